@@ -0,0 +1,195 @@
+"""
+Headless batch scoring of a patient cohort (no PyQt).
+
+Reads a CSV or Parquet cohort with one patient per row:
+
+    age, sex, weight, height, cephalosporin, medications
+
+(``medications`` is the comma-separated text the GUI takes; an ``id`` or
+``patient_id`` column is carried through).  The cohort is cut into chunks that
+worker processes score with the same code the window uses (scoring.Scorer:
+EB overall risk + the per-SOC CatBoost models).  Each worker loads its own
+copy of the models once, so memory grows with ``--workers``.  Results stream
+out as one Parquet part file per chunk, in input order:
+
+    out_dir/part-00000.parquet, part-00001.parquet, ...
+
+with the carried-through columns, generation, overall_percentage, one
+column per SOC (probability in percent) and ``error``: rows that fail
+validation (no age, a sex other than Male/Female, an unknown cephalosporin,
+...) are not scored, get nulls and the reason there, and do not stop the
+run.  Read them back with ``pl.scan_parquet("out_dir/*.parquet")``.
+
+usage:
+    python batch_score.py cohort.parquet out_dir [--workers 4] [--chunk-size 20000]
+                          [--models DIR] [--data DIR]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import polars as pl
+
+from scoring import SIDE_EFFECTS, Scorer, clean_patient, generation_for
+
+# accepted spellings of the input columns
+COLUMN_ALIASES = {
+    "age": ("age", "age_y"),
+    "sex": ("sex", "gender"),
+    "weight": ("weight", "weight_kg"),
+    "height": ("height", "height_cm"),
+    "cephalosporin": ("cephalosporin", "ceph"),
+    "meds": ("medications", "meds", "medication_list"),
+}
+PASSTHROUGH = ("id", "patient_id")
+
+_scorer = None
+
+
+def read_chunks(path, chunk_size):
+    """Yield the cohort as DataFrames of about ``chunk_size`` rows without loading the whole file."""
+    if str(path).lower().endswith(".csv"):
+        reader = pl.read_csv_batched(path, batch_size=chunk_size, infer_schema_length=10000)
+        # the reader's batch size is only a hint; regroup into chunk_size rows
+        pending, n = [], 0
+        while True:
+            batches = reader.next_batches(1)
+            if not batches:
+                break
+            pending.append(batches[0])
+            n += batches[0].height
+            if n >= chunk_size:
+                buf = pl.concat(pending, how="vertical_relaxed")
+                start = 0
+                while n >= chunk_size:
+                    yield buf.slice(start, chunk_size)
+                    start += chunk_size
+                    n -= chunk_size
+                pending = [buf.slice(start)]
+        if n:
+            yield pl.concat(pending, how="vertical_relaxed")
+    else:
+        lf = pl.scan_parquet(path)
+        n = lf.select(pl.len()).collect().item()
+        for start in range(0, n, chunk_size):
+            yield lf.slice(start, chunk_size).collect()
+
+
+def to_records(df):
+    """Raw patient dicts (the keys Scorer.score expects, values as read) from one input chunk."""
+    by_lower = {c.lower(): c for c in df.columns}
+    cols = {}
+    for key, names in COLUMN_ALIASES.items():
+        src = next((by_lower[n] for n in names if n in by_lower), None)
+        cols[key] = df[src].to_list() if src is not None else [None] * df.height
+    return [{key: cols[key][i] for key in COLUMN_ALIASES} for i in range(df.height)]
+
+
+def validate(records):
+    """(clean_patient of each record or None, error message or None) per record."""
+    cleaned, errors = [], []
+    for r in records:
+        try:
+            cleaned.append(clean_patient(r))
+            errors.append(None)
+        except ValueError as e:
+            cleaned.append(None)
+            errors.append(str(e))
+    return cleaned, errors
+
+
+def _init_worker(model_dir, data_dir):
+    global _scorer
+    # processes give the parallelism; keep each one to a single scoring thread
+    _scorer = Scorer(model_dir, data_dir, n_jobs=1)
+
+
+def _score_chunk(df):
+    return score_frame(_scorer, df)
+
+
+def score_frame(scorer, df):
+    """Score one input chunk; returns the output DataFrame (invalid rows unscored, with an error)."""
+    import numpy as np
+
+    records, errors = validate(to_records(df))
+    valid = np.array([r is not None for r in records], dtype=bool)
+    overall, probs = scorer.score([r for r in records if r is not None])
+    by_lower = {c.lower(): c for c in df.columns}
+    out = {by_lower[c]: df[by_lower[c]] for c in PASSTHROUGH if c in by_lower}
+    out["age"] = pl.Series([r and r["age"] for r in records], dtype=pl.Int64)
+    out["sex"] = pl.Series([r and r["sex"] for r in records], dtype=pl.String)
+    out["cephalosporin"] = pl.Series([r and r["cephalosporin"] for r in records], dtype=pl.String)
+    out["generation"] = pl.Series([r and generation_for(r["cephalosporin"]) for r in records], dtype=pl.String)
+
+    def scatter(values):
+        full = np.full(df.height, np.nan)
+        full[valid] = values
+        return pl.Series(full).fill_nan(None)
+
+    out["overall_percentage"] = scatter(overall)
+    position = {soc: j for j, soc in enumerate(scorer.engine.soc_names)}
+    for soc in SIDE_EFFECTS:
+        j = position.get(soc)
+        out[soc] = scatter((probs[:, j] * 100).round(2) if j is not None else 0.0)
+    out["error"] = pl.Series(errors, dtype=pl.String)
+    return pl.DataFrame(out)
+
+
+def run(src, out_dir, workers=None, chunk_size=20000, model_dir=None, data_dir=None, log=sys.stderr):
+    """Score ``src`` into Parquet parts under ``out_dir``; returns (rows, seconds)."""
+    model_dir = model_dir or os.getcwd()
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    os.makedirs(out_dir, exist_ok=True)
+    t0 = time.perf_counter()
+    rows = 0
+
+    def write(part, frame):
+        nonlocal rows
+        frame.write_parquet(os.path.join(out_dir, f"part-{part:05d}.parquet"))
+        rows += frame.height
+        dt = time.perf_counter() - t0
+        print(f"part {part}: {rows:,} rows, {rows / max(dt, 1e-9):,.0f} rows/s", file=log)
+
+    chunks = read_chunks(src, chunk_size)
+    if workers <= 1:
+        _init_worker(model_dir, data_dir)
+        for part, df in enumerate(chunks):
+            write(part, _score_chunk(df))
+        _scorer.close()
+    else:
+        # spawn, not fork: polars' thread pool does not survive a fork
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(model_dir, data_dir)) as pool:
+            # keep a bounded number of chunks in flight and write them back in input order
+            pending = []
+            for part, df in enumerate(chunks):
+                pending.append((part, pool.submit(_score_chunk, df)))
+                if len(pending) >= 2 * workers:
+                    p, fut = pending.pop(0)
+                    write(p, fut.result())
+            for p, fut in pending:
+                write(p, fut.result())
+    return rows, time.perf_counter() - t0
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Score a patient cohort (CSV/Parquet) into Parquet parts.")
+    ap.add_argument("src", help="cohort .csv or .parquet")
+    ap.add_argument("out_dir", help="directory for part-*.parquet")
+    ap.add_argument("--workers", type=int, default=None, help="worker processes (default: core count)")
+    ap.add_argument("--chunk-size", type=int, default=20000, help="rows per chunk / part file")
+    ap.add_argument("--models", default=None, help="folder with models.bundle or catboost.joblib (default: cwd)")
+    ap.add_argument("--data", default=None, help="folder with the risk parquets (default: CEPHALO_DATA_DIR)")
+    args = ap.parse_args(argv)
+    rows, dt = run(args.src, args.out_dir, args.workers, args.chunk_size, args.models, args.data)
+    print(f"Scored {rows:,} patients in {dt:.1f}s ({rows / max(dt, 1e-9):,.0f} rows/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,302 @@
+"""
+Benchmarks of the prediction and data hot paths, with a stored baseline.
+
+Each stage is timed on fixtures drawn from the shipped data: patients sampled
+from reports_plus (age, sex, weight, height, cephalosporin) with 1-5
+medications drawn from the model's feature vocabulary, a fifth of them
+misspelt so the fuzzy tiers of the matcher run too.  Everything is seeded, so
+two runs time the same work.
+
+    risk.*      pop_df, ea_df, exppermil, expo, p_ea_hibrido_simple and wraper
+                (the chain behind compute_overall_probability)
+    meds.parse  parse_med_input_to_vector (MedMatcher.match_text) x 1 / 100 / 10k
+    model.*     probability_model: overall risk + predict_proba + summarize x 1 / 100 / 10k
+                (only with models: models.bundle or catboost.joblib in --models)
+    store.*     PatientStore: save_prediction, BatchWriter import, loading a patient back
+    ohe.*       ReportEncoder over the PT / SOC / indication blocks of data/cephalosporines_clean
+
+Results are written as JSON (median / min / mean seconds per call, and per
+item for batches) and compared with the baseline: a stage whose fastest run
+got slower by more than --threshold is a regression and the exit status is 1.
+
+    python bench.py [--models DIR] [--out results.json] [--baseline bench_baseline.json]
+                    [--save-baseline] [--threshold 1.5] [--quick]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+HERE = Path(__file__).resolve().parent
+BASELINE = HERE / "bench_baseline.json"
+CLEAN_DIR = HERE.parent / "data" / "cephalosporines_clean"
+BATCH_SIZES = (1, 100, 10_000)
+RESULTS_VERSION = 1
+
+
+# ---------------- timing ----------------
+def measure(fn, repeat=5, min_time=0.0, items=1):
+    """
+    Seconds per call of ``fn()`` after one warm-up call: median, min and mean
+    over ``repeat`` calls (more while their total is under ``min_time``).
+    """
+    fn()
+    samples = []
+    while len(samples) < repeat or sum(samples) < min_time:
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+        if len(samples) >= 1000:
+            break
+    median = statistics.median(samples)
+    return {"median": median, "min": min(samples), "mean": statistics.fmean(samples),
+            "repeat": len(samples), "items": items, "per_item": median / items}
+
+
+class Suite:
+    def __init__(self, quick=False, log=sys.stderr):
+        self.quick = quick
+        self.log = log
+        self.results = {}
+        self.skipped = {}
+
+    def time(self, name, fn, repeat=5, min_time=0.2, items=1):
+        if self.quick:
+            repeat, min_time = max(1, repeat // 3), 0.0
+        r = self.results[name] = measure(fn, repeat, min_time, items)
+        print(f"{name:<32} {r['median'] * 1e3:10.3f} ms  ({r['repeat']} runs)", file=self.log)
+        return r
+
+    def skip(self, name, reason):
+        self.skipped[name] = reason
+        print(f"{name:<32} skipped: {reason}", file=self.log)
+
+
+# ---------------- fixtures ----------------
+def _misspell(name, rng):
+    if len(name) < 6:
+        return name
+    i = int(rng.integers(1, len(name) - 1))
+    return name[:i] + name[i + 1:]
+
+
+def patients(dfs, med_names, n, seed=0):
+    """``n`` patient dicts sampled from reports_plus, meds as comma-separated text."""
+    import polars as pl
+    from scoring import GEN_MAP
+
+    rng = np.random.default_rng(seed)
+    # only cephalosporins the EB risk has a generation for (as offered by the GUI)
+    other = [name for name, gen in GEN_MAP.items() if gen == "other"]
+    reports = dfs["reports_plus"].filter(~pl.col("ACTIVE_INGREDIENT_NAME").is_in(other))
+    rows = reports[rng.integers(0, reports.height, n)]
+    age = rows["AGE_Y"].str.extract(r"(\d+)", 1).cast(int, strict=False).fill_null(45).to_numpy()
+    out = []
+    for i, r in enumerate(rows.iter_rows(named=True)):
+        meds = [str(m) for m in rng.choice(med_names, int(rng.integers(1, 6)), replace=False)]
+        if rng.random() < 0.2 and meds:
+            meds[0] = _misspell(meds[0], rng)
+        out.append({
+            "name": f"bench {i}", "age": int(age[i]), "sex": r["GENDER_ENG"] or "Female",
+            "weight": r["WEIGHT_KG"], "height": r["HEIGHT_CM"],
+            "cephalosporin": r["ACTIVE_INGREDIENT_NAME"], "meds": ", ".join(meds),
+        })
+    return out
+
+
+# ---------------- stages ----------------
+def bench_risk(suite, dfs):
+    import risk_model
+
+    sex, gen = "Female", "1st gen"
+    pop = risk_model.pop_df(dfs, sex)
+    ea = risk_model.ea_df(dfs, sex, gen)
+    merged = risk_model.juntar_pop_ea(pop, ea)
+    presc = risk_model.exppermil(dfs, gen)
+    expos = risk_model.expo(presc, merged)
+    suite.time("risk.pop_df", lambda: risk_model.pop_df(dfs, sex), repeat=50)
+    suite.time("risk.ea_df", lambda: risk_model.ea_df(dfs, sex, gen), repeat=20)
+    suite.time("risk.exppermil", lambda: risk_model.exppermil(dfs, gen), repeat=50)
+    suite.time("risk.expo", lambda: risk_model.expo(presc, merged), repeat=50)
+    suite.time("risk.p_ea_hibrido_simple", lambda: risk_model.p_ea_hibrido_simple(expos), repeat=50)
+    suite.time("risk.wraper", lambda: risk_model.wraper(dfs, gender=sex, generation=gen, age=40), repeat=20)
+
+
+def bench_meds(suite, matcher, cohort):
+    for n in BATCH_SIZES:
+        texts = [p["meds"] for p in cohort[:n]]
+        suite.time(f"meds.parse[{n}]", lambda: [{m.name: 1 for m in matcher.match_text(t)} for t in texts],
+                   repeat=20 if n < 10_000 else 3, items=n)
+
+
+def bench_model(suite, engine, matcher, dfs, risk_table, cohort):
+    from scoring import generation_for, overall_percentage, summarize
+
+    def probability_model(batch):
+        overall = [overall_percentage(dfs, risk_table, p["sex"], generation_for(p["cephalosporin"]), p["age"])
+                   for p in batch]
+        probs = engine.predict_proba(batch)
+        return overall, [summarize(engine.soc_names, row) for row in probs]
+
+    for n in BATCH_SIZES:
+        batch = [dict(p, meds={m.name: 1 for m in matcher.match_text(p["meds"])}) for p in cohort[:n]]
+        suite.time(f"model.probability_model[{n}]", lambda: probability_model(batch),
+                   repeat=10 if n < 10_000 else 3, items=n)
+
+
+def bench_store(suite, cohort, summary):
+    from patient_store import PatientStore
+
+    meds = [[m.strip() for m in p["meds"].split(",") if m.strip()] for p in cohort]
+    with tempfile.TemporaryDirectory() as tmp:
+        store = PatientStore(os.path.join(tmp, "bench.db"))
+        try:
+            one = iter(range(10 ** 9))
+            suite.time("store.save_prediction", lambda: store.save_prediction(
+                cohort[next(one) % len(cohort)], meds[0], summary), repeat=50)
+
+            n = min(len(cohort), 1000)
+
+            def import_batch():
+                with store.batch_writer() as writer:
+                    for p, m in zip(cohort[:n], meds):
+                        writer.add(p, m, summary)
+            suite.time(f"store.batch_import[{n}]", import_batch, repeat=5, items=n)
+
+            ids = [r[0] for r in store.conn.execute("SELECT id FROM patients ORDER BY id DESC LIMIT 100")]
+
+            def load_patients():
+                for pid in ids:
+                    store.patient_row(pid), store.medications(pid), store.soc_results(pid)
+            suite.time(f"store.load_patient[{len(ids)}]", load_patients, repeat=10, items=len(ids))
+        finally:
+            store.close()
+
+
+def bench_ohe(suite, clean_dir):
+    import polars as pl
+    from encoder import ReportEncoder
+
+    blocks = {"pt": ("reactions", "PT_NAME_ENG"), "soc": ("reactions", "SOC_NAME_ENG"),
+              "indication": ("report_drug_indication", "INDICATION_NAME_ENG")}
+    for block, (table, column) in blocks.items():
+        path = Path(clean_dir) / f"{table}.parquet"
+        if not path.exists():
+            suite.skip(f"ohe.{block}", f"{path} not found")
+            continue
+        df = pl.read_parquet(path, columns=["REPORT_ID", column])
+        suite.time(f"ohe.{block}", lambda: ReportEncoder(column).fit_transform(df), repeat=5, items=df.height)
+
+
+# ---------------- results ----------------
+def metadata():
+    import polars as pl
+
+    return {"version": RESULTS_VERSION, "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(), "platform": platform.platform(),
+            "machine": platform.machine(), "cpus": os.cpu_count(),
+            "numpy": np.__version__, "polars": pl.__version__}
+
+
+def compare(results, baseline, threshold):
+    """
+    {stage: {"ratio", "status"}} against ``baseline`` (regression / improved /
+    ok / new).  Compares the fastest run, which is far less noisy than the
+    median on a shared machine.
+    """
+    out = {}
+    for name, r in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            out[name] = {"ratio": None, "status": "new"}
+            continue
+        ratio = r["min"] / base["min"] if base["min"] > 0 else float("inf")
+        status = "regression" if ratio > threshold else "improved" if ratio < 1 / threshold else "ok"
+        out[name] = {"ratio": round(ratio, 3), "status": status}
+    return out
+
+
+def run(models_dir=None, data_dir=None, clean_dir=CLEAN_DIR, quick=False, log=sys.stderr):
+    """Run every stage; returns the results document (without a comparison)."""
+    import risk_model
+    from med_matcher import MedMatcher
+    from scoring import SIDE_EFFECTS, load_feature_names, load_ingredient_names, load_models, load_risk_data
+
+    suite = Suite(quick, log)
+    dfs, risk_table = load_risk_data(data_dir)
+    feature_names = load_feature_names(models_dir or str(HERE)) or []
+    med_names = list(feature_names[4:]) or load_ingredient_names()
+    cohort = patients(dfs, med_names, max(BATCH_SIZES), seed=0)
+    summary = {soc: {"prob": 12.5, "severity": "Not Probable"} for soc in SIDE_EFFECTS}
+
+    if dfs:
+        bench_risk(suite, dfs)
+    else:
+        suite.skip("risk", f"no parquet files in {data_dir or risk_model.DATA_DIR}")
+    matcher = MedMatcher(feature_names, load_ingredient_names())
+    bench_meds(suite, matcher, cohort)
+
+    models_dir = models_dir or str(HERE)
+    try:
+        engine = load_models(models_dir)
+    except Exception as e:
+        suite.skip("model", f"no models in {models_dir} ({e})")
+    else:
+        try:
+            bench_model(suite, engine, matcher, dfs, risk_table, cohort)
+        finally:
+            engine.close()
+
+    bench_store(suite, cohort, summary)
+    bench_ohe(suite, clean_dir)
+    return {"meta": dict(metadata(), quick=quick, models=bool("model" not in suite.skipped)),
+            "results": suite.results, "skipped": suite.skipped}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Time the prediction and data pipelines against a stored baseline.")
+    ap.add_argument("--models", default=None, help="folder with models.bundle or catboost.joblib (default: here)")
+    ap.add_argument("--data", default=None, help="risk-model parquet folder (default: CEPHALO_DATA_DIR / data/pred_data)")
+    ap.add_argument("--clean", default=str(CLEAN_DIR), help="data/cephalosporines_clean for the OHE stages")
+    ap.add_argument("--out", default=None, help="write the results JSON here (default: stdout)")
+    ap.add_argument("--baseline", default=str(BASELINE), help="baseline results to compare with")
+    ap.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    ap.add_argument("--threshold", type=float, default=1.5, help="slowdown ratio that counts as a regression")
+    ap.add_argument("--quick", action="store_true", help="fewer repetitions (smoke run)")
+    args = ap.parse_args(argv)
+
+    doc = run(args.models, args.data, args.clean, args.quick)
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        doc["baseline"] = {"path": args.baseline, "created": baseline.get("meta", {}).get("created"),
+                           "threshold": args.threshold}
+        doc["comparison"] = compare(doc["results"], baseline, args.threshold)
+        regressions = [name for name, c in doc["comparison"].items() if c["status"] == "regression"]
+        for name, c in doc["comparison"].items():
+            if c["status"] != "ok":
+                print(f"{name:<32} {c['status']}" + (f" x{c['ratio']}" if c["ratio"] else ""), file=sys.stderr)
+
+    text = json.dumps(doc, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"Saved baseline {args.baseline}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
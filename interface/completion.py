@@ -0,0 +1,66 @@
+"""
+Completion model for the medication QLineEdit.
+
+The completer used to hold the whole medication list in a QStringListModel,
+which was re-set and re-filtered (MatchContains) on every keystroke.  Here
+the popup only ever holds the top-k suggestions computed by ``MedMatcher``;
+rows are swapped with row insert/remove notifications instead of a model
+reset, and the prefix range of the previous keystroke narrows the next search.
+"""
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, Qt
+
+from med_matcher import normalize
+
+
+class MedCompletionModel(QAbstractListModel):
+    def __init__(self, matcher=None, k=15, parent=None):
+        super().__init__(parent)
+        self.matcher = matcher
+        self.k = k
+        self._rows = []
+        self._last_key = None
+        self._range = None
+
+    def set_matcher(self, matcher):
+        self.matcher = matcher
+        self._last_key = None
+        self._range = None
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or not (0 <= index.row() < len(self._rows)):
+            return None
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return self._rows[index.row()]
+        return None
+
+    def update_token(self, token):
+        """Recompute the suggestions for the token being typed; returns the number of rows."""
+        key = normalize(token)
+        if self.matcher is None or not key:
+            self._set_rows([])
+            self._last_key = None
+            return 0
+        within = self._range if self._last_key and key.startswith(self._last_key) else None
+        names, self._range = self.matcher.suggest(key, self.k, within)
+        self._last_key = key
+        self._set_rows(names)
+        return len(names)
+
+    def _set_rows(self, names):
+        # keep the common leading rows, replace only the tail
+        keep = 0
+        for a, b in zip(self._rows, names):
+            if a != b:
+                break
+            keep += 1
+        if keep < len(self._rows):
+            self.beginRemoveRows(QModelIndex(), keep, len(self._rows) - 1)
+            del self._rows[keep:]
+            self.endRemoveRows()
+        if keep < len(names):
+            self.beginInsertRows(QModelIndex(), keep, len(names) - 1)
+            self._rows.extend(names[keep:])
+            self.endInsertRows()
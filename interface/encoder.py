@@ -0,0 +1,221 @@
+"""
+Report-level one-hot encoding into sparse matrices over a frozen vocabulary.
+
+``05 OHE.ipynb`` built its PT / SOC / indication / ingredient / generation
+blocks as dense polars pivots (``report_ohe``), zero-filled and thousands of
+columns wide, and the model's 9,094 input columns travel as
+feature_names.csv.  Here:
+
+* ``Vocabulary`` is the column name <-> index map, saved as a small .npz
+  (names as UTF-8 bytes + offsets, a version and a fingerprint).  It only
+  ever grows at the end (``extend``), so a matrix or model built on an older
+  version keeps its column indices;
+* ``ReportEncoder`` turns long (REPORT_ID, category) rows into an
+  (n_reports, len(vocabulary)) CSR matrix: 1 where the report has the
+  category (or the number of rows with ``counts``).  ``fit`` learns the
+  vocabulary, ``transform`` encodes new reports against it as it is and
+  reports how many categories it did not know;
+* ``save_matrix`` / ``load_matrix`` persist a matrix with its REPORT_IDs and
+  the fingerprint of the vocabulary it was built with.
+
+Training (scripts/ohe.py) and the app (scoring.load_models, features.npz)
+read the same vocabulary files.
+
+    python encoder.py feature_names.csv features.npz    # vocabulary from a name-column CSV
+"""
+import sys
+from collections import namedtuple
+
+import numpy as np
+import scipy.sparse as sp
+
+from model_bundle import feature_hash, load_name_column
+
+VOCAB_FORMAT = 1
+FEATURES_VOCAB = "features.npz"
+
+EncodedReports = namedtuple("EncodedReports", ["keys", "matrix", "unknown"])
+
+
+class VocabularyError(ValueError):
+    """A vocabulary or encoded matrix file is unreadable or does not match."""
+
+
+class Vocabulary:
+    """Versioned, append-only list of column names."""
+
+    def __init__(self, names, version=1):
+        self.names = [str(n) for n in names]
+        self.position = {}
+        for i, n in enumerate(self.names):
+            if n in self.position:
+                raise VocabularyError(f"duplicate column name {n!r}")
+            self.position[n] = i
+        self.version = int(version)
+        self.fingerprint = feature_hash(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.position
+
+    def __repr__(self):
+        return f"Vocabulary({len(self)} columns, version {self.version}, {self.fingerprint[:12]})"
+
+    def extend(self, names):
+        """This vocabulary with the unseen ``names`` appended (a new version), or itself if there are none."""
+        new = [n for n in dict.fromkeys(str(n) for n in names) if n not in self.position]
+        return Vocabulary(self.names + new, self.version + 1) if new else self
+
+    def starts_with(self, fingerprint, n):
+        """True if the first ``n`` columns are the vocabulary with ``fingerprint`` (an older version of this one)."""
+        return n <= len(self) and feature_hash(self.names[:n]) == fingerprint
+
+    # ---------------- persistence ----------------
+    def save(self, path):
+        encoded = [n.encode("utf-8") for n in self.names]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f,
+                format=np.int64(VOCAB_FORMAT),
+                version=np.int64(self.version),
+                fingerprint=np.frombuffer(self.fingerprint.encode("ascii"), dtype=np.uint8),
+                names=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+                offsets=offsets,
+            )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as z:
+            if int(z["format"]) != VOCAB_FORMAT:
+                raise VocabularyError(f"{path}: vocabulary format {int(z['format'])}, expected {VOCAB_FORMAT}")
+            blob, offsets = z["names"].tobytes(), z["offsets"]
+            names = [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+            vocab = cls(names, int(z["version"]))
+            recorded = z["fingerprint"].tobytes().decode("ascii")
+        if vocab.fingerprint != recorded:
+            raise VocabularyError(f"{path}: column names do not match their recorded fingerprint")
+        return vocab
+
+    @classmethod
+    def from_csv(cls, path, version=1):
+        """From a single-column CSV with a header row (feature_names.csv)."""
+        return cls(load_name_column(path), version)
+
+
+class ReportEncoder:
+    """
+    One categorical ``column`` of a long table encoded per ``key`` (report).
+    ``counts``: cells hold how many rows carry the category instead of 1.
+    """
+
+    def __init__(self, column, key="REPORT_ID", vocabulary=None, counts=False):
+        self.column = column
+        self.key = key
+        self.vocabulary = vocabulary
+        self.counts = counts
+
+    def _categories(self, df):
+        # first-appearance order, like the columns of the notebook's pivots
+        return df.get_column(self.column).drop_nulls().unique(maintain_order=True).to_list()
+
+    def fit(self, df):
+        """Learn the vocabulary from the categories in ``df``."""
+        self.vocabulary = Vocabulary(self._categories(df))
+        return self
+
+    def partial_fit(self, df):
+        """Append the categories of ``df`` the vocabulary lacks (bumps its version if there are any)."""
+        if self.vocabulary is None:
+            return self.fit(df)
+        self.vocabulary = self.vocabulary.extend(self._categories(df))
+        return self
+
+    def transform(self, df, keys=None):
+        """
+        EncodedReports(keys, CSR matrix, unknown) for ``df`` against the
+        current vocabulary.  Rows follow ``keys`` (default: the sorted keys in
+        ``df``; keys without rows stay empty); ``unknown`` counts the distinct
+        categories left out because the vocabulary does not have them.
+        """
+        import polars as pl
+
+        if self.vocabulary is None:
+            raise VocabularyError("encoder has no vocabulary; fit it or pass one")
+        pairs = df.select(self.key, pl.col(self.column).cast(pl.String)).drop_nulls()
+        if keys is None:
+            keys = pairs.get_column(self.key).unique().sort().to_numpy()
+        keys = np.asarray(keys)
+        n_rows, n_cols = len(keys), len(self.vocabulary)
+
+        # category codes: position in the vocabulary through an Enum cast (null = unknown)
+        codes = pairs.get_column(self.column).cast(pl.Enum(self.vocabulary.names), strict=False)
+        unknown = pairs.filter(codes.is_null()).get_column(self.column).n_unique()
+        # row codes: position of the key in ``keys`` (any order), -1 if absent
+        values = pairs.get_column(self.key).to_numpy()
+        rows = np.full(len(values), -1, dtype=np.int64)
+        if n_rows:
+            order = np.argsort(keys, kind="stable")
+            pos = np.minimum(np.searchsorted(keys[order], values), n_rows - 1)
+            hit = keys[order][pos] == values
+            rows[hit] = order[pos[hit]]
+
+        cells = (pl.DataFrame({"_row": rows, "_col": codes.to_physical().cast(pl.Int64)})
+                 .filter((pl.col("_row") >= 0) & pl.col("_col").is_not_null())
+                 .group_by("_row", "_col").len())
+        data = cells["len"].cast(pl.Float32).to_numpy() if self.counts else np.ones(cells.height, np.float32)
+        matrix = sp.csr_matrix((data, (cells["_row"].to_numpy(), cells["_col"].to_numpy())),
+                               shape=(n_rows, n_cols), dtype=np.float32)
+        return EncodedReports(keys, matrix, unknown)
+
+    def fit_transform(self, df, keys=None):
+        return self.fit(df).transform(df, keys)
+
+
+# ---------------- encoded matrices ----------------
+def save_matrix(path, encoded, vocabulary):
+    """Write EncodedReports (CSR + keys) with the fingerprint/version of ``vocabulary``."""
+    m = encoded.matrix.tocsr()
+    with open(path, "wb") as f:
+        np.savez_compressed(
+            f,
+            keys=np.asarray(encoded.keys),
+            data=m.data, indices=m.indices, indptr=m.indptr,
+            shape=np.array(m.shape, dtype=np.int64),
+            vocab_fingerprint=np.frombuffer(vocabulary.fingerprint.encode("ascii"), dtype=np.uint8),
+            vocab_version=np.int64(vocabulary.version),
+        )
+
+
+def load_matrix(path, vocabulary):
+    """
+    (keys, CSR matrix) of a ``save_matrix`` file, as wide as ``vocabulary``.
+    A matrix built on an older version of the vocabulary is widened with
+    empty columns; any other vocabulary raises VocabularyError.
+    """
+    with np.load(path, allow_pickle=False) as z:
+        shape = tuple(int(s) for s in z["shape"])
+        fingerprint = z["vocab_fingerprint"].tobytes().decode("ascii")
+        if fingerprint != vocabulary.fingerprint and not vocabulary.starts_with(fingerprint, shape[1]):
+            raise VocabularyError(
+                f"{path} was encoded with vocabulary version {int(z['vocab_version'])} "
+                f"({fingerprint[:12]}), which {vocabulary!r} does not extend")
+        matrix = sp.csr_matrix((z["data"], z["indices"], z["indptr"]), shape=(shape[0], len(vocabulary)))
+        return z["keys"], matrix
+
+
+def main(argv):
+    if len(argv) != 3:
+        print("usage: python encoder.py names.csv out.npz")
+        return 2
+    vocab = Vocabulary.from_csv(argv[1])
+    vocab.save(argv[2])
+    print(f"Wrote {argv[2]}: {vocab!r}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,186 @@
+"""
+Adverse-event age histograms of reports_plus, parsed once.
+
+``risk_model.ea_df`` used to cast ``AGE_Y`` to text, pull the number out with
+``str.extract``, cast it back and lowercase ``gen`` / ``GENDER_ENG`` on
+every row of reports_plus for every prediction, only to ``np.histogram``
+the ages into 100 one-year bins.  ``EventAges`` does that parsing once:
+per report a clean integer age (-1 when missing or outside 0-100), a sex
+code (``SEXES``), a generation code (index into ``generations``, -1 when
+missing) and the year, plus the (sex, generation, age bin) count cube of
+all of them, so ``histogram`` is a sum over a stored 3 x G x 100 array.  Filters
+on years go back to the per-report arrays (one ``np.bincount``).
+
+The arrays are stored as event_ages.npz next to the risk data, tagged with
+a hash of the parquet they were parsed from; a refreshed reports_plus
+makes ``load`` return None and the histograms are rebuilt.
+
+Build offline with (any table with AGE_Y and GENDER_ENG works, e.g. the
+full reports table):
+    python event_ages.py [data_dir] [--source reports_plus.parquet] [--out event_ages.npz]
+"""
+import argparse
+import hashlib
+import sys
+from pathlib import Path
+
+import numpy as np
+
+SEXES = ("female", "male", "other")  # lowercased GENDER_ENG; "other" = anything else or missing
+N_BINS = 100  # np.histogram(ages, bins=np.arange(0, 101)): one bin per year, 99 and 100 share the last
+FILE_NAME = "event_ages.npz"
+SOURCE = "reports_plus"
+VERSION = 1
+
+
+def file_hash(path):
+    """sha256 of a file's bytes ("" if it does not exist)."""
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    except FileNotFoundError:
+        return ""
+    return h.hexdigest()
+
+
+def parse(df):
+    """(age, sex, generation, year, generation names) arrays of a reports frame (AGE_Y, GENDER_ENG[, gen, YEAR])."""
+    import polars as pl
+
+    n = df.height
+    age = (
+        df.get_column("AGE_Y").cast(pl.Utf8).str.extract(r"(\d+)", 1).cast(pl.Int64, strict=False)
+        .to_frame().select(pl.when(pl.col("AGE_Y").is_between(0, 100)).then(pl.col("AGE_Y")).otherwise(-1))
+        .to_series().to_numpy().astype(np.int8)
+    )
+    sex = (
+        df.get_column("GENDER_ENG").cast(pl.Utf8).str.to_lowercase()
+        .replace_strict({s: i for i, s in enumerate(SEXES[:-1])}, default=len(SEXES) - 1, return_dtype=pl.Int8)
+        .to_numpy()
+    )
+    if "gen" in df.columns:
+        gen_text = df.get_column("gen").cast(pl.Utf8).str.to_lowercase()
+        names = tuple(sorted(gen_text.drop_nulls().unique().to_list()))
+    else:
+        names = ()
+    if names:
+        gen = gen_text.cast(pl.Enum(names)).to_physical().cast(pl.Int8).fill_null(-1).to_numpy()
+    else:
+        gen = np.full(n, -1, dtype=np.int8)
+    if "YEAR" in df.columns:
+        year = df.get_column("YEAR").cast(pl.Int16).fill_null(-1).to_numpy()
+    else:
+        year = np.full(n, -1, dtype=np.int16)
+    return age, sex, gen, year, names
+
+
+class EventAges:
+    """Parsed report ages with their (sex, generation, age bin) histogram cube."""
+
+    def __init__(self, age, sex, generation, year, generations, source_hash="", counts=None):
+        self.age = np.asarray(age, dtype=np.int8)
+        self.sex = np.asarray(sex, dtype=np.int8)
+        self.generation = np.asarray(generation, dtype=np.int8)
+        self.year = np.asarray(year, dtype=np.int16)
+        self.generations = tuple(str(g) for g in generations)
+        self.source_hash = source_hash
+        # generation axis: the named generations, then "no generation"
+        shape = (len(SEXES), len(self.generations) + 1, N_BINS)
+        if counts is None:
+            counts = self._bincount(np.ones(self.age.size, dtype=bool))
+        self.counts = np.asarray(counts, dtype=np.int64).reshape(shape)
+
+    def _cell(self, keep):
+        keep = keep & (self.age >= 0)
+        gen = np.where(self.generation[keep] >= 0, self.generation[keep], len(self.generations)).astype(np.int64)
+        bins = np.minimum(self.age[keep], N_BINS - 1).astype(np.int64)
+        return (self.sex[keep].astype(np.int64) * (len(self.generations) + 1) + gen) * N_BINS + bins
+
+    def _bincount(self, keep):
+        return np.bincount(self._cell(keep), minlength=len(SEXES) * (len(self.generations) + 1) * N_BINS)
+
+    def __len__(self):
+        return self.age.size
+
+    def histogram(self, gender=None, generations=None, years=None):
+        """
+        (100,) event counts per age bin, like ``np.histogram(ages, np.arange(0, 101))``
+        over the reports of ``gender`` (None: all), of any of ``generations``
+        (names, case-insensitive; None: all, including reports without one) and
+        received in ``years`` (None: all).
+        """
+        counts = self.counts
+        if years is not None:
+            keep = np.isin(self.year, np.fromiter(years, dtype=np.int64))
+            counts = self._bincount(keep).reshape(counts.shape)
+        if gender is not None:
+            g = gender.lower()
+            counts = counts[[SEXES.index(g) if g in SEXES[:-1] else len(SEXES) - 1]]
+        if generations is not None:
+            wanted = {g.lower() for g in generations}
+            counts = counts[:, [i for i, g in enumerate(self.generations) if g in wanted]]
+        return counts.sum(axis=(0, 1))
+
+    # ---------------- construction / persistence ----------------
+    @classmethod
+    def from_frame(cls, df, source_hash=""):
+        age, sex, gen, year, names = parse(df)
+        return cls(age, sex, gen, year, names, source_hash)
+
+    @classmethod
+    def from_parquet(cls, path):
+        """Parse the columns it needs from a parquet file, tagged with the file's hash."""
+        import polars as pl
+
+        lf = pl.scan_parquet(path)
+        columns = [c for c in ("AGE_Y", "GENDER_ENG", "gen", "YEAR") if c in lf.collect_schema()]
+        return cls.from_frame(lf.select(columns).collect(), file_hash(path))
+
+    def save(self, path):
+        np.savez_compressed(path, version=np.array(VERSION), sexes=np.array(SEXES), age=self.age, sex=self.sex,
+                            generation=self.generation, year=self.year, generations=np.array(self.generations, dtype=str),
+                            counts=self.counts, source_hash=np.array(self.source_hash))
+
+    @classmethod
+    def load(cls, path, source_hash=None):
+        """The stored arrays, or None if missing, from another version or parsed from other data than ``source_hash``."""
+        try:
+            with np.load(path) as z:
+                if int(z["version"]) != VERSION or tuple(z["sexes"]) != SEXES:
+                    return None
+                if source_hash is not None and str(z["source_hash"]) != source_hash:
+                    return None
+                return cls(z["age"], z["sex"], z["generation"], z["year"], tuple(z["generations"]),
+                           str(z["source_hash"]), z["counts"])
+        except (FileNotFoundError, KeyError, ValueError):
+            return None
+
+
+def main(argv=None):
+    import time
+
+    import risk_model
+
+    ap = argparse.ArgumentParser(description="Parse report ages once and store their histograms.")
+    ap.add_argument("data_dir", nargs="?", type=Path, default=risk_model.DATA_DIR,
+                    help="folder the risk model reads")
+    ap.add_argument("--source", type=Path, help=f"reports parquet (default: DATA_DIR/{SOURCE}.parquet)")
+    ap.add_argument("--out", type=Path, help=f"output file (default: DATA_DIR/{FILE_NAME})")
+    args = ap.parse_args(argv)
+
+    source = args.source or args.data_dir / f"{SOURCE}.parquet"
+    out = args.out or args.data_dir / FILE_NAME
+    t0 = time.perf_counter()
+    ages = EventAges.from_parquet(source)
+    t1 = time.perf_counter()
+    ages.save(out)
+    print(f"Parsed {len(ages):,} reports of {source} in {t1 - t0:.2f}s "
+          f"({int(ages.counts.sum()):,} with an age; generations {list(ages.generations)})")
+    print(f"Saved {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+Sparse representation of the model input.
+
+feature_names.csv has 9,094 columns and almost all of them are medication
+indicator flags, so a patient only ever sets a handful of them.  A patient is
+encoded once into a ``SparseRow`` (column indices + values) and batches of rows
+become a scipy CSR matrix.  CatBoost scores CSR input directly; other backends
+can scatter the rows into a small reusable dense block (see ``densify``).
+"""
+from collections import namedtuple
+
+import numpy as np
+import scipy.sparse as sp
+
+SparseRow = namedtuple("SparseRow", ["indices", "values"])
+
+
+def iter_meds(meds):
+    """Accept a list of names or the legacy {name: 0/1} dict and yield the names in use."""
+    if not meds:
+        return
+    if isinstance(meds, dict):
+        for name, used in meds.items():
+            if used == 1:
+                yield name
+    else:
+        yield from meds
+
+
+class FeatureIndex:
+    """Column name <-> index map for the model input space."""
+
+    DEMOGRAPHIC_COLUMNS = ("AGE_Y", "WEIGHT_KG", "HEIGHT_CM", "GENDER_CODE")
+
+    def __init__(self, feature_names):
+        self.names = [str(f).strip() for f in feature_names]
+        self.position = {f: i for i, f in enumerate(self.names)}
+        # lowercase name -> its columns: meds match case-insensitively but
+        # otherwise exactly, like the notebook; punctuation/spacing variants
+        # ("gentamicin, sulfate" / "gentamicin sulfate") stay separate columns
+        self._by_lower = {}
+        for i, f in enumerate(self.names):
+            self._by_lower.setdefault(f.lower(), []).append(i)
+        self.demographic = {c: self.position[c] for c in self.DEMOGRAPHIC_COLUMNS if c in self.position}
+
+    def __len__(self):
+        return len(self.names)
+
+    def columns_for(self, name):
+        """Columns whose name equals ``name`` up to case (empty if none)."""
+        return self._by_lower.get(str(name).strip().lower(), [])
+
+    def encode(self, patient):
+        """
+        patient: dict with keys age, sex, weight, height and meds
+        (list of names or {name: 0/1}). Returns a SparseRow.
+        """
+        cols = {}
+        demo = self.demographic
+        if "AGE_Y" in demo:
+            cols[demo["AGE_Y"]] = patient.get("age") or 0
+        if "WEIGHT_KG" in demo:
+            cols[demo["WEIGHT_KG"]] = patient.get("weight") or 0
+        if "HEIGHT_CM" in demo:
+            cols[demo["HEIGHT_CM"]] = patient.get("height") or 0
+        if "GENDER_CODE" in demo:
+            cols[demo["GENDER_CODE"]] = 1 if str(patient.get("sex", "")).lower() == "male" else 0
+        for med in iter_meds(patient.get("meds")):
+            for c in self.columns_for(med):
+                cols[c] = 1
+        # zeros are implicit
+        idx = np.fromiter((c for c, v in cols.items() if v), dtype=np.int32)
+        idx.sort()
+        vals = np.fromiter((cols[c] for c in idx), dtype=np.float32, count=idx.size)
+        return SparseRow(idx, vals)
+
+
+def rows_to_csr(rows, n_features):
+    """Stack SparseRows into an (N, n_features) float32 CSR matrix."""
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    for r, row in enumerate(rows):
+        indptr[r + 1] = indptr[r] + row.indices.size
+    indices = np.concatenate([r.indices for r in rows]) if rows else np.empty(0, np.int32)
+    values = np.concatenate([r.values for r in rows]) if rows else np.empty(0, np.float32)
+    return sp.csr_matrix((values, indices, indptr), shape=(len(rows), n_features), dtype=np.float32)
+
+
+def densify(x, out):
+    """Write the rows of CSR ``x`` into the zero-filled dense block ``out`` (shape must match)."""
+    out.fill(0.0)
+    x.toarray(out=out)
+    return out
+
+
+def csr_from_parquet(path, feature_names, columns_per_batch=512):
+    """
+    Read the model features of a wide parquet (e.g. pivoted_full_data.parquet)
+    into a CSR matrix without materialising the dense frame: columns are read
+    a few hundred at a time and only their non-zero cells are kept.
+    Features missing from the file stay all-zero; nulls count as zero.
+    """
+    import polars as pl
+
+    index = feature_names if isinstance(feature_names, FeatureIndex) else FeatureIndex(feature_names)
+    available = set(pl.read_parquet_schema(path))
+    wanted = [f for f in index.names if f in available]
+
+    n_rows = None
+    rows, cols, vals = [], [], []
+    for start in range(0, len(wanted), columns_per_batch):
+        chunk = wanted[start:start + columns_per_batch]
+        block = pl.read_parquet(path, columns=chunk)
+        n_rows = block.height
+        for name in chunk:
+            col = block[name].fill_null(0).cast(pl.Float32).to_numpy()
+            nz = np.flatnonzero(col)
+            if nz.size:
+                rows.append(nz.astype(np.int64))
+                cols.append(np.full(nz.size, index.position[name], dtype=np.int32))
+                vals.append(col[nz])
+        del block
+
+    if n_rows is None:
+        n_rows = pl.scan_parquet(path).select(pl.len()).collect().item()
+    if not rows:
+        return sp.csr_matrix((n_rows, len(index)), dtype=np.float32)
+    coo = sp.coo_matrix(
+        (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(n_rows, len(index)), dtype=np.float32,
+    )
+    return coo.tocsr()
@@ -0,0 +1,125 @@
+"""
+Batched inference for the per-SOC CatBoost models.
+
+The GUI used to build a 1 x 9094 pandas DataFrame for every prediction and
+call ``predict_proba`` on each model one after the other.  ``SOCInferenceEngine``
+scores N patients at once against every SOC model: patients are encoded as
+sparse rows (see features.py) and the models are evaluated in parallel on a
+thread pool (CatBoost releases the GIL while predicting).  Backends that cannot
+take sparse input get the rows scattered into one preallocated float32 block
+that is reused between calls.  The result is an N x n_soc probability array in
+SOC order.
+"""
+import inspect
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from features import FeatureIndex, densify, rows_to_csr
+from telemetry import span
+
+
+class SOCInferenceEngine:
+    """
+    Scores batches of patients against all SOC models.
+
+    models: dict SOC name -> fitted classifier exposing ``predict_proba``.
+    feature_names: model input columns, in training order (feature_names.csv).
+    soc_names: output order (soc_columns.csv). Defaults to the models' order.
+    n_jobs: worker threads used to run the models; defaults to the core count.
+    chunk_size: rows scored per call when predicting large CSR batches.
+    sparse: feed CSR to the models (default: True when every model is CatBoost).
+    """
+
+    def __init__(self, models, feature_names, soc_names=None, n_jobs=None, chunk_size=4096, sparse=None):
+        self.models = models
+        self.index = feature_names if isinstance(feature_names, FeatureIndex) else FeatureIndex(feature_names)
+        self.feature_names = self.index.names
+        self.soc_names = list(soc_names) if soc_names else list(models)
+        missing = [s for s in self.soc_names if s not in models]
+        if missing:
+            raise ValueError(f"No model loaded for SOC(s): {missing}")
+        self._soc_models = [models[s] for s in self.soc_names]
+        self._span_names = [f"model.{s}" for s in self.soc_names]
+        self.n_jobs = n_jobs or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        # CatBoost scores CSR directly; anything else is fed dense blocks
+        if sparse is None:
+            sparse = all(type(m).__module__.startswith("catboost") for m in self._soc_models)
+        self.sparse = sparse
+
+        # CatBoost already parallelises each call; pin it to one thread so the
+        # pool is not oversubscribed.
+        self._predict_kwargs = [
+            {"thread_count": 1} if "thread_count" in inspect.signature(m.predict_proba).parameters else {}
+            for m in self._soc_models
+        ]
+
+        self._buffer = np.zeros((0, len(self.feature_names)), dtype=np.float32)
+        self._lock = threading.Lock()
+        self._pool = None
+
+    @property
+    def n_features(self):
+        return len(self.index)
+
+    # ---------------- encoding ----------------
+    def _matrix(self, n):
+        """Return an n-row view of the shared dense buffer, growing it if needed."""
+        if self._buffer.shape[0] < n:
+            self._buffer = np.zeros((n, self.n_features), dtype=np.float32)
+        return self._buffer[:n]
+
+    def encode(self, patients):
+        """
+        Encode patient dicts (keys age, sex, weight, height and meds as a list
+        of names or {name: 0/1}) into an (N, n_features) CSR matrix.
+        """
+        return rows_to_csr([self.index.encode(p) for p in patients], self.n_features)
+
+    # ---------------- scoring ----------------
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.n_jobs, thread_name_prefix="soc-model")
+        return self._pool
+
+    def predict_matrix(self, x):
+        """Score a dense array or CSR block as-is; returns (N, n_soc) positive-class probabilities."""
+        out = np.empty((x.shape[0], len(self._soc_models)), dtype=np.float64)
+        if x.shape[0] == 0:
+            return out
+
+        def run(j):
+            with span(self._span_names[j]):
+                out[:, j] = self._soc_models[j].predict_proba(x, **self._predict_kwargs[j])[:, 1]
+
+        if self.n_jobs == 1:
+            for j in range(len(self._soc_models)):
+                run(j)
+        else:
+            # .result() re-raises model errors instead of hiding them
+            for fut in [self._executor().submit(run, j) for j in range(len(self._soc_models))]:
+                fut.result()
+        return out
+
+    def predict_csr(self, x):
+        """Score a CSR matrix of any height in chunks of ``chunk_size`` rows."""
+        out = np.empty((x.shape[0], len(self._soc_models)), dtype=np.float64)
+        with self._lock:
+            for start in range(0, x.shape[0], self.chunk_size):
+                block = x[start:start + self.chunk_size]
+                if not self.sparse:
+                    block = densify(block, self._matrix(block.shape[0]))
+                out[start:start + block.shape[0]] = self.predict_matrix(block)
+        return out
+
+    def predict_proba(self, patients):
+        """Encode and score a batch of patient dicts; returns an (N, n_soc) array."""
+        return self.predict_csr(self.encode(patients))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
@@ -9,65 +9,30 @@ sys.excepthook = except_hook
 
 
 # cephalo_predictor_medication.py
-from pathlib import Path
-import polars as pl
-import sys
-import sqlite3
+# numpy/polars/joblib/catboost are imported lazily by the background loader
+# (see CephaloPredictor._load_resources) so the window can appear immediately.
 import csv
 import json
-import random
 import os
-import joblib
-import numpy as np
-import pandas as pd
-
-import sys
-import sqlite3
-import csv
-import json
-import random
-import os
-import joblib
-import numpy as np
+import threading
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QLabel, QVBoxLayout, QGroupBox, QFormLayout,
     QLineEdit, QComboBox, QPushButton, QMessageBox, QTableWidget,
     QTableWidgetItem, QHeaderView, QScrollArea, QProgressBar, QHBoxLayout,
-    QDialog, QCompleter
+    QDialog, QCompleter, QTableView, QCheckBox, QFileDialog, QShortcut
 )
-from PyQt5.QtGui import QFont, QColor
-from PyQt5.QtCore import Qt, QStringListModel
-
-
-# ---------- Full SIDE_EFFECTS list ----------
-SIDE_EFFECTS = [
-    "Blood and lymphatic system disorders",
-    "Cardiac disorders",
-    "Congenital, familial and genetic disorders",
-    "Ear and labyrinth disorders",
-    "Endocrine disorders",
-    "Eye disorders",
-    "Gastrointestinal disorders",
-    "General disorders and administration site conditions",
-    "Hepatobiliary disorders",
-    "Immune system disorders",
-    "Infections and infestations",
-    "Injury, poisoning and procedural complications",
-    "Investigations",
-    "Metabolism and nutrition disorders",
-    "Musculoskeletal and connective tissue disorders",
-    "Neoplasms benign, malignant and unspecified (incl cysts and polyps)",
-    "Nervous system disorders",
-    "Pregnancy, puerperium and perinatal conditions",
-    "Psychiatric disorders",
-    "Renal and urinary disorders",
-    "Reproductive system and breast disorders",
-    "Respiratory, thoracic and mediastinal disorders",
-    "Skin and subcutaneous tissue disorders",
-    "Social circumstances",
-    "Surgical and medical procedures",
-    "Vascular disorders"
-]
+from PyQt5.QtGui import QFont, QColor, QKeySequence
+from PyQt5.QtCore import Qt, QThreadPool, QTimer
+
+from completion import MedCompletionModel
+from med_matcher import MedMatcher
+from patient_store import PatientStore
+from patient_table import PatientTableModel
+from scoring import (SIDE_EFFECTS, RiskService, generation_for, load_feature_names, load_ingredient_names,
+                     load_models, load_risk_data, summarize)
+import telemetry
+from telemetry import span
+from workers import Job
 
 
 # to get this pat os.getcwd() + "/interface/database.csv"
@@ -103,7 +68,7 @@ def load_med_list_from_csv(path):
     return meds
 
 
-# --- Patient Browser Dialog (unchanged) ---
+# --- Patient Browser Dialog ---
 class PatientBrowser(QDialog):
     def __init__(self, parent, conn):
         super().__init__(parent)
@@ -113,34 +78,92 @@ class PatientBrowser(QDialog):
         self.resize(900, 420)
 
         layout = QVBoxLayout(self)
-        self.table = QTableWidget()
-        self.table.setColumnCount(6)
-        self.table.setHorizontalHeaderLabels(["ID", "Name", "Age", "Sex", "Cephalosporin", "Timestamp"])
+        self.filter_input = QLineEdit()
+        self.filter_input.setPlaceholderText("Filter by name or cephalosporin…")
+        layout.addWidget(self.filter_input)
+
+        # rows are paged in from SQLite as the view scrolls (patient_table.py)
+        self.model = PatientTableModel(conn, parent=self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QTableView.SelectRows)
+        self.table.setEditTriggers(QTableView.NoEditTriggers)
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
         self.table.verticalHeader().setVisible(False)
+        self.table.setSortingEnabled(True)
+        self.table.sortByColumn(0, Qt.DescendingOrder)
         layout.addWidget(self.table)
 
-        self.load_data()
-        self.table.cellDoubleClicked.connect(self.select_patient)
+        # debounce typing so each keystroke does not re-query
+        self._filter_timer = QTimer(self)
+        self._filter_timer.setSingleShot(True)
+        self._filter_timer.setInterval(200)
+        self._filter_timer.timeout.connect(lambda: self.model.set_filter(self.filter_input.text()))
+        self.filter_input.textChanged.connect(self._filter_timer.start)
+        self.table.doubleClicked.connect(self.select_patient)
 
-    def load_data(self):
-        cur = self.conn.cursor()
-        # Try to include timestamp if present
-        try:
-            cur.execute("SELECT id, name, age, sex, cephalosporin, timestamp FROM patients ORDER BY id DESC")
-        except sqlite3.OperationalError:
-            cur.execute("SELECT id, name, age, sex, cephalosporin FROM patients ORDER BY id DESC")
-        rows = cur.fetchall()
-        self.table.setRowCount(len(rows))
-        for i, row in enumerate(rows):
-            for j, val in enumerate(row):
-                self.table.setItem(i, j, QTableWidgetItem(str(val if val is not None else "")))
-
-    def select_patient(self, row, _col):
-        self.selected_id = int(self.table.item(row, 0).text())
+    def select_patient(self, index):
+        self.selected_id = self.model.patient_id(index.row())
         self.accept()
 
 
+# --- Diagnostics Dialog (hidden: Ctrl+Shift+D) ---
+class DiagnosticsDialog(QDialog):
+    COLUMNS = ("Stage", "Count", "Mean", "p50", "p95", "p99", "Max")
+    KEYS = ("count", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms")
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.setWindowTitle("Diagnostics — stage timings (ms)")
+        self.resize(760, 480)
+
+        layout = QVBoxLayout(self)
+        self.record_box = QCheckBox("Record timings")
+        self.record_box.setChecked(telemetry.enabled())
+        self.record_box.toggled.connect(lambda on: telemetry.enable() if on else telemetry.disable())
+        layout.addWidget(self.record_box)
+
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        layout.addWidget(self.table)
+
+        buttons = QHBoxLayout()
+        export_btn = QPushButton("Export…")
+        reset_btn = QPushButton("Reset")
+        export_btn.clicked.connect(self.export)
+        reset_btn.clicked.connect(lambda: (telemetry.reset(), self.refresh()))
+        buttons.addWidget(export_btn)
+        buttons.addWidget(reset_btn)
+        layout.addLayout(buttons)
+
+        # stages are recorded on worker threads; poll while the dialog is open
+        self._timer = QTimer(self)
+        self._timer.setInterval(1000)
+        self._timer.timeout.connect(self.refresh)
+        self._timer.start()
+        self.refresh()
+
+    def refresh(self):
+        stats = telemetry.snapshot()
+        self.table.setRowCount(len(stats))
+        for i, (name, s) in enumerate(stats.items()):
+            self.table.setItem(i, 0, QTableWidgetItem(name))
+            for j, key in enumerate(self.KEYS, start=1):
+                text = str(s[key]) if key == "count" else f"{s[key]:.2f}"
+                item = QTableWidgetItem(text)
+                item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(i, j, item)
+
+    def export(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export timings", "timings.json", "JSON (*.json)")
+        if path:
+            telemetry.export(path)
+
+
 # --- Main Application Window ---
 class CephaloPredictor(QWidget):
     def __init__(self):
@@ -151,62 +174,32 @@ class CephaloPredictor(QWidget):
         # load medication list from CSV (column C)
         self.med_list = load_med_list_from_csv(CSV_PATH)
 
-                # DB
+        # DB: one connection, schema migrated once via user_version (patient_store.py)
         self.db_path = os.path.join(os.getcwd(), "patients.db")
-        self.conn = sqlite3.connect(self.db_path)
-        self.ensure_table_and_columns()
+        self.store = PatientStore(self.db_path)
+        self.conn = self.store.conn
         self.current_patient_id = None
-        self.conn = sqlite3.connect("patients.db")
-        self.ensure_columns_exist()
 
-        # --- load parquet dfs (same logic from your notebook) ---
+        # --- models and parquet data load in the background (see _load_resources) ---
         self.dfs = {}
-        try:
-            carpeta = Path(r"C:\Users\Pau\Desktop\HACKATHON")  # change if your parquet files are elsewhere
-            for p in sorted(carpeta.glob("*.parquet")):
-                try:
-                    self.dfs[p.stem] = pl.read_parquet(p)
-                except Exception as e:
-                    print(f"Warning: couldn't read {p}: {e}")
-            print("Parquet files loaded:", list(self.dfs.keys())[:10])
-        except Exception as e:
-            print("Warning loading parquet files:", e)
-            self.dfs = {}
-
-        # --------- Load CatBoost models-per-SOC ----------
-        try:
-            # 1) Load the CatBoost models-per-SOC dict
-            self.models = joblib.load("catboost.joblib")
-            print(f"Loaded CatBoost models for {len(self.models)} SOCs.")
-
-            # 2) Load feature names + SOC names exactly like notebook
-            self.model_features = (
-                pd.read_csv(os.path.join(os.getcwd(), "feature_names.csv"))
-                .squeeze()
-                .astype(str)
-                .str.strip()
-                .tolist()
-            )
-
-            self.model_outputs = (
-                pd.read_csv(os.path.join(os.getcwd(), "soc_columns.csv"))
-                .squeeze()
-                .astype(str)
-                .str.strip()
-                .tolist()
-            )
-
-            print(f"Loaded {len(self.models)} SOC models.")
-            print("First SOCs:", self.model_outputs[:5])
-            print("First features:", self.model_features[:5])
-
-        except Exception as e:
-            print("Could not load CatBoost models:", e)
-            self.models = {}
-            self.model_features = []
-            self.model_outputs = []
-            print("⚠️ Could not load CatBoost SOC models:", e)
-
+        self.risk_table = None
+        self.risk = RiskService(self.dfs, self.risk_table)
+        self.models = {}
+        self.model_features = []
+        self.model_outputs = []
+        self.engine = None
+        self.med_matcher = None
+        self._ready = threading.Event()
+        self._load_lock = threading.Lock()
+        self._load_job = None
+
+        # predictions run on a worker thread; only the latest request is shown
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(2)
+        self._prediction_seq = 0
+        self._prediction_job = None
+        # superseded jobs still running on the pool (kept alive until they return)
+        self._retired_jobs = []
 
         # UI scaffold with a global scroll area
         scroll = QScrollArea()
@@ -220,32 +213,90 @@ class CephaloPredictor(QWidget):
         self.setLayout(main_layout)
         self.apply_modern_style()
 
-    # ---------------- Database helpers ----------------
-    def ensure_table_and_columns(self):
-        """Create table if missing and ensure weight, height and medications_json columns exist."""
-        cur = self.conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS patients (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                age INTEGER,
-                sex TEXT,
-                cephalosporin TEXT,
-                summary_json TEXT
-            )
-        """)
-        self.conn.commit()
-        # helper to add column if not present
-        def ensure_col(name, coltype="TEXT"):
-            cur.execute("PRAGMA table_info(patients);")
-            cols = [r[1] for r in cur.fetchall()]
-            if name not in cols:
-                cur.execute(f"ALTER TABLE patients ADD COLUMN {name} {coltype}")
-                self.conn.commit()
-        ensure_col("weight", "REAL")
-        ensure_col("height", "REAL")
-        ensure_col("medications_json", "TEXT")
-        ensure_col("timestamp", "TEXT")
+        # hidden timing panel (telemetry.py)
+        QShortcut(QKeySequence("Ctrl+Shift+D"), self, self.open_diagnostics)
+
+        # start loading once the event loop is running and the window is shown
+        QTimer.singleShot(0, self.start_background_load)
+
+    # ---------------- Startup loading ----------------
+    def _load_resources(self, job=None):
+        """
+        Read the parquet files the risk wrapper needs, the risk table and the
+        CatBoost models. Runs on a worker thread; never touches widgets.
+        """
+        report = job.report if job is not None else (lambda *a: None)
+        with self._load_lock:
+            # a concurrent caller may have finished loading while we waited
+            if not self._ready.is_set():
+                self._load_resources_locked(report)
+        return bool(self.dfs), self.engine is not None
+
+    def _load_resources_locked(self, report):
+        try:
+            # --- load parquet dfs + the precomputed (sex, generation, age) EB risk ---
+            report(10, "Loading data")
+            try:
+                # set CEPHALO_DATA_DIR if your parquet files are elsewhere
+                with span("load.data"):
+                    self.dfs, self.risk_table = load_risk_data()
+                print("Parquet files loaded:", list(self.dfs.keys())[:10])
+            except Exception as e:
+                print("Warning loading parquet files:", e)
+                self.dfs, self.risk_table = {}, None
+            self.risk.reload(self.dfs, self.risk_table)
+
+            # --------- Load CatBoost models-per-SOC ----------
+            report(50, "Loading models")
+            try:
+                with span("load.models"):
+                    self.engine = load_models(os.getcwd())
+                self.models = self.engine.models
+                self.model_features = self.engine.feature_names
+                self.model_outputs = self.engine.soc_names
+
+                print(f"Loaded {len(self.models)} SOC models.")
+                print("First SOCs:", self.model_outputs[:5])
+                print("First features:", self.model_features[:5])
+
+            except Exception as e:
+                print("Could not load CatBoost models:", e)
+                self.models = {}
+                self.model_features = []
+                self.model_outputs = []
+                self.engine = None
+                print("⚠️ Could not load CatBoost SOC models:", e)
+
+            # --- medication matcher over the feature columns + CSV med list ---
+            report(90, "Indexing medications")
+            features = self.model_features
+            if not features:
+                features = load_feature_names(os.getcwd()) or []
+            self.med_matcher = MedMatcher(features, self.med_list + load_ingredient_names())
+            report(100, "Ready")
+        finally:
+            self._ready.set()
+
+    def start_background_load(self):
+        if self._load_job is not None or self._ready.is_set():
+            return
+        self._load_job = Job(0, self._load_resources)
+        self._load_job.signals.progress.connect(lambda _id, pct, stage: self.status_label.setText(f"{stage}…"))
+        self._load_job.signals.finished.connect(self._on_resources_loaded)
+        self._load_job.signals.failed.connect(lambda _id, msg: self.status_label.setText(f"Loading failed: {msg}"))
+        self.status_label.setText("Loading models and data…")
+        self.pool.start(self._load_job)
+
+    def _on_resources_loaded(self, _job_id, result):
+        data_ok, models_ok = result
+        parts = ["data ready" if data_ok else "data unavailable",
+                 "models ready" if models_ok else "models unavailable"]
+        self.status_label.setText(" · ".join(parts).capitalize())
+
+    def ensure_ready(self):
+        """Block until models/data are available (loads synchronously if the background load has not started)."""
+        if not self._ready.is_set():
+            self._load_resources()
 
     # ---------------- UI setup ----------------
     def setup_ui(self, parent):
@@ -256,6 +307,12 @@ class CephaloPredictor(QWidget):
         title.setAlignment(Qt.AlignCenter)
         main_layout.addWidget(title)
 
+        # readiness of the background-loaded models / data
+        self.status_label = QLabel("")
+        self.status_label.setAlignment(Qt.AlignCenter)
+        self.status_label.setStyleSheet("color: #6b7280; font-size: 12px;")
+        main_layout.addWidget(self.status_label)
+
         # toolbar
         toolbar = QHBoxLayout()
         self.load_btn = QPushButton("Load Last Patient")
@@ -353,32 +410,19 @@ class CephaloPredictor(QWidget):
         # NEW: weight & height
         self.weight_input = QLineEdit()
         self.height_input = QLineEdit()
-        # medication single text input with completer
-        self.med_input = QLineEdit()
-        self.med_input.setPlaceholderText("Type medications separated by commas — suggestions will appear as you type")
-        # set completer using med_list
         # --- set up medication input + robust completer for comma-separated input ---
         self.med_input = QLineEdit()
         self.med_input.setPlaceholderText("Type medications separated by commas — suggestions will appear as you type")
 
-        # ensure med_list is available and non-empty
-        print(f"DEBUG: med_list length = {len(self.med_list)}")  # remove later if you want
-
-        # use QStringListModel for the completer
-        completer_model = QStringListModel()
-        completer_model.setStringList(self.med_list)  # load list into model
+        # top-k suggestions from the medication index (filled once it is loaded)
+        self.completer_model = MedCompletionModel(self.med_matcher)
 
-        # create completer and configure
+        # create completer and configure; the model is already filtered, so the
+        # completer must not filter it again
         self.completer = QCompleter()
-        self.completer.setModel(completer_model)
+        self.completer.setModel(self.completer_model)
         self.completer.setCaseSensitivity(Qt.CaseInsensitive)
-        # MatchContains allows matching anywhere in the string
-        try:
-            self.completer.setFilterMode(Qt.MatchContains)
-        except Exception:
-            # older PyQt5 versions sometimes don't expose setFilterMode; ignore if absent
-            pass
-        self.completer.setCompletionMode(QCompleter.PopupCompletion)
+        self.completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
 
         # helper: get the token after last comma (what user is currently typing)
         def current_token(text: str) -> str:
@@ -406,19 +450,17 @@ class CephaloPredictor(QWidget):
         # Use the str overload to ensure string argument arrives
         self.completer.activated[str].connect(insert_completion)
 
-        # When user edits the text, update the completer prefix to the current token and show popup
+        # When user edits the text, refresh the suggestions for the current token and show popup
         def on_med_text_edited(t: str):
             prefix = current_token(t)
-            # small debug so you can see prefix changes in terminal
-            print(f"DEBUG: prefix='{prefix}'")
-            if prefix:
-                # update model if med_list changed dynamically
-                self.completer.model().setStringList(self.med_list)
-                self.completer.setCompletionPrefix(prefix)
+            # pick up the index once the background load has built it
+            if self.completer_model.matcher is not self.med_matcher:
+                self.completer_model.set_matcher(self.med_matcher)
+            if prefix and self.completer_model.update_token(prefix):
                 # show popup positioned at the widget
                 self.completer.complete()
             else:
-                # hide popup if no prefix
+                # hide popup if no prefix / no suggestions
                 try:
                     self.completer.popup().hide()
                 except Exception:
@@ -455,6 +497,13 @@ class CephaloPredictor(QWidget):
 
         prob_layout.addWidget(prob_label)
         prob_layout.addWidget(self.prob_value)
+
+        # busy indicator while a prediction runs in the background
+        self.predict_progress = QProgressBar()
+        self.predict_progress.setRange(0, 100)
+        self.predict_progress.setAlignment(Qt.AlignCenter)
+        self.predict_progress.setVisible(False)
+        prob_layout.addWidget(self.predict_progress)
         prob_group.setLayout(prob_layout)
 
         main_layout.addWidget(prob_group)
@@ -491,413 +540,111 @@ class CephaloPredictor(QWidget):
         self.browse_btn.clicked.connect(self.open_browser)
         self.delete_btn.clicked.connect(self.delete_patient)
 
-        # ---------------- notebook-derived helper functions ----------------
-
-    def _pop_df(self, gender: str) -> pl.DataFrame:
-        """Return population proportion per age for the requested gender."""
-        if not self.dfs:
-            raise RuntimeError("Parquet data not loaded.")
-        if gender == "Male":
-            df = self.dfs.get("canada_interp_men")
-            col = "Men"
-        elif gender == "Female":
-            df = self.dfs.get("canada_interp_women")
-            col = "Women"
-        else:
-            df = self.dfs.get("canada_interp_total")
-            col = "Total"
-
-        if df is None:
-            raise RuntimeError("Needed population parquet not found (canada_interp_*).")
-
-        pop_promedio = (
-            df.group_by("Age")
-            .agg(pl.col(col).mean().alias("TotalPop_avg"))
-            .sort("Age")
-        )
-
-        pop_promedio = pop_promedio.with_columns(
-            (pl.col("TotalPop_avg") / pl.col("TotalPop_avg").sum()).alias("P_pob")
-        )
-        return pop_promedio
+    # ---------------- notebook-derived helper functions (see risk_model.py) ----------------
+    def _pop_df(self, gender: str):
+        import risk_model
+        return risk_model.pop_df(self.dfs, gender)
 
     def _ea_df(self, gender, generation):
-        """Return EA distribution dataframe (Age, P_EA_smooth etc.)."""
-        if "reports_plus" not in self.dfs:
-            raise RuntimeError("reports_plus parquet not found.")
-
-        # prepare ages array
-        def preparar_total(df: pl.DataFrame, years=None, gen_in=generation, gender=gender):
-            d = (
-                df.with_columns(
-                    pl.col("AGE_Y")
-                    .cast(pl.Utf8)
-                    .str.extract(r"(\d+)", 1)
-                    .cast(pl.Int64, strict=False)
-                    .alias("AGE_Y")
-                )
-                .filter(pl.col("AGE_Y").is_not_null() & (pl.col("AGE_Y") >= 0) & (pl.col("AGE_Y") <= 100))
-            )
-            if years is not None:
-                d = d.filter(pl.col("YEAR").is_in(list(years)))
-            if gen_in is not None and "gen" in d.columns:
-                d = d.filter(pl.col("gen").cast(pl.Utf8).str.to_lowercase().is_in([g.lower() for g in gen_in]))
-            if gender is not None and "GENDER_ENG" in d.columns:
-                d = d.filter(pl.col("GENDER_ENG").cast(pl.Utf8).str.to_lowercase() == gender.lower())
-            return d["AGE_Y"].to_numpy()
-
-        def build_df_curva_total(df: pl.DataFrame, years=None, gen_in=None, gender=None, bins=60, window=7):
-            ages = preparar_total(df, years=years, gen_in=gen_in, gender=gender)
-            if ages.size == 0:
-                # return empty df with Age 1..100 zeroed
-                centers = np.arange(1, 101)
-                return pl.DataFrame({
-                    "Age": centers,
-                    "EA_count": [0] * 100,
-                    "EA_smooth": [0.0] * 100,
-                    "P_EA": [0.0] * 100,
-                    "P_EA_smooth": [0.0] * 100
-                })
-            bins = np.arange(0, 101, 1)
-            counts, edges = np.histogram(ages, bins=bins)
-            centers = np.arange(1, 101)
-            y_hist = counts.astype(float)
-            kernel = np.ones(window) / window
-            y_smooth = np.convolve(y_hist, kernel, mode="same")
-            total = y_hist.sum()
-            y_prop = y_hist / total if total > 0 else y_hist
-            smooth_prop = y_smooth / y_smooth.sum() if y_smooth.sum() > 0 else y_smooth
-            df_out = pl.DataFrame({
-                "Age": centers,
-                "EA_count": y_hist,
-                "EA_smooth": y_smooth,
-                "P_EA": y_prop,
-                "P_EA_smooth": smooth_prop
-            })
-            return df_out
-
-        df_ea = build_df_curva_total(self.dfs["reports_plus"], bins=45, window=7)
-        return df_ea
+        import risk_model
+        return risk_model.ea_df(self.dfs, gender, generation)
 
     def _juntar_pop_ea(self, pop_df, ea_df):
-        df_merged = (
-            pop_df.join(ea_df, on="Age", how="inner")
-            .with_columns([
-                (pl.col("P_EA_smooth") / pl.col("P_pob")).alias("EA_to_Pop_Ratio"),
-                (pl.col("P_EA_smooth") - pl.col("P_pob")).alias("EA_minus_Pop")
-            ])
-            .sort("Age")
-        )
-        return df_merged
+        import risk_model
+        return risk_model.juntar_pop_ea(pop_df, ea_df)
 
     def _exppermil(self, generation: str) -> float:
-        cefs_pl = self.dfs.get("cefs")
-        if cefs_pl is None:
-            raise RuntimeError("cefs parquet not found.")
-        patterns = {
-            "1st gen": r"(?i)\b1st\s*gen\b",
-            "2/3 gen": r"(?i)\b2\s*/?\s*3(?:rd)?\s*gen\b",
-            "4/5 gen": r"(?i)\b4\s*/?\s*5(?:th)?\s*gen\b",
-            None: r".*",
-            "all": r".*"
-        }
-        if generation not in patterns:
-            raise ValueError(f"generation inválida: {generation}")
-        df_gen = cefs_pl.filter(
-            pl.col("Antimicrobial_Class").str.replace_all('"', "").str.contains(patterns[generation])
-        )
-        presc_anual = (
-            df_gen.group_by("Year").agg(pl.col("Canada_Prescriptions").sum().alias("Presc_total_year")).sort("Year")
-        )
-        presc_general = float(presc_anual["Presc_total_year"].mean()) if presc_anual.height > 0 else 0.0
-        return presc_general
+        import risk_model
+        return risk_model.exppermil(self.dfs, generation)
 
     def _expo(self, presc_general, df_merged):
-        df_expos = df_merged.with_columns(
-            (pl.lit(presc_general) * pl.col("TotalPop_avg") / 1000).alias("Presc_est_pob")
-        )
-        sum_p_pob = float(df_expos["Presc_est_pob"].sum())
-        if sum_p_pob == 0:
-            df_expos = df_expos.with_columns((pl.lit(0.0)).alias("P_exp_pob"))
-        else:
-            df_expos = df_expos.with_columns((pl.col("Presc_est_pob") / sum_p_pob).alias("P_exp_pob"))
-        total_pop = float(df_expos["TotalPop_avg"].sum())
-        presc_total_all = presc_general * (total_pop / 1000.0) if total_pop > 0 else 0.0
-        df_expos = df_expos.with_columns((pl.lit(presc_total_all) * pl.col("P_EA_smooth")).alias("Presc_est_ea"))
-        sum_ea_smooth = float(df_expos["EA_smooth"].sum())
-        df_expos = df_expos.with_columns(
-            (pl.lit(presc_total_all) * (pl.col("EA_smooth") / sum_ea_smooth)).alias("Presc_est_ea_from_counts"))
-        sum_p_ea = float(df_expos["Presc_est_ea"].sum())
-        if sum_p_ea == 0:
-            df_expos = df_expos.with_columns((pl.lit(0.0)).alias("P_exp_ea"))
-        else:
-            df_expos = df_expos.with_columns((pl.col("Presc_est_ea") / sum_p_ea).alias("P_exp_ea"))
-        return df_expos
-
-    def _p_ea_hibrido_simple(self, df_expos: pl.DataFrame, lam: float = 0.7, window: int = 7) -> pl.DataFrame:
-        FACTOR_SUBREG = 20.0
-        lam = float(np.clip(lam, 0.0, 1.0))
-        presc_total_all = float(df_expos["Presc_est_pob"].sum()) if "Presc_est_pob" in df_expos.columns else float(
-            df_expos["Presc_est_ea"].sum())
-        p_raw = lam * df_expos["P_exp_pob"] + (1 - lam) * df_expos["P_exp_ea"]
-        p_exp_h = p_raw / float(p_raw.sum()) if float(p_raw.sum()) != 0 else p_raw
-        presc_est_h = presc_total_all * p_exp_h
-        ea_est = df_expos["EA_smooth"] * FACTOR_SUBREG
-        with np.errstate(divide="ignore", invalid="ignore"):
-            p_age_h = (ea_est / presc_est_h).to_numpy()
-        p_age_h = np.nan_to_num(p_age_h, nan=0.0, posinf=0.0, neginf=0.0)
-        p_age_h = np.clip(p_age_h, 0.0, 1.0)
-        k = max(1, int(window))
-        w = np.ones(k) / k
-        p_age_h_smooth = np.convolve(p_age_h, w, mode="same")
-        out = df_expos.select(["Age"]).with_columns([
-            pl.Series("P_exp_h", p_exp_h),
-            pl.Series("Presc_est_h", presc_est_h),
-            pl.Series("EA_estimated", ea_est),
-            pl.Series("p_age_h", p_age_h),
-            pl.Series("p_age_h_smooth", p_age_h_smooth),
-            pl.lit(lam).alias("lambda")
-        ]).sort("Age")
-        return out
+        import risk_model
+        return risk_model.expo(presc_general, df_merged)
+
+    def _p_ea_hibrido_simple(self, df_expos, lam: float = 0.7, window: int = 7):
+        import risk_model
+        return risk_model.p_ea_hibrido_simple(df_expos, lam=lam, window=window)
 
     def _p_poredad(self, df, edad):
-        prob_90 = float(df.filter(pl.col("Age") == edad).select("p_age_h_smooth").item() if df.filter(
-            pl.col("Age") == edad).height > 0 else 0.0)
-        return prob_90
+        import risk_model
+        return risk_model.p_poredad(df, edad)
 
     def _wraper(self, gender=None, generation=None, age=None):
-        # build pop and ea dfs, join them
-        pop = self._pop_df(gender)
-        ea = self._ea_df(gender, generation)
-        merged = self._juntar_pop_ea(pop, ea)
-        presc = self._exppermil(generation)
-        expo_df = self._expo(presc, merged)
-        df = self._p_ea_hibrido_simple(expo_df, lam=0.7, window=7)
-        df = df.sort("Age")
-        if age is not None:
-            p = self._p_poredad(df, age)
-            percentage = p * 100.0
-            return percentage, df
-        return 0.0, df
-
-    def compute_overall_probability(self, age, sex, weight, height):
+        import risk_model
+        return risk_model.wraper(self.dfs, gender=gender, generation=generation, age=age)
+
+    def compute_overall_probability(self, age, sex, weight, height, ceph=None, update_label=True):
         """
-        Calls the notebook-derived wrapper to compute the percentage.
+        Calls the notebook-derived wrapper to compute the percentage, through
+        self.risk (memoised per sex, generation, age and data version).
         sex must be 'Male' or 'Female' (matching notebook).
         generation inferred from cephalosporin if possible, else default to '1st gen'.
+        ceph: cephalosporin name; read from the combo box if omitted (GUI thread only).
+        update_label: set prob_value; pass False when called from a worker thread.
         """
         try:
+            self.ensure_ready()
             # infer generation from cephalosporin name if widget exists, otherwise default
-            gen_map = {
-                "cefaclor": "2/3 gen",
-    "cefaclor monohydrate": "2/3 gen",
-    "cefadroxil": "1st gen",
-    "cefadroxil monohydrate": "1st gen",
-    "cefalexin": "1st gen",
-    "cefalexin sodium": "1st gen",
-    "cefatrizine": "2/3 gen",
-    "cefazolin": "1st gen",
-    "cefazolin benzathine": "1st gen",
-    "cefazolin sodium": "1st gen",
-    "cefazolin, sodium": "1st gen",
-    "cefazoline benzathine": "1st gen",
-    "cefcapene": "2/3 gen",
-    "cefcapene pivoxil": "2/3 gen",
-    "cefcapene pivoxil hcl": "2/3 gen",
-    "cefcapene pivoxil hydrochloride": "2/3 gen",
-    "cefcapene pivoxil hydrochloride hydrate": "2/3 gen",
-    "cefdinir": "2/3 gen",
-    "cefepim": "4/5 gen",
-    "cefepime": "4/5 gen",
-    "cefepime dihydrochloride monohydrate": "4/5 gen",
-    "cefepime hcl": "4/5 gen",
-    "cefepime hydrochloride": "4/5 gen",
-    "cefepime hydrochloride monohydrate": "4/5 gen",
-    "cefepime, hydrochloride, monohydrate": "4/5 gen",
-    "cefixima": "2/3 gen",
-    "cefixime": "2/3 gen",
-    "cefixime trihydrate": "2/3 gen",
-    "cefmetazole sodium": "2/3 gen",
-    "cefodizime": "2/3 gen",
-    "cefodizime disodium": "2/3 gen",
-    "cefodizime sodium": "2/3 gen",
-    "cefoperazone sodium": "2/3 gen",
-    "cefotaxime": "2/3 gen",
-    "cefotaxime sodique": "2/3 gen",
-    "cefotaxime sodium": "2/3 gen",
-    "cefotiam": "2/3 gen",  # treated as 2nd/3rd bucket
-    "cefotiam hexetil hydrochloride": "2/3 gen",
-    "cefotiam hydrochloride": "2/3 gen",
-    "cefoxitin": "2/3 gen",
-    "cefoxitin sodium": "2/3 gen",
-    "cefpodoxime proxetil": "2/3 gen",
-    "cefprozil": "2/3 gen",
-    "cefprozil monohydrate": "2/3 gen",
-    "ceftaroline": "4/5 gen",
-    "ceftaroline fosamil": "4/5 gen",
-    "ceftaroline fosamil acetate": "4/5 gen",
-    "ceftazidime": "2/3 gen",
-    "ceftazidime pentahydrate": "2/3 gen",
-    "ceftazidime sodium": "2/3 gen",
-    "ceftobiprole": "4/5 gen",
-    "ceftolozane": "4/5 gen",
-    "ceftolozane sulfate": "4/5 gen",
-    "ceftriaxone": "2/3 gen",
-    "ceftriaxone disodium": "2/3 gen",
-    "ceftriaxone sodique": "2/3 gen",
-    "ceftriaxone sodium": "2/3 gen",
-    "ceftriaxone sodium hydrate": "2/3 gen",
-    "ceftriaxone sodium sesquaterhydrate": "2/3 gen",
-    "ceftriaxone, sodium, sesquaterhydrate": "2/3 gen",
-    "cefuroxime": "2/3 gen",
-    "cefuroxime axetil": "2/3 gen",
-    "cefuroxime salt not specified": "2/3 gen",
-    "cefuroxime sodium": "2/3 gen",
-    "cephalexin": "1st gen",
-    "cephazolin sodium": "1st gen",
-    "methylol cefalexin lysinate": "1st gen",
-    "probenecid": "other",
-    "sodium cefazolin": "1st gen",
-    "sodium ceforoxine": "2/3 gen",  # likely cefuroxime → 2nd-gen bucket
-    "sodium cefoxitin": "2/3 gen",
-    "sodium ceftriaxone": "2/3 gen",
-    "tazobactam": "other",
-    "tazobactam sodique": "other",
-    "tazobactam sodium": "other"
-            }
-            generation = None
             ceph_combo = getattr(self, "cephalo_combo", None)
-            if ceph_combo:
+            if ceph is None and ceph_combo:
                 ceph = ceph_combo.currentText()
-                generation = gen_map.get(ceph, None)
-            if generation is None:
-                generation = "1st gen"
-
-            # ensure required parquet data exist
-            if not self.dfs:
-                raise RuntimeError("Parquet files not loaded; cannot compute probability.")
+            generation = generation_for(ceph)
 
-            # call wrapped function
-            percentage, _df = self._wraper(gender=sex, generation=generation, age=age)
+            with span("overall_probability"):
+                percentage = self.risk.percentage(sex, generation, age)
             # update UI label
-            self.prob_value.setText(f"{percentage:.2f} %")
+            if update_label:
+                self.prob_value.setText(f"{percentage:.2f} %")
             return percentage
 
         except Exception as e:
             print("Error computing overall probability:", e)
-            self.prob_value.setText("— %")
+            if update_label:
+                self.prob_value.setText("— %")
             return 0.0
 
     # ---------------- Prediction model (placeholder deterministic) ----------
-    def probability_model(self, age, sex, weight, height, meds_vector):
+    def probability_model(self, age, sex, weight, height, meds_vector, ceph=None):
         """
-        CatBoost version: strict, clean, identical to notebook pipeline.
-        Only uses the model_features list. No fuzzy matching.
+        Per-SOC CatBoost probabilities for the demographics and meds_vector.
+        Medications set the model_features columns with the same name
+        (case-insensitive), as in the notebook; parse_med_input_to_vector only
+        passes names that were typed or picked exactly, never fuzzy guesses.
+        Safe to call from a worker thread. The overall risk is not part of it:
+        callers get that from compute_overall_probability (ceph is unused).
         """
 
-        if not self.models:
-            return {soc: {"prob": 0, "severity": "Not Probable", "color": "#e2e8f0"}
-                    for soc in SIDE_EFFECTS}
-
-        feat = self.model_features
-
-        # --- 1) Build a clean zero-filled DataFrame (1 row × d features) ---
-        x_df = pd.DataFrame(0, index=[0], columns=feat)
-
-        # --- 2) Insert demographic values if the columns exist ---
-        if "AGE_Y" in feat:
-            x_df.loc[0, "AGE_Y"] = age
-        if "WEIGHT_KG" in feat:
-            x_df.loc[0, "WEIGHT_KG"] = weight or 0
-        if "HEIGHT_CM" in feat:
-            x_df.loc[0, "HEIGHT_CM"] = height or 0
-        if "GENDER_CODE" in feat:
-            x_df.loc[0, "GENDER_CODE"] = 1 if sex.lower() == "male" else 0
-
-        # compute overall percentage (not the per-side-effect model)
-        overall_percentage = self.compute_overall_probability(age, sex, weight, height)
-        # optionally save it to DB if you want (e.g., timestamp or a field)
-
-        # --- 3) Set medications that match feature columns EXACTLY ---
-        # (this matches the notebook: you set example.loc[0, 'cefalexin']=1)
-        for med, is_used in meds_vector.items():
-            if is_used != 1:
-                continue
-            # exact column match
-            med_col = med.strip().lower()
-            for f in feat:
-                if f.lower() == med_col:
-                    x_df.loc[0, f] = 1
-
-        # --- 4) Predict using each SOC model ---
-        results = {}
-        for soc, model in self.models.items():
-            try:
-                p = float(model.predict_proba(x_df)[:, 1][0])
-            except Exception:
-                p = 0.0
-
-            p_pct = 100 * p
-
-            if p_pct < 33:
-                severity = "Not Probable"
-                color = "#22c55e"
-            elif p_pct < 66:
-                severity = "Probable"
-                color = "#facc15"
-            else:
-                severity = "Very Probable"
-                color = "#ef4444"
-
-            results[soc] = {
-                "prob": round(p_pct, 2),
-                "severity": severity,
-                "color": color,
-            }
-
-        # --- 5) Re-map to the UI order stored in SIDE_EFFECTS ---
-        summary = {}
-        for eff in SIDE_EFFECTS:
-            summary[eff] = results.get(
-                eff,
-                {"prob": 0, "severity": "Not Probable", "color": "#e2e8f0"}
-            )
+        self.ensure_ready()
+        if not self.engine:
+            return summarize((), ())
 
-        return summary
+        # --- 1) Encode the patient (demographics + meds matching feature columns EXACTLY)
+        #        and score every SOC model in one batched call ---
+        patient = {"age": age, "sex": sex, "weight": weight, "height": height, "meds": meds_vector}
+        try:
+            with span("soc_models"):
+                probs = self.engine.predict_proba([patient])[0]
+        except Exception as e:
+            print("Warning: SOC model prediction failed:", e)
+            probs = [0.0] * len(self.engine.soc_names)
 
+        # --- 2) Classify each SOC probability, in the UI order stored in SIDE_EFFECTS ---
+        return summarize(self.engine.soc_names, probs)
 
     # ---------------- Helpers to parse medication input ----------------
-    def parse_med_input_to_vector(self, med_text):
+    def parse_med_input_to_vector(self, med_text, unmatched=None):
         """
         med_text: single string, comma-separated medication names typed by user.
-        Returns a dict mapping each medication in self.med_list -> 1 or 0
-        (case-insensitive matching; only meds from med_list are included).
+        Returns {medication name: 1} for every token that is a medication name
+        (case-insensitive; completer picks are exact names).  Names are feature
+        columns or entries of self.med_list.  Other tokens are not guessed at:
+        they are appended to ``unmatched`` if a list is given.
         """
-        found = set()
-        tokens = [t.strip() for t in med_text.split(",") if t.strip()]
-        # match case-insensitive; we use lowercase map for med_list
-        med_map_lower = {m.lower(): m for m in self.med_list}
-        for token in tokens:
-            key = token.lower()
-            if key in med_map_lower:
-                found.add(med_map_lower[key])
-            else:
-                # try partial match: contains
-                for mlow, morig in med_map_lower.items():
-                    if key in mlow or mlow in key:
-                        found.add(morig)
-                        break
-        vec = {m: (1 if m in found else 0) for m in self.med_list}
-        return vec
-
-    def ensure_columns_exist(self):
-        cur = self.conn.cursor()
-        cur.execute("PRAGMA table_info(patients)")
-        cols = [row[1] for row in cur.fetchall()]
-
-        if "overall_percentage" not in cols:
-            cur.execute("ALTER TABLE patients ADD COLUMN overall_percentage REAL")
-            self.conn.commit()
+        self.ensure_ready()
+        matches, unknown = self.med_matcher.split_text(med_text)
+        if unmatched is not None:
+            unmatched.extend(unknown)
+        return {m.name: 1 for m in matches}
 
     # ---------------- Save / Predict ----------------
     def predict_and_save(self):
@@ -929,12 +676,98 @@ class CephaloPredictor(QWidget):
             QMessageBox.warning(self, "Invalid Input", "Height must be numeric.")
             return
 
-        meds_vector = self.parse_med_input_to_vector(med_text)
+        inputs = {
+            "name": name, "age": age, "sex": sex, "ceph": ceph,
+            "weight": weight, "height": height, "med_text": med_text,
+            # the record to update is fixed when the request is made
+            "patient_id": self.current_patient_id,
+        }
+
+        # a newer request supersedes whatever is still queued or running
+        if self._prediction_job is not None:
+            self._prediction_job.cancel()
+            if not self.pool.tryTake(self._prediction_job) and not self._prediction_job.is_done():
+                self._retired_jobs.append(self._prediction_job)
+            self._prediction_job = None
+        self._retired_jobs = [j for j in self._retired_jobs if not j.is_done()]
+        self._prediction_seq += 1
+        job = Job(self._prediction_seq, self._run_prediction, inputs)
+        job.signals.progress.connect(self._on_prediction_progress)
+        job.signals.finished.connect(self._on_prediction_finished)
+        job.signals.failed.connect(self._on_prediction_failed)
+        self._prediction_job = job
+
+        self.predict_progress.setValue(0)
+        self.predict_progress.setFormat("Predicting… %p%")
+        self.predict_progress.setVisible(True)
+        self.pool.start(job)
+
+    def _run_prediction(self, job, inputs):
+        """Worker-thread part of predict_and_save: no widget access here."""
+        with span("prediction"):
+            return self._predict(job, inputs)
+
+    def _predict(self, job, inputs):
+        age, sex, weight, height, ceph = (inputs[k] for k in ("age", "sex", "weight", "height", "ceph"))
+
+        if not self._ready.is_set():
+            job.report(2, "Waiting for models")
+            self.ensure_ready()
+            job.check()
+
+        job.report(5, "Matching medications")
+        unmatched = []
+        with span("match_medications"):
+            meds_vector = self.parse_med_input_to_vector(inputs["med_text"], unmatched)
+        job.check()
 
         # Compute the overall adverse side-effect probability
-        overall_percentage = self.compute_overall_probability(age, sex, weight, height)
+        job.report(20, "Overall risk")
+        overall_percentage = self.compute_overall_probability(age, sex, weight, height, ceph=ceph, update_label=False)
+        job.check()
+
+        job.report(40, "SOC models")
+        summary = self.probability_model(age, sex, weight, height, meds_vector, ceph=ceph)
+        job.check()
+
+        job.report(100, "Done")
+        return dict(inputs, meds_vector=meds_vector, unmatched_meds=unmatched,
+                    overall_percentage=overall_percentage, summary=summary)
 
-        summary = self.probability_model(age, sex, weight, height, meds_vector)
+    def _release_prediction_job(self):
+        """
+        Forget the current job once its result arrived.  The signal is emitted
+        from inside Job.run, so a job that is not done yet stays referenced in
+        _retired_jobs until it is (see workers.Job).
+        """
+        job, self._prediction_job = self._prediction_job, None
+        if job is not None and not job.is_done():
+            self._retired_jobs.append(job)
+
+    def _on_prediction_progress(self, job_id, percent, stage):
+        if job_id != self._prediction_seq:
+            return
+        self.predict_progress.setValue(percent)
+        self.predict_progress.setFormat(f"{stage}… %p%")
+
+    def _on_prediction_failed(self, job_id, message):
+        if job_id != self._prediction_seq:
+            return
+        self._release_prediction_job()
+        self.predict_progress.setVisible(False)
+        QMessageBox.warning(self, "Prediction Failed", f"Could not compute the prediction:\n{message}")
+
+    def _on_prediction_finished(self, job_id, result):
+        if job_id != self._prediction_seq:
+            # superseded by a newer request
+            return
+        self._release_prediction_job()
+        self.predict_progress.setVisible(False)
+
+        name = result["name"]
+        summary = result["summary"]
+        overall_percentage = result["overall_percentage"]
+        self.prob_value.setText(f"{overall_percentage:.2f} %")
 
         # Update UI table with bars & severity
         for i, eff in enumerate(SIDE_EFFECTS):
@@ -947,35 +780,37 @@ class CephaloPredictor(QWidget):
             self.results_table.setCellWidget(i, 1, bar)
             self.results_table.setItem(i, 2, QTableWidgetItem(d["severity"]))
 
-        # Save to DB (weights, heights, meds vector JSON, summary)
-        cur = self.conn.cursor()
-        meds_json = json.dumps(meds_vector, ensure_ascii=False)
-        summary_json = json.dumps(summary, ensure_ascii=False)
-        timestamp = __import__("datetime").datetime.utcnow().isoformat()
-        if self.current_patient_id:
-            cur.execute("""
-                UPDATE patients SET
-                    name=?, age=?, sex=?, cephalosporin=?, weight=?, height=?, medications_json=?, overall_percentage=?, summary_json=?, timestamp=?
-                WHERE id=?
-            """, (name, age, sex, ceph, weight, height, meds_json, overall_percentage, summary_json, timestamp,
-                  self.current_patient_id))
-
-            QMessageBox.information(self, "Updated", f"✅ Updated prediction for {name}.")
+        # Save to DB (patient row + medications in use + per-SOC results, one transaction)
+        patient = {
+            "name": name, "age": result["age"], "sex": result["sex"], "cephalosporin": result["ceph"],
+            "weight": result["weight"], "height": result["height"], "overall_percentage": overall_percentage,
+            "timestamp": __import__("datetime").datetime.utcnow().isoformat(),
+        }
+        with span("db.save_prediction"):
+            patient_id = self.store.save_prediction(patient, result["meds_vector"], summary, result["patient_id"])
+        # unknown medication names are left out of the model input, not guessed at
+        note = ""
+        if result["unmatched_meds"]:
+            note = "\n\n⚠️ Not recognised, left out of the prediction: " + ", ".join(result["unmatched_meds"])
+        if result["patient_id"]:
+            QMessageBox.information(self, "Updated", f"✅ Updated prediction for {name}.{note}")
         else:
-            cur.execute("""
-                INSERT INTO patients (
-                    name, age, sex, cephalosporin, weight, height, medications_json, overall_percentage, summary_json, timestamp
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (name, age, sex, ceph, weight, height, meds_json, overall_percentage, summary_json, timestamp))
-            self.current_patient_id = cur.lastrowid
-            QMessageBox.information(self, "Saved", f"✅ Saved new prediction for {name}.")
-        self.conn.commit()
+            self.current_patient_id = patient_id
+            QMessageBox.information(self, "Saved", f"✅ Saved new prediction for {name}.{note}")
+
+    def open_diagnostics(self):
+        DiagnosticsDialog(self).exec_()
+
+    def closeEvent(self, event):
+        if self._prediction_job is not None:
+            self._prediction_job.cancel()
+        self.pool.waitForDone(2000)
+        self.store.close()
+        super().closeEvent(event)
 
     # ---------------- Load / Browse ----------------
     def load_last_patient(self):
-        cur = self.conn.cursor()
-        cur.execute("SELECT id, name, age, sex, cephalosporin, weight, height, medications_json, overall_percentage, summary_json FROM patients ORDER BY id DESC LIMIT 1")
-        row = cur.fetchone()
+        row = self.store.patient_row()
         if not row:
             QMessageBox.warning(self, "Not Found", "No existing patients found.")
             return
@@ -986,42 +821,42 @@ class CephaloPredictor(QWidget):
         self.cephalo_combo.setCurrentText(row[4])
         self.weight_input.setText("" if row[5] is None else str(row[5]))
         self.height_input.setText("" if row[6] is None else str(row[6]))
-        # medications_json -> repopulate text input with comma-separated present meds
-        if row[7]:
-            try:
-                meds_vec = json.loads(row[7])
-                present = [m for m, v in meds_vec.items() if v == 1]
-                self.med_input.setText(", ".join(present))
-            except Exception:
-                self.med_input.setText("")
-        else:
-            self.med_input.setText("")
-        # load summary if present
         # row[8] = overall_percentage
         if row[8] is not None:
             self.prob_value.setText(f"{row[8]:.2f} %")
         else:
             self.prob_value.setText("— %")
-
-        # row[9] = summary_json
-        if row[9]:
-            try:
-                summary = json.loads(row[9])
-                for i, eff in enumerate(SIDE_EFFECTS):
-                    d = summary.get(eff, {"prob": 0.0, "severity": "Not Probable", "color": "#e2e8f0"})
-                    bar = QProgressBar()
-                    bar.setValue(int(d["prob"]))
-                    bar.setFormat(f"{d['prob']}%")
-                    bar.setAlignment(Qt.AlignCenter)
-                    bar.setStyleSheet(
-                        f"QProgressBar::chunk {{ background-color: {d.get('color', '#e2e8f0')}; border-radius: 5px; }}")
-                    self.results_table.setCellWidget(i, 1, bar)
-                    self.results_table.setItem(i, 2, QTableWidgetItem(d.get("severity", "Not Probable")))
-            except Exception:
-                pass
+        # row[7] / row[9]: legacy JSON columns, only set on rows that could not be migrated
+        self.show_stored_results(row[0], row[7], row[9])
 
         QMessageBox.information(self, "Loaded", f"✅ Loaded record for {row[1]}")
 
+    def show_stored_results(self, pid, meds_json=None, summary_json=None):
+        """Fill the medication input and the SOC table from the stored records of patient ``pid``."""
+        with span("db.load_results"):
+            present = self.store.medications(pid)
+            summary = self.store.soc_results(pid)
+        try:
+            if meds_json:
+                present = [m for m, v in json.loads(meds_json).items() if v == 1]
+            if summary_json:
+                summary = json.loads(summary_json)
+        except Exception:
+            pass
+        self.med_input.setText(", ".join(present))
+
+        if summary:
+            for i, eff in enumerate(SIDE_EFFECTS):
+                d = summary.get(eff, {"prob": 0.0, "severity": "Not Probable", "color": "#e2e8f0"})
+                bar = QProgressBar()
+                bar.setValue(int(d["prob"]))
+                bar.setFormat(f"{d['prob']}%")
+                bar.setAlignment(Qt.AlignCenter)
+                bar.setStyleSheet(
+                    f"QProgressBar::chunk {{ background-color: {d.get('color', '#e2e8f0')}; border-radius: 5px; }}")
+                self.results_table.setCellWidget(i, 1, bar)
+                self.results_table.setItem(i, 2, QTableWidgetItem(d.get("severity", "Not Probable")))
+
     def open_browser(self):
         dlg = PatientBrowser(self, self.conn)
         if dlg.exec_() == QDialog.Accepted and dlg.selected_id:
@@ -1033,7 +868,6 @@ class CephaloPredictor(QWidget):
         If a patient is currently loaded, ask for confirmation to delete that one.
         Otherwise, open the browser to select which one to delete.
         """
-        cur = self.conn.cursor()
 
         if self.current_patient_id:
             # Confirm deletion of currently loaded patient
@@ -1045,8 +879,7 @@ class CephaloPredictor(QWidget):
                 QMessageBox.No,
             )
             if reply == QMessageBox.Yes:
-                cur.execute("DELETE FROM patients WHERE id = ?", (self.current_patient_id,))
-                self.conn.commit()
+                self.store.delete_patient(self.current_patient_id)
                 QMessageBox.information(self, "Deleted", "✅ Patient record deleted successfully.")
                 self.clear_form()
                 self.current_patient_id = None
@@ -1065,16 +898,14 @@ class CephaloPredictor(QWidget):
                     QMessageBox.No,
                 )
                 if reply == QMessageBox.Yes:
-                    cur.execute("DELETE FROM patients WHERE id = ?", (dlg.selected_id,))
-                    self.conn.commit()
+                    self.store.delete_patient(dlg.selected_id)
                     QMessageBox.information(self, "Deleted", "✅ Selected patient record deleted successfully.")
                 else:
                     QMessageBox.information(self, "Cancelled", "Deletion cancelled.")
 
     def load_patient_by_id(self, pid):
-        cur = self.conn.cursor()
-        cur.execute("SELECT id, name, age, sex, cephalosporin, weight, height, medications_json, overall_percentage, summary_json FROM patients WHERE id=?", (pid,))
-        row = cur.fetchone()
+        with span("db.load_patient"):
+            row = self.store.patient_row(pid)
         if not row:
             QMessageBox.warning(self, "Not Found", "Record not found.")
             return
@@ -1085,36 +916,13 @@ class CephaloPredictor(QWidget):
         self.cephalo_combo.setCurrentText(row[4])
         self.weight_input.setText("" if row[5] is None else str(row[5]))
         self.height_input.setText("" if row[6] is None else str(row[6]))
-        # repopulate meds input
-        if row[7]:
-            try:
-                mv = json.loads(row[7])
-                present = [m for m, v in mv.items() if v == 1]
-                self.med_input.setText(", ".join(present))
-            except Exception:
-                self.med_input.setText("")
         # row[8] = overall_percentage
         if row[8] is not None:
             self.prob_value.setText(f"{row[8]:.2f} %")
         else:
             self.prob_value.setText("— %")
-
-        # row[9] = summary_json
-        if row[9]:
-            try:
-                summary = json.loads(row[9])
-                for i, eff in enumerate(SIDE_EFFECTS):
-                    d = summary.get(eff, {"prob": 0.0, "severity": "Not Probable", "color": "#e2e8f0"})
-                    bar = QProgressBar()
-                    bar.setValue(int(d["prob"]))
-                    bar.setFormat(f"{d['prob']}%")
-                    bar.setAlignment(Qt.AlignCenter)
-                    bar.setStyleSheet(
-                        f"QProgressBar::chunk {{ background-color: {d.get('color', '#e2e8f0')}; border-radius: 5px; }}")
-                    self.results_table.setCellWidget(i, 1, bar)
-                    self.results_table.setItem(i, 2, QTableWidgetItem(d.get("severity", "Not Probable")))
-            except:
-                pass
+        # row[7] / row[9]: legacy JSON columns, only set on rows that could not be migrated
+        self.show_stored_results(row[0], row[7], row[9])
 
         QMessageBox.information(self, "Loaded", f"✅ Loaded patient ID {row[0]}: {row[1]}")
 
@@ -0,0 +1,205 @@
+"""
+Indexed medication matcher.
+
+Resolves the comma-separated names typed in the GUI to model feature columns.
+The vocabulary (medication feature columns plus the CSV medication list) is
+indexed once:
+
+* an exact, case-insensitive lookup (spaces around commas ignored, since the
+  completer rewrites "a,b" as "a, b"): the only thing ``resolve`` /
+  ``match_text`` use, so what reaches the model is a name the user typed or
+  picked from the completer, never a guess.  Many names contain commas
+  ("gentamicin, sulfate"), so ``split_text`` takes the longest run of
+  comma-separated tokens that is a name;
+* a sorted key list of normalised forms (case, punctuation and spacing
+  folded) for prefix ranges (bisect),
+* a trigram inverted index for infix and fuzzy hits, which is what catches the
+  spelling variants present in feature_names.csv (furosemide / fursemide /
+  frusemide, gentamicin / gentamycin sulfate, ...).
+
+The last two only feed suggestions: candidates are ranked exact > prefix >
+contains > fuzzy and carry the feature column indices they map to.
+"""
+import heapq
+import re
+from bisect import bisect_left
+from collections import Counter, namedtuple
+from itertools import chain
+
+Match = namedtuple("Match", ["name", "columns", "score"])
+
+_PUNCT = re.compile(r"[^\w]+")
+
+# minimum trigram Dice similarity for a purely fuzzy hit
+FUZZY_THRESHOLD = 0.55
+
+
+def normalize(name):
+    """Lowercase, turn punctuation into spaces and collapse whitespace."""
+    return " ".join(_PUNCT.sub(" ", str(name).lower()).split())
+
+
+def _comma_key(name):
+    """Lowercase with the spacing around commas dropped."""
+    return ",".join(p.strip() for p in str(name).split(",")).lower()
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class MedMatcher:
+    """
+    feature_names: model input columns (their positions become the column indices).
+    extra_names: other medication names to offer (e.g. load_med_list_from_csv); they
+    match but map to no column unless they are a feature name up to case.
+    skip: feature columns that are not medications.
+    """
+
+    def __init__(self, feature_names=(), extra_names=(), skip=("AGE_Y", "WEIGHT_KG", "HEIGHT_CM", "GENDER_CODE")):
+        skip = set(skip)
+        by_key = {}
+        for i, f in enumerate(feature_names):
+            if f in skip:
+                continue
+            key = normalize(f)
+            if key:
+                by_key.setdefault(key, [f, []])[1].append(i)
+        for name in extra_names:
+            key = normalize(name)
+            if key:
+                by_key.setdefault(key, [name, []])
+
+        # exact (case-insensitive) name -> [name, columns]; comma key -> exact key
+        self._exact = {}
+        for i, f in enumerate(feature_names):
+            if f not in skip and str(f).strip():
+                self._exact.setdefault(str(f).strip().lower(), [str(f).strip(), []])[1].append(i)
+        for name in extra_names:
+            if str(name).strip():
+                self._exact.setdefault(str(name).strip().lower(), [str(name).strip(), []])
+        self._by_comma_key = {}
+        for key in self._exact:
+            self._by_comma_key.setdefault(_comma_key(key), key)
+        self._max_commas = max((key.count(",") for key in self._exact), default=0)
+
+        self.keys = sorted(by_key)
+        self.names = [by_key[k][0] for k in self.keys]
+        self.columns = [tuple(by_key[k][1]) for k in self.keys]
+        self._id = {k: i for i, k in enumerate(self.keys)}
+        self._grams = [trigrams(k) for k in self.keys]
+        self._postings = {}
+        for i, grams in enumerate(self._grams):
+            for g in grams:
+                self._postings.setdefault(g, []).append(i)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _match(self, i, score):
+        return Match(self.names[i], self.columns[i], score)
+
+    def prefix_range(self, key, lo=0, hi=None):
+        """[lo, hi) slice of the sorted keys starting with normalised ``key``, optionally searched within a previous range."""
+        hi = len(self.keys) if hi is None else hi
+        lo = bisect_left(self.keys, key, lo, hi)
+        return lo, bisect_left(self.keys, key + "\uffff", lo, hi)
+
+    def _prefix_ids(self, key, k, lo=0, hi=None):
+        lo, hi = self.prefix_range(key, lo, hi)
+        return heapq.nsmallest(k, range(lo, hi), key=lambda i: (len(self.keys[i]), self.keys[i]))
+
+    def prefix(self, token, k=20):
+        """Entries whose normalised name starts with ``token``, shortest first."""
+        key = normalize(token)
+        if not key:
+            return []
+        return [self._match(i, 2.0 + len(key) / len(self.keys[i])) for i in self._prefix_ids(key, k)]
+
+    def candidates(self, token, k=10):
+        """Ranked matches for one typed token."""
+        key = normalize(token)
+        if not key:
+            return []
+        scores = {}
+        exact = self._id.get(key)
+        if exact is not None:
+            scores[exact] = 3.0
+        for i in self._prefix_ids(key, k):
+            scores.setdefault(i, 2.0 + len(key) / len(self.keys[i]))
+        if len(scores) >= k:
+            # prefix hits (score >= 2) always outrank infix/fuzzy ones (< 2)
+            return [self._match(i, sc) for i, sc in sorted(scores.items(), key=lambda t: -t[1])[:k]]
+
+        # shared-trigram counts over the posting lists of the token's trigrams
+        q = trigrams(key)
+        shared = Counter(chain.from_iterable(self._postings.get(g, ()) for g in q))
+        padded_key = f" {key} "
+        for i, n in shared.items():
+            if i in scores:
+                continue
+            dice = 2.0 * n / (len(q) + len(self._grams[i]))
+            name = self.keys[i]
+            # infix of what is being typed, or a whole vocabulary name inside the token
+            if key in name or f" {name} " in padded_key:
+                scores[i] = 1.0 + dice
+            elif dice >= FUZZY_THRESHOLD:
+                scores[i] = dice
+        best = sorted(scores.items(), key=lambda t: (-t[1], len(self.keys[t[0]]), self.keys[t[0]]))[:k]
+        return [self._match(i, s) for i, s in best]
+
+    def suggest(self, token, k=10, within=None):
+        """
+        Completion list for a token that is being typed: prefix hits first
+        (shortest names), topped up with infix/fuzzy candidates.  ``within`` is
+        the prefix range returned for a shorter version of the same token, so
+        each keystroke only bisects the previous slice.
+        Returns (names, prefix range).
+        """
+        key = normalize(token)
+        if not key:
+            return [], (0, len(self.keys))
+        lo, hi = self.prefix_range(key, *(within or (0, len(self.keys))))
+        ids = heapq.nsmallest(k, range(lo, hi), key=lambda i: (len(self.keys[i]), self.keys[i]))
+        names = [self.names[i] for i in ids]
+        if len(names) < k:
+            seen = set(names)
+            names += [m.name for m in self.candidates(key, k) if m.name not in seen][:k - len(names)]
+        return names, (lo, hi)
+
+    def resolve(self, token):
+        """
+        The entry named ``token`` (case-insensitive; spaces at the ends and
+        around commas ignored), or None.  No prefix or fuzzy guessing.
+        """
+        hit = self._exact.get(str(token).strip().lower())
+        if hit is None:
+            hit = self._exact.get(self._by_comma_key.get(_comma_key(token)))
+        return Match(hit[0], tuple(hit[1]), 3.0) if hit is not None else None
+
+    def split_text(self, text):
+        """
+        (matches, unmatched tokens) for the comma-separated tokens of ``text``;
+        neighbouring tokens that together are a name ("gentamicin, sulfate")
+        resolve as that one name.
+        """
+        parts = text.split(",")
+        matches, unmatched = [], []
+        i = 0
+        while i < len(parts):
+            for j in range(min(len(parts), i + self._max_commas + 1), i, -1):
+                m = self.resolve(",".join(parts[i:j]))
+                if m is not None:
+                    matches.append(m)
+                    i = j
+                    break
+            else:
+                if parts[i].strip():
+                    unmatched.append(parts[i].strip())
+                i += 1
+        return matches, unmatched
+
+    def match_text(self, text):
+        """Resolve every comma-separated token of ``text``; unmatched tokens are skipped."""
+        return self.split_text(text)[0]
@@ -0,0 +1,210 @@
+"""
+Single-file, memory-mapped bundle of the per-SOC CatBoost models.
+
+Replaces catboost.joblib (a pickled dict of 27 models) plus the
+feature_names.csv / soc_columns.csv sidecars.  Layout:
+
+    b"CEPHBNDL"            8-byte magic
+    uint32 version         little endian
+    uint64 header length
+    header                 UTF-8 JSON: features, feature_hash, socs[name, offset, length, crc32]
+    model blobs            CatBoost native .cbm bytes, each starting on a page boundary
+
+The file is opened with mmap, so the header is parsed without reading the
+blobs, and a model's bytes are read straight out of the mapping (no second
+copy of the file in memory) the first time that model is asked for.
+Deserialising builds the model in the process's own memory: processes do
+not share loaded models, and each pays the full size of what it loads.
+
+Build from the current artefacts with:
+    python model_bundle.py catboost.joblib feature_names.csv soc_columns.csv models.bundle
+"""
+import csv
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import zlib
+
+MAGIC = b"CEPHBNDL"
+BUNDLE_VERSION = 1
+PAGE = 4096
+BUNDLE_NAME = "models.bundle"
+_PREFIX = struct.Struct("<8sIQ")
+
+
+class BundleError(ValueError):
+    """The file is not a readable model bundle."""
+
+
+class BundleSchemaError(BundleError):
+    """The bundle's feature schema does not match what the caller expects."""
+
+
+def load_name_column(path):
+    """
+    Read a single-column CSV with a header row (feature_names.csv, soc_columns.csv)
+    into a list of stripped strings, without pandas.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        # pandas read empty cells as NaN -> "nan"; keep the same names
+        return [(row[0].strip() if row else "") or "nan" for row in reader]
+
+
+def feature_hash(feature_names):
+    return hashlib.sha256("\n".join(feature_names).encode("utf-8")).hexdigest()
+
+
+def _align(n):
+    return (n + PAGE - 1) // PAGE * PAGE
+
+
+def _model_bytes(model):
+    """Serialise a CatBoost model to its native binary (.cbm) format."""
+    fd, tmp = tempfile.mkstemp(suffix=".cbm")
+    os.close(fd)
+    try:
+        model.save_model(tmp, format="cbm")
+        with open(tmp, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(tmp)
+
+
+def write_bundle(path, models, feature_names, soc_names=None):
+    """
+    models: dict SOC name -> fitted CatBoost model; feature_names: model input
+    columns in training order; soc_names: output order (defaults to models' order).
+    Raises BundleSchemaError if a model was trained on other feature names.
+    """
+    feature_names = [str(f) for f in feature_names]
+    soc_names = list(soc_names) if soc_names else list(models)
+    blobs = []
+    for soc in soc_names:
+        model = models[soc]
+        trained = getattr(model, "feature_names_", None)
+        if trained is not None and len(trained) != len(feature_names):
+            raise BundleSchemaError(
+                f"model for {soc!r} was trained on {len(trained)} features, feature list has {len(feature_names)}")
+        if trained is not None and [str(f) for f in trained] != feature_names:
+            i = next(i for i, (a, b) in enumerate(zip(trained, feature_names)) if str(a) != b)
+            raise BundleSchemaError(
+                f"model for {soc!r} was trained on other features: column {i} is {trained[i]!r}, "
+                f"feature list has {feature_names[i]!r}")
+        blobs.append(_model_bytes(model))
+
+    def header_for(offset0):
+        socs, off = [], offset0
+        for soc, blob in zip(soc_names, blobs):
+            socs.append({"name": soc, "offset": off, "length": len(blob), "crc32": zlib.crc32(blob)})
+            off = _align(off + len(blob))
+        return json.dumps({
+            "version": BUNDLE_VERSION,
+            "features": feature_names,
+            "feature_hash": feature_hash(feature_names),
+            "socs": socs,
+        }).encode("utf-8")
+
+    # offsets depend on the header size and vice versa; grow start until the header fits before it
+    start = _align(_PREFIX.size + len(header_for(0)) + 64)
+    header = header_for(start)
+    while _PREFIX.size + len(header) > start:
+        start = _align(_PREFIX.size + len(header))
+        header = header_for(start)
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_PREFIX.pack(MAGIC, BUNDLE_VERSION, len(header)))
+        f.write(header)
+        for entry, blob in zip(json.loads(header)["socs"], blobs):
+            f.seek(entry["offset"])
+            f.write(blob)
+    os.replace(tmp, path)
+
+
+class ModelBundle:
+    """Read-only view of a bundle file; models are deserialised on first access."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mm) < _PREFIX.size:
+            raise BundleError(f"{path}: file too short to be a model bundle")
+        magic, version, header_len = _PREFIX.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise BundleError(f"{path}: not a model bundle")
+        if version != BUNDLE_VERSION:
+            raise BundleError(f"{path}: bundle version {version}, this app reads version {BUNDLE_VERSION}")
+        header = json.loads(self._mm[_PREFIX.size:_PREFIX.size + header_len].decode("utf-8"))
+        self.feature_names = header["features"]
+        self.feature_hash = header["feature_hash"]
+        if feature_hash(self.feature_names) != self.feature_hash:
+            raise BundleSchemaError(f"{path}: feature list does not match its recorded hash")
+        self._entries = {e["name"]: e for e in header["socs"]}
+        self.soc_names = [e["name"] for e in header["socs"]]
+        self._models = {}
+
+    def check_features(self, expected):
+        """Raise BundleSchemaError unless ``expected`` is exactly the bundle's feature list."""
+        expected = [str(f) for f in expected]
+        if feature_hash(expected) == self.feature_hash:
+            return
+        if len(expected) != len(self.feature_names):
+            raise BundleSchemaError(
+                f"feature schema mismatch: bundle has {len(self.feature_names)} features, expected {len(expected)}")
+        i = next(i for i, (a, b) in enumerate(zip(self.feature_names, expected)) if a != b)
+        raise BundleSchemaError(
+            f"feature schema mismatch at column {i}: bundle has {self.feature_names[i]!r}, expected {expected[i]!r}")
+
+    def blob(self, soc):
+        """The .cbm bytes of one model (a copy out of the mapping), CRC-checked."""
+        e = self._entries[soc]
+        data = self._mm[e["offset"]:e["offset"] + e["length"]]
+        if zlib.crc32(data) != e["crc32"]:
+            raise BundleError(f"{self.path}: model blob for {soc!r} is corrupted")
+        return data
+
+    def model(self, soc):
+        if soc not in self._models:
+            from catboost import CatBoostClassifier
+
+            m = CatBoostClassifier()
+            m.load_model(blob=self.blob(soc))
+            n = len(m.feature_names_ or ())
+            if n and n != len(self.feature_names):
+                raise BundleSchemaError(
+                    f"model for {soc!r} expects {n} features, bundle lists {len(self.feature_names)}")
+            self._models[soc] = m
+        return self._models[soc]
+
+    def models(self):
+        """dict SOC name -> model, in bundle order (loads every model)."""
+        return {soc: self.model(soc) for soc in self.soc_names}
+
+    def close(self):
+        self._mm.close()
+
+
+def main(argv):
+    if len(argv) != 5:
+        print("usage: python model_bundle.py catboost.joblib feature_names.csv soc_columns.csv out.bundle")
+        return 2
+    import joblib
+
+    models = joblib.load(argv[1])
+    features = load_name_column(argv[2])
+    socs = load_name_column(argv[3])
+    write_bundle(argv[4], models, features, socs)
+    b = ModelBundle(argv[4])
+    print(f"Wrote {argv[4]}: {len(b.soc_names)} models, {len(b.feature_names)} features")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
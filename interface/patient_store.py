@@ -0,0 +1,379 @@
+"""
+SQLite storage for patients and their predictions (patients.db).
+
+``PatientStore`` owns the single connection the app uses:
+
+* WAL journal, synchronous=NORMAL and a larger page cache, so a save is an
+  append to the WAL instead of a rollback-journal fsync dance;
+* the schema is versioned with ``PRAGMA user_version`` and each migration in
+  ``MIGRATIONS`` runs exactly once;
+* statements are fixed module-level strings, so sqlite3's statement cache
+  re-uses the prepared statements;
+* bulk imports go through ``BatchWriter``: one transaction per few thousand
+  patients with ``executemany`` for the child rows.
+
+Medications and SOC results are stored relationally rather than as the JSON
+blobs the ``patients`` table used to carry (medications_json held a 0/1 flag
+for *every* medication, ~250 KB a row):
+
+    medication(id, name)                          vocabulary, one row per name
+    soc(id, name)                                 SOC vocabulary
+    patient_medication(patient_id, med_id)        only the medications in use
+    patient_soc_result(patient_id, soc_id, prob, severity)
+
+so questions such as "patients on cefepime with Nervous system prob > 50 %"
+are plain SQL (see ``patients_with``).
+
+Bulk import from a JSON-lines file (one patient object per line):
+    python patient_store.py import records.jsonl [patients.db]
+"""
+import json
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+
+SEVERITY_COLORS = {
+    "Not Probable": "#22c55e",
+    "Probable": "#facc15",
+    "Very Probable": "#ef4444",
+}
+DEFAULT_COLOR = "#e2e8f0"
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA busy_timeout = 5000",
+)
+
+# columns added to the original patients table over time (legacy files may lack some)
+PATIENT_COLUMNS = (
+    ("weight", "REAL"),
+    ("height", "REAL"),
+    ("medications_json", "TEXT"),
+    ("timestamp", "TEXT"),
+    ("overall_percentage", "REAL"),
+)
+
+NORMALISED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS medication (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS soc (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS patient_medication (
+    patient_id INTEGER NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+    med_id INTEGER NOT NULL REFERENCES medication(id),
+    PRIMARY KEY (patient_id, med_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_patient_medication_med ON patient_medication(med_id, patient_id);
+CREATE TABLE IF NOT EXISTS patient_soc_result (
+    patient_id INTEGER NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+    soc_id INTEGER NOT NULL REFERENCES soc(id),
+    prob REAL NOT NULL,
+    severity TEXT NOT NULL,
+    PRIMARY KEY (patient_id, soc_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_patient_soc_result_soc ON patient_soc_result(soc_id, prob);
+CREATE INDEX IF NOT EXISTS idx_patients_name ON patients(IFNULL(name, ''), id);
+CREATE INDEX IF NOT EXISTS idx_patients_age ON patients(IFNULL(age, -1), id);
+CREATE INDEX IF NOT EXISTS idx_patients_cephalosporin ON patients(IFNULL(cephalosporin, ''), id);
+CREATE INDEX IF NOT EXISTS idx_patients_timestamp ON patients(IFNULL(timestamp, ''), id)
+"""
+# (the idx_patients_* expressions are the sort orders of patient_table.COLUMNS)
+
+PATIENT_FIELDS = ("name", "age", "sex", "cephalosporin", "weight", "height", "overall_percentage", "timestamp")
+
+INSERT_PATIENT = f"INSERT INTO patients ({', '.join(PATIENT_FIELDS)}) VALUES ({', '.join('?' * len(PATIENT_FIELDS))})"
+UPDATE_PATIENT = (f"UPDATE patients SET {', '.join(f + '=?' for f in PATIENT_FIELDS)},"
+                  " medications_json=NULL, summary_json=NULL WHERE id=?")
+SELECT_PATIENT = ("SELECT id, name, age, sex, cephalosporin, weight, height, medications_json,"
+                  " overall_percentage, summary_json FROM patients")
+DELETE_MEDICATIONS = "DELETE FROM patient_medication WHERE patient_id = ?"
+INSERT_MEDICATION = "INSERT OR IGNORE INTO patient_medication (patient_id, med_id) VALUES (?, ?)"
+DELETE_SOC_RESULTS = "DELETE FROM patient_soc_result WHERE patient_id = ?"
+INSERT_SOC_RESULT = "INSERT INTO patient_soc_result (patient_id, soc_id, prob, severity) VALUES (?, ?, ?, ?)"
+
+
+# ---------------- migrations (MIGRATIONS[i] brings a file to user_version i + 1) ----------------
+def _create_patients(store):
+    """The original table; files created by older versions get the columns added since."""
+    store.conn.execute("""
+        CREATE TABLE IF NOT EXISTS patients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            age INTEGER,
+            sex TEXT,
+            cephalosporin TEXT,
+            summary_json TEXT
+        )
+    """)
+    cols = {r[1] for r in store.conn.execute("PRAGMA table_info(patients)")}
+    for name, coltype in PATIENT_COLUMNS:
+        if name not in cols:
+            store.conn.execute(f"ALTER TABLE patients ADD COLUMN {name} {coltype}")
+
+
+def _create_normalised_tables(store):
+    for stmt in NORMALISED_SCHEMA.split(";"):
+        store.conn.execute(stmt)
+
+
+def _migrate_json_columns(store):
+    """Move medications_json / summary_json into the normalised tables."""
+    rows = store.conn.execute("""
+        SELECT id, medications_json, summary_json FROM patients
+        WHERE medications_json IS NOT NULL OR summary_json IS NOT NULL
+    """).fetchall()
+    for pid, meds_json, summary_json in rows:
+        try:
+            if meds_json:
+                store.set_medications(pid, json.loads(meds_json))
+            if summary_json:
+                store.set_soc_results(pid, json.loads(summary_json))
+        except (ValueError, AttributeError) as e:
+            # leave the JSON in place so nothing is lost
+            print(f"Warning: could not migrate patient {pid}:", e)
+            continue
+        store.conn.execute("UPDATE patients SET medications_json = NULL, summary_json = NULL WHERE id = ?", (pid,))
+    store.needs_vacuum = bool(rows)
+
+
+MIGRATIONS = (_create_patients, _create_normalised_tables, _migrate_json_columns)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+class PatientStore:
+    """The app's connection to patients.db; use it from one thread (the GUI thread)."""
+
+    def __init__(self, path):
+        self.path = path
+        # autocommit mode: transactions are explicit (see transaction())
+        self.conn = sqlite3.connect(path, isolation_level=None, cached_statements=128)
+        for pragma in PRAGMAS:
+            self.conn.execute(pragma)
+        self._med_ids = {}
+        self._soc_ids = {}
+        self.needs_vacuum = False
+        self.migrate()
+        self._load_vocabularies()
+
+    def close(self):
+        self.conn.close()
+
+    @contextmanager
+    def transaction(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            # ids handed out inside the rolled-back transaction are gone
+            self._load_vocabularies()
+            raise
+        self.conn.execute("COMMIT")
+
+    def migrate(self):
+        """Run the migrations this file has not seen yet; returns the schema version."""
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            print(f"Warning: {self.path} has schema version {version}, this app knows up to {SCHEMA_VERSION}")
+            return version
+        for version, step in enumerate(MIGRATIONS[version:], version + 1):
+            with self.transaction():
+                step(self)
+                self.conn.execute(f"PRAGMA user_version = {version}")
+            print(f"{self.path}: migrated to schema version {version}")
+        if self.needs_vacuum:
+            # give the space of the dropped JSON blobs back to the file system
+            self.conn.execute("VACUUM")
+            self.needs_vacuum = False
+        return version
+
+    # ---------------- vocabularies ----------------
+    def _load_vocabularies(self):
+        tables = {r[0] for r in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self._med_ids = dict(self.conn.execute("SELECT name, id FROM medication")) if "medication" in tables else {}
+        self._soc_ids = dict(self.conn.execute("SELECT name, id FROM soc")) if "soc" in tables else {}
+
+    def _vocab_id(self, table, cache, name):
+        i = cache.get(name)
+        if i is None:
+            self.conn.execute(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", (name,))
+            i = self.conn.execute(f"SELECT id FROM {table} WHERE name = ?", (name,)).fetchone()[0]
+            cache[name] = i
+        return i
+
+    def med_id(self, name):
+        return self._vocab_id("medication", self._med_ids, name)
+
+    def soc_id(self, name):
+        return self._vocab_id("soc", self._soc_ids, name)
+
+    # ---------------- writes ----------------
+    def set_medications(self, patient_id, meds):
+        """meds: names in use, or the legacy {name: 0/1} dict. Call inside a transaction."""
+        if isinstance(meds, dict):
+            meds = [m for m, used in meds.items() if used == 1]
+        self.conn.execute(DELETE_MEDICATIONS, (patient_id,))
+        self.conn.executemany(INSERT_MEDICATION, [(patient_id, self.med_id(m)) for m in meds])
+
+    def set_soc_results(self, patient_id, summary):
+        """summary: {soc: {"prob": percent, "severity": label, ...}} as built by probability_model."""
+        self.conn.execute(DELETE_SOC_RESULTS, (patient_id,))
+        self.conn.executemany(INSERT_SOC_RESULT, self._soc_rows(patient_id, summary))
+
+    def _soc_rows(self, patient_id, summary):
+        return [(patient_id, self.soc_id(soc), float(d.get("prob", 0.0)), d.get("severity", "Not Probable"))
+                for soc, d in summary.items()]
+
+    def save_prediction(self, patient, meds, summary, patient_id=None):
+        """
+        Insert (or, with ``patient_id``, overwrite) one patient with its
+        medications and SOC results in a single transaction. ``patient`` maps
+        PATIENT_FIELDS to values. Returns the patient id.
+        """
+        values = tuple(patient.get(f) for f in PATIENT_FIELDS)
+        with self.transaction():
+            if patient_id:
+                self.conn.execute(UPDATE_PATIENT, values + (patient_id,))
+            else:
+                patient_id = self.conn.execute(INSERT_PATIENT, values).lastrowid
+            self.set_medications(patient_id, meds)
+            self.set_soc_results(patient_id, summary)
+        return patient_id
+
+    def delete_patient(self, patient_id):
+        """Remove a patient; medications and SOC results go with it (ON DELETE CASCADE)."""
+        with self.transaction():
+            self.conn.execute("DELETE FROM patients WHERE id = ?", (patient_id,))
+
+    def batch_writer(self, batch_size=5000):
+        return BatchWriter(self, batch_size)
+
+    # ---------------- reads ----------------
+    def patient_row(self, patient_id=None):
+        """
+        (id, name, age, sex, cephalosporin, weight, height, medications_json,
+        overall_percentage, summary_json) of ``patient_id``, or of the newest
+        patient when it is None.
+        """
+        if patient_id is None:
+            return self.conn.execute(SELECT_PATIENT + " ORDER BY id DESC LIMIT 1").fetchone()
+        return self.conn.execute(SELECT_PATIENT + " WHERE id = ?", (patient_id,)).fetchone()
+
+    def medications(self, patient_id):
+        rows = self.conn.execute("""
+            SELECT m.name FROM patient_medication pm JOIN medication m ON m.id = pm.med_id
+            WHERE pm.patient_id = ? ORDER BY m.name
+        """, (patient_id,))
+        return [r[0] for r in rows]
+
+    def soc_results(self, patient_id):
+        """The stored summary in probability_model's format (colour derived from severity)."""
+        rows = self.conn.execute("""
+            SELECT s.name, r.prob, r.severity FROM patient_soc_result r JOIN soc s ON s.id = r.soc_id
+            WHERE r.patient_id = ?
+        """, (patient_id,))
+        return {soc: {"prob": prob, "severity": sev, "color": SEVERITY_COLORS.get(sev, DEFAULT_COLOR)}
+                for soc, prob, sev in rows}
+
+    def patients_with(self, medication=None, soc=None, min_prob=None):
+        """
+        Ids of patients on ``medication`` and/or whose ``soc`` probability (percent)
+        exceeds ``min_prob``, newest first, e.g. patients_with("cefepime", "Nervous system disorders", 50).
+        """
+        sql, params = ["SELECT p.id FROM patients p"], []
+        if medication is not None:
+            sql.append("JOIN patient_medication pm ON pm.patient_id = p.id"
+                       " JOIN medication m ON m.id = pm.med_id AND m.name = ?")
+            params.append(medication)
+        if soc is not None:
+            sql.append("JOIN patient_soc_result r ON r.patient_id = p.id"
+                       " JOIN soc s ON s.id = r.soc_id AND s.name = ?")
+            params.append(soc)
+            if min_prob is not None:
+                sql.append("AND r.prob > ?")
+                params.append(min_prob)
+        sql.append("ORDER BY p.id DESC")
+        return [r[0] for r in self.conn.execute(" ".join(sql), params)]
+
+
+class BatchWriter:
+    """
+    Buffers new patients and writes them ``batch_size`` at a time, one
+    transaction per batch. Use it as a context manager so the tail is flushed:
+
+        with store.batch_writer() as w:
+            for rec in records:
+                w.add(rec, rec["meds"], rec["summary"])
+    """
+
+    def __init__(self, store, batch_size=5000):
+        self.store = store
+        self.batch_size = batch_size
+        self.written = 0
+        self._pending = []
+
+    def add(self, patient, meds=(), summary=None):
+        if isinstance(meds, dict):
+            meds = [m for m, used in meds.items() if used == 1]
+        self._pending.append((tuple(patient.get(f) for f in PATIENT_FIELDS), list(meds), summary or {}))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        store, conn = self.store, self.store.conn
+        med_rows, soc_rows = [], []
+        # every parent id is created in this same transaction, so the per-row
+        # foreign key lookups are skipped (the pragma cannot change inside one)
+        conn.execute("PRAGMA foreign_keys = OFF")
+        try:
+            with store.transaction():
+                for values, meds, summary in self._pending:
+                    pid = conn.execute(INSERT_PATIENT, values).lastrowid
+                    med_rows.extend((pid, store.med_id(m)) for m in meds)
+                    soc_rows.extend(store._soc_rows(pid, summary))
+                conn.executemany(INSERT_MEDICATION, med_rows)
+                conn.executemany(INSERT_SOC_RESULT, soc_rows)
+        finally:
+            conn.execute("PRAGMA foreign_keys = ON")
+        self.written += len(self._pending)
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        return False
+
+
+def main(argv):
+    if len(argv) not in (3, 4) or argv[1] != "import":
+        print("usage: python patient_store.py import records.jsonl [patients.db]")
+        return 2
+    store = PatientStore(argv[3] if len(argv) == 4 else "patients.db")
+    t0 = time.perf_counter()
+    with open(argv[2], encoding="utf-8") as f, store.batch_writer() as writer:
+        for line in f:
+            if line.strip():
+                rec = json.loads(line)
+                writer.add(rec, rec.get("meds") or (), rec.get("summary"))
+    dt = time.perf_counter() - t0
+    print(f"Imported {writer.written} patients in {dt:.2f}s ({writer.written / max(dt, 1e-9):,.0f}/s)")
+    store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,111 @@
+"""
+Lazily paged table model over the ``patients`` table for the patient browser.
+
+Rows are fetched a page at a time as the view scrolls (``canFetchMore`` /
+``fetchMore``) with keyset pagination: each page continues after the sort key
+and id of the last row already loaded instead of using OFFSET, so every page
+is an index range scan no matter how deep the user scrolls.  Sorting and the
+name/cephalosporin filter are applied in SQL, never in Python.
+"""
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+# header, column, sort expression (must match the index expressions in patient_store.SCHEMA)
+COLUMNS = (
+    ("ID", "id", "id"),
+    ("Name", "name", "IFNULL(name, '')"),
+    ("Age", "age", "IFNULL(age, -1)"),
+    ("Sex", "sex", None),
+    ("Cephalosporin", "cephalosporin", "IFNULL(cephalosporin, '')"),
+    ("Timestamp", "timestamp", "IFNULL(timestamp, '')"),
+)
+
+
+class PatientTableModel(QAbstractTableModel):
+    def __init__(self, conn, page_size=200, parent=None):
+        super().__init__(parent)
+        self.conn = conn
+        self.page_size = page_size
+        self._rows = []          # (id, name, age, sex, cephalosporin, timestamp, sort key)
+        self._exhausted = False
+        self._sort_column = 0
+        self._descending = True
+        self._filter = ""
+
+    # ---------------- Qt model interface ----------------
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        val = self._rows[index.row()][index.column()]
+        return "" if val is None else str(val)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return COLUMNS[section][0]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._exhausted:
+            return
+        page = self._query_page()
+        if len(page) < self.page_size:
+            self._exhausted = True
+        if page:
+            self.beginInsertRows(QModelIndex(), len(self._rows), len(self._rows) + len(page) - 1)
+            self._rows.extend(page)
+            self.endInsertRows()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        if COLUMNS[column][2] is None:
+            return
+        self._sort_column = column
+        self._descending = order == Qt.DescendingOrder
+        self.reload()
+
+    # ---------------- paging ----------------
+    def set_filter(self, text):
+        """Show only patients whose name or cephalosporin starts with ``text`` (case-insensitive)."""
+        self._filter = text.strip()
+        self.reload()
+
+    def reload(self):
+        self.beginResetModel()
+        self._rows = []
+        self._exhausted = False
+        self.endResetModel()
+        self.fetchMore()
+
+    def patient_id(self, row):
+        return self._rows[row][0]
+
+    def _query_page(self):
+        key = COLUMNS[self._sort_column][2]
+        direction, cmp = ("DESC", "<") if self._descending else ("ASC", ">")
+        where, params = [], []
+        if self._filter:
+            where.append("(name LIKE ? ESCAPE '\\' OR cephalosporin LIKE ? ESCAPE '\\')")
+            pattern = self._filter.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            params += [pattern, pattern]
+        if self._rows:
+            # keyset: continue after the last loaded (sort key, id)
+            last = self._rows[-1]
+            if key == "id":
+                where.append(f"id {cmp} ?")
+                params.append(last[0])
+            else:
+                # spelled out rather than as a row value so SQLite seeks the index
+                where.append(f"{key} {cmp}= ? AND ({key} {cmp} ? OR id {cmp} ?)")
+                params += [last[-1], last[-1], last[0]]
+        sql = (f"SELECT id, name, age, sex, cephalosporin, timestamp, {key} FROM patients"
+               + (" WHERE " + " AND ".join(where) if where else "")
+               + f" ORDER BY {key} {direction}" + ("" if key == "id" else f", id {direction}")
+               + " LIMIT ?")
+        return self.conn.execute(sql, params + [self.page_size]).fetchall()
@@ -0,0 +1,183 @@
+"""
+Year x age x sex population cube of Canada.
+
+``03 Data Demonstration`` interpolates every age between the 2016 and 2021
+censuses in Python loops (``N(y) = N2016 * exp(r * (y - 2016))`` with
+``r = ln(N2021 / N2016) / 5``, 0 if either count is 0) and writes
+canada_interp_total/men/women.parquet for 2016-2024; ``risk_model.pop_df``
+then re-aggregated those frames with ``group_by("Age").mean()`` on every
+prediction.  Here the whole (year, age, sex) cube is one NumPy broadcast,
+for any span of years (years after 2021 are extrapolated with the same
+rate), and is stored as population.npz next to the risk data.  The
+per-age population shares (``P_pob``) averaged over ``AVERAGE_YEARS`` and
+for every single year are computed once when the cube is made, so
+``weights`` is a lookup.
+
+Build offline with:
+    python population.py [census_dir] [data_dir] [--last-year 2035] [--interp-parquets]
+"""
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+
+SEXES = ("Total", "Men", "Women")  # census column names
+BASE_YEAR, CENSUS_YEAR = 2016, 2021
+AVERAGE_YEARS = (2016, 2024)  # the span the canada_interp_* files cover
+CUBE_VERSION = 1
+CUBE_NAME = "population.npz"
+CENSUS_DIR = Path(__file__).resolve().parent.parent / "data" / "processed"
+
+
+def sex_column(gender):
+    """Census column of a GENDER_ENG value; anything but Male/Female is the total population."""
+    return {"Male": "Men", "Female": "Women"}.get(gender, "Total")
+
+
+def interpolate(base, census, years, base_year=BASE_YEAR, census_year=CENSUS_YEAR):
+    """
+    (len(years), *base.shape) exponential interpolation / extrapolation of
+    the counts ``base`` (at ``base_year``) through ``census`` (at ``census_year``).
+    """
+    base = np.asarray(base, dtype=np.float64)
+    census = np.asarray(census, dtype=np.float64)
+    ok = (base > 0) & (census > 0)
+    # ln(1) = 0: no growth where either count is 0
+    rate = np.log(np.where(ok, census, 1.0) / np.where(ok, base, 1.0)) / (census_year - base_year)
+    t = np.asarray(years, dtype=np.float64) - base_year
+    return base[None] * np.exp(rate[None] * t.reshape((-1,) + (1,) * base.ndim))
+
+
+def _shares(counts):
+    """Population share of each age (axis -2) within each sex."""
+    total = counts.sum(axis=-2, keepdims=True)
+    return np.divide(counts, total, out=np.zeros_like(counts), where=total > 0)
+
+
+class PopulationCube:
+    """Population counts by (year, age, sex) with their per-age shares precomputed."""
+
+    def __init__(self, years, ages, counts, average_years=AVERAGE_YEARS):
+        self.years = np.asarray(years, dtype=np.int64)
+        self.ages = np.asarray(ages, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.float64)
+        if self.counts.shape != (self.years.size, self.ages.size, len(SEXES)):
+            raise ValueError(f"counts of shape {self.counts.shape} do not match "
+                             f"{self.years.size} years x {self.ages.size} ages x {len(SEXES)} sexes")
+        self.average_years = tuple(int(y) for y in average_years)
+        lo, hi = self.average_years
+        span = (self.years >= lo) & (self.years <= hi)
+        if not span.any():
+            raise ValueError(f"no year of {self.years[0]}-{self.years[-1]} in the averaging span {lo}-{hi}")
+        self.average = self.counts[span].mean(axis=0)  # (age, sex), the old group_by("Age").mean()
+        self.average_shares = _shares(self.average)
+        self.shares = _shares(self.counts)
+        self._year_index = {int(y): i for i, y in enumerate(self.years)}
+
+    def weights(self, gender=None, year=None):
+        """
+        (ages, counts, shares) for ``gender`` (Male / Female / anything else
+        = total): averaged over ``average_years``, or of a single ``year``.
+        """
+        s = SEXES.index(sex_column(gender))
+        if year is None:
+            return self.ages, self.average[:, s], self.average_shares[:, s]
+        try:
+            i = self._year_index[int(year)]
+        except KeyError:
+            raise ValueError(f"year {year} outside the cube ({self.years[0]}-{self.years[-1]})") from None
+        return self.ages, self.counts[i, :, s], self.shares[i, :, s]
+
+    # ---------------- construction ----------------
+    @classmethod
+    def from_census(cls, census_2016, census_2021, last_year=AVERAGE_YEARS[1], average_years=AVERAGE_YEARS):
+        """From the two census frames (Age, Total, Men, Women), interpolated for 2016..``last_year``."""
+        census_2016 = census_2016.sort("Age")
+        census_2021 = census_2021.sort("Age")
+        ages = census_2016["Age"].to_numpy()
+        if not np.array_equal(ages, census_2021["Age"].to_numpy()):
+            raise ValueError("the two censuses do not have the same ages")
+        years = np.arange(BASE_YEAR, last_year + 1)
+        counts = interpolate(census_2016.select(SEXES).to_numpy(), census_2021.select(SEXES).to_numpy(), years)
+        return cls(years, ages, counts, average_years)
+
+    @classmethod
+    def from_interp_frames(cls, dfs, average_years=AVERAGE_YEARS):
+        """From the canada_interp_total/men/women frames of ``dfs`` (``risk_model.load_parquets``)."""
+        frames = {"Total": "canada_interp_total", "Men": "canada_interp_men", "Women": "canada_interp_women"}
+        missing = [name for name in frames.values() if dfs.get(name) is None]
+        if missing:
+            raise RuntimeError(f"Needed population parquet not found ({', '.join(missing)}).")
+        first = dfs[frames["Total"]].sort("Census Year", "Age")
+        years = np.unique(first["Census Year"].to_numpy())
+        ages = np.unique(first["Age"].to_numpy())
+        counts = np.zeros((years.size, ages.size, len(SEXES)))
+        for s, sex in enumerate(SEXES):
+            df = dfs[frames[sex]]
+            yi = np.searchsorted(years, df["Census Year"].to_numpy())
+            ai = np.searchsorted(ages, df["Age"].to_numpy())
+            counts[yi, ai, s] = df[sex].to_numpy()
+        return cls(years, ages, counts, average_years)
+
+    def interp_frames(self):
+        """{canada_interp_*: frame} in the notebook's layout (Census Year, Age, <sex>)."""
+        import polars as pl
+
+        names = {"Total": "canada_interp_total", "Men": "canada_interp_men", "Women": "canada_interp_women"}
+        year = np.repeat(self.years, self.ages.size)
+        age = np.tile(self.ages, self.years.size)
+        # the notebook's frames are ordered age-major
+        order = np.lexsort((year, age))
+        return {names[sex]: pl.DataFrame({"Census Year": year[order], "Age": age[order],
+                                          sex: self.counts[:, :, s].reshape(-1)[order]})
+                for s, sex in enumerate(SEXES)}
+
+    # ---------------- persistence ----------------
+    def save(self, path):
+        np.savez(path, version=np.array(CUBE_VERSION), years=self.years, ages=self.ages, counts=self.counts,
+                 sexes=np.array(SEXES), average_years=np.array(self.average_years))
+
+    @classmethod
+    def load(cls, path):
+        """The stored cube, or None if it is missing or from another version."""
+        try:
+            with np.load(path) as z:
+                if int(z["version"]) != CUBE_VERSION or tuple(z["sexes"]) != SEXES:
+                    return None
+                return cls(z["years"], z["ages"], z["counts"], tuple(z["average_years"]))
+        except (FileNotFoundError, KeyError, ValueError):
+            return None
+
+
+def main(argv=None):
+    import risk_model
+
+    ap = argparse.ArgumentParser(description="Build the population cube from the 2016 and 2021 censuses.")
+    ap.add_argument("census_dir", nargs="?", type=Path, default=CENSUS_DIR,
+                    help="folder with canada_census_2016/2021.parquet")
+    ap.add_argument("data_dir", nargs="?", type=Path, default=risk_model.DATA_DIR,
+                    help="folder the risk model reads (population.npz is written there)")
+    ap.add_argument("--last-year", type=int, default=2035, help="extrapolate up to this year")
+    ap.add_argument("--interp-parquets", action="store_true",
+                    help="also rewrite canada_interp_total/men/women.parquet (2016-2024)")
+    args = ap.parse_args(argv)
+
+    import polars as pl
+    c2016 = pl.read_parquet(args.census_dir / "canada_census_2016.parquet")
+    c2021 = pl.read_parquet(args.census_dir / "canada_census_2021.parquet")
+    cube = PopulationCube.from_census(c2016, c2021, last_year=args.last_year)
+    cube.save(args.data_dir / CUBE_NAME)
+    print(f"Saved population cube {cube.counts.shape} ({cube.years[0]}-{cube.years[-1]}) "
+          f"to {args.data_dir / CUBE_NAME}")
+    if args.interp_parquets:
+        lo, hi = AVERAGE_YEARS
+        notebook_span = PopulationCube.from_census(c2016, c2021, last_year=hi)
+        for name, df in notebook_span.interp_frames().items():
+            df.write_parquet(args.data_dir / f"{name}.parquet")
+            print(f"Wrote {args.data_dir / name}.parquet ({df.height} rows)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+"""
+Local HTTP prediction service.
+
+One process loads the models and risk data once (scoring.Scorer) and serves
+every workstation on the network:
+
+    POST /predict   {"age": 40, "sex": "Male", "weight": 70, "height": 170,
+                     "cephalosporin": "cefepime", "medications": "furosemide, gentamicin"}
+                 -> {"overall_percentage": ..., "summary": {SOC: {"prob", "severity", "color"}}}
+    GET  /stats     request count, batch sizes and latency percentiles
+    GET  /health
+
+Concurrent /predict requests are coalesced by ``MicroBatcher``: the first
+request of a batch waits at most ``max_wait`` seconds for others to arrive and
+up to ``max_batch`` patients are scored in one engine call.  Requests are
+validated one by one before they are queued (a bad one gets a 400 alone),
+and if a batch still fails it is re-scored item by item so only the request
+that fails gets the error.  Only the standard
+library is used for the server (http.server), so it runs on localhost with no
+other services.
+
+usage:
+    python predict_server.py [--host 127.0.0.1] [--port 8765] [--max-batch 64] [--max-wait-ms 5]
+                             [--models DIR] [--data DIR]
+"""
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from scoring import Scorer, clean_patient, summarize
+
+
+class LatencyStats:
+    """Rolling window of request latencies (seconds) with percentiles."""
+
+    def __init__(self, window=10000):
+        self._samples = deque(maxlen=window)
+        self._batch_sizes = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+
+    def add_request(self, seconds):
+        with self._lock:
+            self.requests += 1
+            self._samples.append(seconds)
+
+    def add_batch(self, size):
+        with self._lock:
+            self.batches += 1
+            self._batch_sizes.append(size)
+
+    def snapshot(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            sizes = list(self._batch_sizes)
+            requests, batches = self.requests, self.batches
+
+        def pct(q):
+            if not samples:
+                return None
+            return round(1000 * samples[min(len(samples) - 1, int(q / 100 * len(samples)))], 3)
+
+        return {
+            "requests": requests,
+            "batches": batches,
+            "mean_batch_size": round(sum(sizes) / len(sizes), 2) if sizes else None,
+            "latency_ms": {"p50": pct(50), "p90": pct(90), "p99": pct(99), "max": pct(100)},
+        }
+
+
+class MicroBatcher:
+    """
+    Collects items submitted from many threads and hands them to
+    ``fn(items) -> results`` in batches from one worker thread.
+    ``submit`` returns a Future resolved with the item's result.  When
+    ``fn`` raises for a batch, each item is retried on its own and only the
+    futures of the items that fail get the exception.
+    """
+
+    def __init__(self, fn, max_batch=64, max_wait=0.005, stats=None):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.stats = stats
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        fut = Future()
+        self._queue.put((item, fut))
+        return fut
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _loop(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    nxt = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    self._queue.put(None)
+                    break
+                batch.append(nxt)
+            if self.stats is not None:
+                self.stats.add_batch(len(batch))
+            try:
+                results = self.fn([item for item, _ in batch])
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                else:
+                    self._one_by_one(batch)
+                continue
+            for (_, fut), res in zip(batch, results):
+                fut.set_result(res)
+
+    def _one_by_one(self, batch):
+        for item, fut in batch:
+            try:
+                fut.set_result(self.fn([item])[0])
+            except Exception as e:
+                fut.set_exception(e)
+
+
+def parse_patient(body):
+    """
+    Validate a /predict body the way predict_and_save validates the form
+    (scoring.clean_patient: age and sex required, sex Male or Female, a known
+    cephalosporin or none, meds a string or a list of strings); raises
+    ValueError.
+    """
+    if not isinstance(body, dict):
+        raise ValueError("request body must be a JSON object")
+    return clean_patient({
+        "age": body.get("age"),
+        "sex": body.get("sex"),
+        "weight": body.get("weight"),
+        "height": body.get("height"),
+        "cephalosporin": body.get("cephalosporin", body.get("ceph")),
+        "meds": body.get("medications", body.get("meds", "")),
+    })
+
+
+class PredictionService:
+    """Scorer + micro-batcher + stats; what the HTTP handler talks to."""
+
+    def __init__(self, scorer, max_batch=64, max_wait=0.005):
+        self.scorer = scorer
+        self.stats = LatencyStats()
+        self.batcher = MicroBatcher(self._score_batch, max_batch, max_wait, self.stats)
+
+    def _score_batch(self, patients):
+        overall, probs = self.scorer.score(patients)
+        soc_names = self.scorer.engine.soc_names
+        return [{"overall_percentage": float(o), "summary": summarize(soc_names, p)}
+                for o, p in zip(overall, probs)]
+
+    def predict(self, patient, timeout=30.0):
+        """patient: as returned by parse_patient. Blocks until its batch has been scored."""
+        t0 = time.perf_counter()
+        result = self.batcher.submit(patient).result(timeout)
+        self.stats.add_request(time.perf_counter() - t0)
+        return result
+
+    def close(self):
+        self.batcher.close()
+        self.scorer.close()
+
+
+class PredictionHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # bursts of concurrent clients are the point of micro-batching; the
+    # default listen backlog of 5 resets their connections
+    request_queue_size = 128
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status, payload):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send(200, {"status": "ok"})
+            elif self.path == "/stats":
+                self._send(200, service.stats.snapshot())
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/predict":
+                self._send(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                patient = parse_patient(json.loads(self.rfile.read(length) or b"null"))
+            except ValueError as e:
+                self._send(400, {"error": str(e)})
+                return
+            try:
+                self._send(200, service.predict(patient))
+            except Exception as e:
+                self._send(500, {"error": str(e)})
+
+        def log_message(self, fmt, *args):
+            # one line per request would dominate the service's own cost
+            pass
+
+    return Handler
+
+
+def serve(host="127.0.0.1", port=8765, max_batch=64, max_wait=0.005, model_dir=None, data_dir=None):
+    service = PredictionService(Scorer(model_dir or os.getcwd(), data_dir), max_batch, max_wait)
+    httpd = PredictionHTTPServer((host, port), make_handler(service))
+    print(f"Serving predictions on http://{host}:{httpd.server_address[1]} "
+          f"(max batch {max_batch}, max wait {max_wait * 1000:g} ms)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        service.close()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Local HTTP prediction service.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--max-batch", type=int, default=64, help="patients scored per engine call at most")
+    ap.add_argument("--max-wait-ms", type=float, default=5.0, help="how long a batch waits to fill up")
+    ap.add_argument("--models", default=None, help="folder with models.bundle or catboost.joblib (default: cwd)")
+    ap.add_argument("--data", default=None, help="folder with the risk parquets (default: CEPHALO_DATA_DIR)")
+    args = ap.parse_args(argv)
+    serve(args.host, args.port, args.max_batch, args.max_wait_ms / 1000.0, args.models, args.data)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,314 @@
+"""
+Empirical-Bayes overall risk (notebook "05 Function").
+
+Pure polars/numpy version of the chain the GUI runs behind "Predict & Save
+Risk": population distribution -> adverse-event age distribution -> exposure
+-> hybrid per-age risk.  Every function takes the ``dfs`` dict of loaded
+parquet frames (keyed by file stem) so it can be used without PyQt5.
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from telemetry import span
+
+# folder with canada_interp_*, reports_plus and cefs parquet files (+ population.npz)
+DATA_DIR = Path(os.environ.get(
+    "CEPHALO_DATA_DIR",
+    Path(__file__).resolve().parent.parent / "data" / "pred_data",
+))
+
+# voluntary reporting captures roughly 1 in 20 adverse events
+FACTOR_SUBREG = 20.0
+
+RISK_PARQUETS = (
+    "canada_interp_men",
+    "canada_interp_women",
+    "canada_interp_total",
+    "reports_plus",
+    "cefs",
+)
+# dfs key of the population.PopulationCube (population.npz, else built from canada_interp_*)
+POPULATION = "population"
+# dfs key of the event_ages.EventAges of reports_plus (event_ages.npz, else parsed from the frame)
+EVENT_AGES = "event_ages"
+
+
+def load_parquets(folder=DATA_DIR, names=None):
+    """Read ``<folder>/<name>.parquet`` files into a dict keyed by stem (all files if names is None)."""
+    dfs = {}
+    folder = Path(folder)
+    paths = sorted(folder.glob("*.parquet")) if names is None else [folder / f"{n}.parquet" for n in names]
+    for p in paths:
+        try:
+            dfs[p.stem] = pl.read_parquet(p)
+        except Exception as e:
+            print(f"Warning: couldn't read {p}: {e}")
+    return dfs
+
+
+def load_population(folder, dfs):
+    """Put the persisted population cube of ``folder`` (population.npz) into ``dfs`` if there is one."""
+    from population import CUBE_NAME, PopulationCube
+
+    cube = PopulationCube.load(Path(folder) / CUBE_NAME)
+    if cube is not None:
+        dfs[POPULATION] = cube
+    return dfs
+
+
+def population_cube(dfs):
+    """The PopulationCube of ``dfs``, built once from the canada_interp_* frames if none was loaded."""
+    from population import PopulationCube
+
+    cube = dfs.get(POPULATION)
+    if cube is None:
+        cube = dfs[POPULATION] = PopulationCube.from_interp_frames(dfs)
+    return cube
+
+
+def load_event_ages(folder, dfs):
+    """
+    Put the parsed reports_plus ages of ``folder`` (event_ages.npz) into ``dfs``.
+    A missing or stale file is rebuilt from the loaded frame and saved.
+    """
+    from event_ages import FILE_NAME, SOURCE, EventAges, file_hash
+
+    path = Path(folder) / FILE_NAME
+    source_hash = file_hash(Path(folder) / f"{SOURCE}.parquet")
+    ages = EventAges.load(path, source_hash)
+    if ages is None and dfs.get(SOURCE) is not None:
+        ages = EventAges.from_frame(dfs[SOURCE], source_hash)
+        try:
+            ages.save(path)
+        except OSError as e:
+            print(f"Warning: couldn't save event ages to {path}: {e}")
+    if ages is not None:
+        dfs[EVENT_AGES] = ages
+    return dfs
+
+
+def event_ages(dfs):
+    """The EventAges of ``dfs``, parsed once from reports_plus if none was loaded."""
+    from event_ages import EventAges
+
+    ages = dfs.get(EVENT_AGES)
+    if ages is None:
+        if "reports_plus" not in dfs:
+            raise RuntimeError("reports_plus parquet not found.")
+        ages = dfs[EVENT_AGES] = EventAges.from_frame(dfs["reports_plus"])
+    return ages
+
+
+def pop_df(dfs, gender: str, year=None) -> pl.DataFrame:
+    """Return population proportion per age for the requested gender (averaged over years, or of ``year``)."""
+    if not dfs:
+        raise RuntimeError("Parquet data not loaded.")
+    ages, counts, shares = population_cube(dfs).weights(gender, year)
+    return pl.DataFrame({"Age": ages, "TotalPop_avg": counts, "P_pob": shares})
+
+
+def ea_df(dfs, gender, generation, years=None, window=7):
+    """
+    Return EA distribution dataframe (Age, P_EA_smooth etc.).
+
+    Like the notebook, the curve is over every report of reports_plus
+    (``gender`` / ``generation`` do not filter it); the ages are parsed once
+    and histogrammed by ``event_ages``.
+    """
+    centers = np.arange(1, 101)
+    y_hist = event_ages(dfs).histogram(years=years).astype(float)
+    if y_hist.sum() == 0:
+        # return empty df with Age 1..100 zeroed
+        return pl.DataFrame({
+            "Age": centers,
+            "EA_count": [0] * 100,
+            "EA_smooth": [0.0] * 100,
+            "P_EA": [0.0] * 100,
+            "P_EA_smooth": [0.0] * 100
+        })
+    kernel = np.ones(window) / window
+    y_smooth = np.convolve(y_hist, kernel, mode="same")
+    total = y_hist.sum()
+    y_prop = y_hist / total
+    smooth_prop = y_smooth / y_smooth.sum() if y_smooth.sum() > 0 else y_smooth
+    return pl.DataFrame({
+        "Age": centers,
+        "EA_count": y_hist,
+        "EA_smooth": y_smooth,
+        "P_EA": y_prop,
+        "P_EA_smooth": smooth_prop
+    })
+
+
+def juntar_pop_ea(pop_df, ea_df):
+    df_merged = (
+        pop_df.join(ea_df, on="Age", how="inner")
+        .with_columns([
+            (pl.col("P_EA_smooth") / pl.col("P_pob")).alias("EA_to_Pop_Ratio"),
+            (pl.col("P_EA_smooth") - pl.col("P_pob")).alias("EA_minus_Pop")
+        ])
+        .sort("Age")
+    )
+    return df_merged
+
+
+def exppermil(dfs, generation: str) -> float:
+    cefs_pl = dfs.get("cefs")
+    if cefs_pl is None:
+        raise RuntimeError("cefs parquet not found.")
+    patterns = {
+        "1st gen": r"(?i)\b1st\s*gen\b",
+        "2/3 gen": r"(?i)\b2\s*/?\s*3(?:rd)?\s*gen\b",
+        "4/5 gen": r"(?i)\b4\s*/?\s*5(?:th)?\s*gen\b",
+        None: r".*",
+        "all": r".*"
+    }
+    if generation not in patterns:
+        raise ValueError(f"generation inválida: {generation}")
+    df_gen = cefs_pl.filter(
+        pl.col("Antimicrobial_Class").str.replace_all('"', "").str.contains(patterns[generation])
+    )
+    presc_anual = (
+        df_gen.group_by("Year").agg(pl.col("Canada_Prescriptions").sum().alias("Presc_total_year")).sort("Year")
+    )
+    presc_general = float(presc_anual["Presc_total_year"].mean()) if presc_anual.height > 0 else 0.0
+    return presc_general
+
+
+def expo(presc_general, df_merged):
+    df_expos = df_merged.with_columns(
+        (pl.lit(presc_general) * pl.col("TotalPop_avg") / 1000).alias("Presc_est_pob")
+    )
+    sum_p_pob = float(df_expos["Presc_est_pob"].sum())
+    if sum_p_pob == 0:
+        df_expos = df_expos.with_columns((pl.lit(0.0)).alias("P_exp_pob"))
+    else:
+        df_expos = df_expos.with_columns((pl.col("Presc_est_pob") / sum_p_pob).alias("P_exp_pob"))
+    total_pop = float(df_expos["TotalPop_avg"].sum())
+    presc_total_all = presc_general * (total_pop / 1000.0) if total_pop > 0 else 0.0
+    df_expos = df_expos.with_columns((pl.lit(presc_total_all) * pl.col("P_EA_smooth")).alias("Presc_est_ea"))
+    sum_ea_smooth = float(df_expos["EA_smooth"].sum())
+    df_expos = df_expos.with_columns(
+        (pl.lit(presc_total_all) * (pl.col("EA_smooth") / sum_ea_smooth)).alias("Presc_est_ea_from_counts"))
+    sum_p_ea = float(df_expos["Presc_est_ea"].sum())
+    if sum_p_ea == 0:
+        df_expos = df_expos.with_columns((pl.lit(0.0)).alias("P_exp_ea"))
+    else:
+        df_expos = df_expos.with_columns((pl.col("Presc_est_ea") / sum_p_ea).alias("P_exp_ea"))
+    return df_expos
+
+
+def p_ea_hibrido_simple(df_expos: pl.DataFrame, lam: float = 0.7, window: int = 7,
+                        factor_subreg: float = FACTOR_SUBREG) -> pl.DataFrame:
+    lam = float(np.clip(lam, 0.0, 1.0))
+    presc_total_all = float(df_expos["Presc_est_pob"].sum()) if "Presc_est_pob" in df_expos.columns else float(
+        df_expos["Presc_est_ea"].sum())
+    p_raw = lam * df_expos["P_exp_pob"] + (1 - lam) * df_expos["P_exp_ea"]
+    p_exp_h = p_raw / float(p_raw.sum()) if float(p_raw.sum()) != 0 else p_raw
+    presc_est_h = presc_total_all * p_exp_h
+    ea_est = df_expos["EA_smooth"] * factor_subreg
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p_age_h = (ea_est / presc_est_h).to_numpy()
+    p_age_h = np.nan_to_num(p_age_h, nan=0.0, posinf=0.0, neginf=0.0)
+    p_age_h = np.clip(p_age_h, 0.0, 1.0)
+    k = max(1, int(window))
+    w = np.ones(k) / k
+    p_age_h_smooth = np.convolve(p_age_h, w, mode="same")
+    out = df_expos.select(["Age"]).with_columns([
+        pl.Series("P_exp_h", p_exp_h),
+        pl.Series("Presc_est_h", presc_est_h),
+        pl.Series("EA_estimated", ea_est),
+        pl.Series("p_age_h", p_age_h),
+        pl.Series("p_age_h_smooth", p_age_h_smooth),
+        pl.lit(lam).alias("lambda")
+    ]).sort("Age")
+    return out
+
+
+def _moving_average_same(x, windows):
+    """
+    np.convolve(x, ones(k)/k, mode="same") along the last axis for every k in
+    ``windows`` at once (via cumulative sums); returns x.shape[:-1] + (W, n).
+    """
+    n = x.shape[-1]
+    csum = np.concatenate([np.zeros(x.shape[:-1] + (1,)), np.cumsum(x, axis=-1)], axis=-1)
+    i = np.arange(n)
+    k = np.asarray(windows)[:, None]
+    hi = np.minimum(i + (k - 1) // 2, n - 1)
+    lo = np.maximum(i + (k - 1) // 2 - k + 1, 0)
+    return (csum[..., hi + 1] - csum[..., lo]) / k
+
+
+def p_ea_hibrido_grid(df_expos: pl.DataFrame, lams, windows, factors) -> np.ndarray:
+    """
+    p_age_h_smooth of ``p_ea_hibrido_simple`` for every combination of
+    lambda, smoothing window and under-reporting factor in one broadcast pass.
+
+    Returns an array of shape (len(lams), len(windows), len(factors), n_ages);
+    ages follow df_expos["Age"] sorted ascending.
+    """
+    d = df_expos.sort("Age")
+    n = d.height
+    lams = np.clip(np.asarray(lams, dtype=float).ravel(), 0.0, 1.0)
+    windows = np.maximum(1, np.asarray(windows).astype(int).ravel())
+    factors = np.asarray(factors, dtype=float).ravel()
+    if windows.max(initial=1) > n:
+        raise ValueError(f"window larger than the age axis ({n})")
+
+    presc_total_all = float(d["Presc_est_pob"].sum()) if "Presc_est_pob" in d.columns else float(
+        d["Presc_est_ea"].sum())
+    p_pob = d["P_exp_pob"].to_numpy().astype(float)
+    p_ea = d["P_exp_ea"].to_numpy().astype(float)
+    ea_smooth = d["EA_smooth"].to_numpy().astype(float)
+
+    # (L, A)
+    p_raw = lams[:, None] * p_pob + (1 - lams[:, None]) * p_ea
+    tot = p_raw.sum(axis=1, keepdims=True)
+    p_exp_h = np.divide(p_raw, tot, out=p_raw.copy(), where=tot != 0)
+    presc_est_h = presc_total_all * p_exp_h
+    # (F, A)
+    ea_est = factors[:, None] * ea_smooth
+    # (L, F, A)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p_age_h = ea_est[None, :, :] / presc_est_h[:, None, :]
+    p_age_h = np.clip(np.nan_to_num(p_age_h, nan=0.0, posinf=0.0, neginf=0.0), 0.0, 1.0)
+    # (L, F, W, A) -> (L, W, F, A)
+    return _moving_average_same(p_age_h, windows).transpose(0, 2, 1, 3)
+
+
+def wraper_grid(dfs, gender=None, generation=None, lams=(0.7,), windows=(7,), factors=(FACTOR_SUBREG,)):
+    """Sensitivity sweep of the wrapper: builds the exposure frame once and returns (ages, tensor)."""
+    merged = juntar_pop_ea(pop_df(dfs, gender), ea_df(dfs, gender, generation))
+    expo_df = expo(exppermil(dfs, generation), merged).sort("Age")
+    return expo_df["Age"].to_numpy(), p_ea_hibrido_grid(expo_df, lams, windows, factors)
+
+
+def p_poredad(df, edad):
+    prob_90 = float(df.filter(pl.col("Age") == edad).select("p_age_h_smooth").item() if df.filter(
+        pl.col("Age") == edad).height > 0 else 0.0)
+    return prob_90
+
+
+def wraper(dfs, gender=None, generation=None, age=None):
+    # build pop and ea dfs, join them (each stage timed when telemetry is on)
+    with span("wraper.pop_df"):
+        pop = pop_df(dfs, gender)
+    with span("wraper.ea_df"):
+        ea = ea_df(dfs, gender, generation)
+    with span("wraper.juntar_pop_ea"):
+        merged = juntar_pop_ea(pop, ea)
+    with span("wraper.exppermil"):
+        presc = exppermil(dfs, generation)
+    with span("wraper.expo"):
+        expo_df = expo(presc, merged)
+    with span("wraper.p_ea_hibrido"):
+        df = p_ea_hibrido_simple(expo_df, lam=0.7, window=7)
+        df = df.sort("Age")
+    if age is not None:
+        p = p_poredad(df, age)
+        percentage = p * 100.0
+        return percentage, df
+    return 0.0, df
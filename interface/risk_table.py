@@ -0,0 +1,146 @@
+"""
+Precomputed age x sex x generation risk table.
+
+``risk_model.wraper`` rebuilds the whole polars chain for every prediction even
+though its output only depends on (sex, generation) and the source parquets.
+This module evaluates it once for every cell and stores ``p_age_h_smooth`` as a
+(sex, generation, age 1-100) array in a small .npz next to the data, tagged
+with a content hash of the source parquets so a data refresh invalidates it.
+The (size, mtime) of the sources is stored too: at startup the table is
+accepted on that stamp alone, and the sources are only read and hashed when
+it changed.
+
+Build offline with:
+    python risk_table.py [data_dir]
+"""
+import hashlib
+import sys
+from pathlib import Path
+
+import numpy as np
+
+import risk_model
+
+SEXES = ("Female", "Male", "Total")
+GENERATIONS = ("1st gen", "2/3 gen", "4/5 gen")
+AGES = np.arange(1, 101)
+TABLE_VERSION = 1
+TABLE_NAME = "risk_table.npz"
+
+
+def _source_files(names):
+    from population import CUBE_NAME
+
+    return [f"{name}.parquet" for name in names] + [CUBE_NAME]
+
+
+def source_stamp(data_dir=risk_model.DATA_DIR, names=risk_model.RISK_PARQUETS):
+    """(size, mtime_ns) of the files ``source_hash`` reads, as one string; stat calls only."""
+    parts = []
+    for file_name in _source_files(names):
+        try:
+            st = (Path(data_dir) / file_name).stat()
+            parts.append(f"{file_name}:{st.st_size}:{st.st_mtime_ns}")
+        except FileNotFoundError:
+            parts.append(f"{file_name}:-")
+    return "|".join(parts)
+
+
+def source_hash(data_dir=risk_model.DATA_DIR, names=risk_model.RISK_PARQUETS):
+    """sha256 over the bytes of the parquet files the EB wrapper reads (and population.npz)."""
+    h = hashlib.sha256()
+    for file_name in _source_files(names):
+        p = Path(data_dir) / file_name
+        h.update(file_name.encode())
+        if p.exists():
+            with open(p, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+    return h.hexdigest()
+
+
+def _sex_index(sex):
+    # _pop_df treats anything other than Male/Female as the total population
+    return SEXES.index(sex) if sex in ("Male", "Female") else SEXES.index("Total")
+
+
+def build_table(dfs):
+    """Evaluate the EB wrapper for every (sex, generation); returns a (3, 3, 100) array of p_age_h_smooth."""
+    table = np.zeros((len(SEXES), len(GENERATIONS), AGES.size), dtype=np.float64)
+    for i, sex in enumerate(SEXES):
+        for j, gen in enumerate(GENERATIONS):
+            _, df = risk_model.wraper(dfs, gender=sex, generation=gen)
+            age = df["Age"].to_numpy()
+            ok = (age >= AGES[0]) & (age <= AGES[-1])
+            table[i, j, age[ok] - AGES[0]] = df["p_age_h_smooth"].to_numpy()[ok]
+    return table
+
+
+class RiskTable:
+    """O(1) lookup of the overall EB risk; mirrors ``wraper(...)[0]``."""
+
+    def __init__(self, table, data_hash, stamp=""):
+        self.table = table
+        self.data_hash = data_hash
+        self.stamp = stamp
+
+    def percentage(self, sex, generation, age):
+        """Risk in percent; raises ValueError for unknown generations like ``exppermil``."""
+        if generation not in GENERATIONS:
+            raise ValueError(f"generation inválida: {generation}")
+        if age is None or not (AGES[0] <= age <= AGES[-1]):
+            return 0.0
+        return float(self.table[_sex_index(sex), GENERATIONS.index(generation), int(age) - AGES[0]]) * 100.0
+
+    def save(self, path):
+        np.savez(path, table=self.table, data_hash=np.array(self.data_hash), stamp=np.array(self.stamp),
+                 version=np.array(TABLE_VERSION), sexes=np.array(SEXES), generations=np.array(GENERATIONS))
+
+    @classmethod
+    def load(cls, path, data_hash=None):
+        """Return the stored table, or None if it is missing, from another version or stale."""
+        try:
+            with np.load(path) as z:
+                if int(z["version"]) != TABLE_VERSION:
+                    return None
+                if data_hash is not None and str(z["data_hash"]) != data_hash:
+                    return None
+                return cls(z["table"], str(z["data_hash"]), str(z["stamp"]) if "stamp" in z.files else "")
+        except (FileNotFoundError, KeyError, ValueError):
+            return None
+
+    @classmethod
+    def build(cls, data_dir=risk_model.DATA_DIR, dfs=None):
+        if dfs is None:
+            dfs = risk_model.load_population(data_dir, risk_model.load_parquets(data_dir, risk_model.RISK_PARQUETS))
+        stamp = source_stamp(data_dir)
+        return cls(build_table(dfs), source_hash(data_dir), stamp)
+
+    @classmethod
+    def load_or_build(cls, data_dir=risk_model.DATA_DIR, dfs=None):
+        """
+        Load the persisted table if it matches the current parquets, otherwise
+        rebuild and save it.  Unchanged (size, mtime) stamps skip the hashing.
+        """
+        path = Path(data_dir) / TABLE_NAME
+        stamp = source_stamp(data_dir)
+        rt = cls.load(path)
+        if rt is not None and rt.stamp == stamp:
+            return rt
+        if rt is not None and rt.data_hash == source_hash(data_dir):
+            # same bytes, new mtimes (copied or touched): only the stamp is stale
+            rt.stamp = stamp
+        else:
+            rt = cls.build(data_dir, dfs)
+        try:
+            rt.save(path)
+        except OSError as e:
+            print(f"Warning: couldn't save risk table to {path}: {e}")
+        return rt
+
+
+if __name__ == "__main__":
+    data_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else risk_model.DATA_DIR
+    rt = RiskTable.build(data_dir)
+    rt.save(data_dir / TABLE_NAME)
+    print(f"Saved risk table {rt.table.shape} to {data_dir / TABLE_NAME} (data hash {rt.data_hash[:12]})")
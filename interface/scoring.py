@@ -0,0 +1,420 @@
+"""
+The prediction pipeline without the window.
+
+Everything the GUI needs to turn (age, sex, weight, height, cephalosporin,
+medications) into the overall EB risk and the per-SOC summary lives here, free
+of PyQt, so the same code serves ``CephaloPredictor``, the batch scorer
+(batch_score.py) and anything else that runs headless:
+
+* ``load_risk_data`` / ``load_models``: the parquet + risk-table and model
+  loading the window does at startup;
+* ``overall_percentage``: what ``compute_overall_probability`` shows, and
+  ``RiskService``, its memoised form (one computation per distinct input);
+* ``summarize``: the severity/colour mapping of ``probability_model``;
+* ``Scorer``: all of the above for batches of patient dicts.
+"""
+import csv
+import math
+import os
+import threading
+from collections import OrderedDict
+
+from med_matcher import MedMatcher
+from model_bundle import BUNDLE_NAME, ModelBundle, load_name_column
+
+# ---------- Full SIDE_EFFECTS list ----------
+SIDE_EFFECTS = [
+    "Blood and lymphatic system disorders",
+    "Cardiac disorders",
+    "Congenital, familial and genetic disorders",
+    "Ear and labyrinth disorders",
+    "Endocrine disorders",
+    "Eye disorders",
+    "Gastrointestinal disorders",
+    "General disorders and administration site conditions",
+    "Hepatobiliary disorders",
+    "Immune system disorders",
+    "Infections and infestations",
+    "Injury, poisoning and procedural complications",
+    "Investigations",
+    "Metabolism and nutrition disorders",
+    "Musculoskeletal and connective tissue disorders",
+    "Neoplasms benign, malignant and unspecified (incl cysts and polyps)",
+    "Nervous system disorders",
+    "Pregnancy, puerperium and perinatal conditions",
+    "Psychiatric disorders",
+    "Renal and urinary disorders",
+    "Reproductive system and breast disorders",
+    "Respiratory, thoracic and mediastinal disorders",
+    "Skin and subcutaneous tissue disorders",
+    "Social circumstances",
+    "Surgical and medical procedures",
+    "Vascular disorders"
+]
+
+# cephalosporin (as offered in the GUI combo) -> generation bucket of the EB model
+GEN_MAP = {
+    "cefaclor": "2/3 gen",
+    "cefaclor monohydrate": "2/3 gen",
+    "cefadroxil": "1st gen",
+    "cefadroxil monohydrate": "1st gen",
+    "cefalexin": "1st gen",
+    "cefalexin sodium": "1st gen",
+    "cefatrizine": "2/3 gen",
+    "cefazolin": "1st gen",
+    "cefazolin benzathine": "1st gen",
+    "cefazolin sodium": "1st gen",
+    "cefazolin, sodium": "1st gen",
+    "cefazoline benzathine": "1st gen",
+    "cefcapene": "2/3 gen",
+    "cefcapene pivoxil": "2/3 gen",
+    "cefcapene pivoxil hcl": "2/3 gen",
+    "cefcapene pivoxil hydrochloride": "2/3 gen",
+    "cefcapene pivoxil hydrochloride hydrate": "2/3 gen",
+    "cefdinir": "2/3 gen",
+    "cefepim": "4/5 gen",
+    "cefepime": "4/5 gen",
+    "cefepime dihydrochloride monohydrate": "4/5 gen",
+    "cefepime hcl": "4/5 gen",
+    "cefepime hydrochloride": "4/5 gen",
+    "cefepime hydrochloride monohydrate": "4/5 gen",
+    "cefepime, hydrochloride, monohydrate": "4/5 gen",
+    "cefixima": "2/3 gen",
+    "cefixime": "2/3 gen",
+    "cefixime trihydrate": "2/3 gen",
+    "cefmetazole sodium": "2/3 gen",
+    "cefodizime": "2/3 gen",
+    "cefodizime disodium": "2/3 gen",
+    "cefodizime sodium": "2/3 gen",
+    "cefoperazone sodium": "2/3 gen",
+    "cefotaxime": "2/3 gen",
+    "cefotaxime sodique": "2/3 gen",
+    "cefotaxime sodium": "2/3 gen",
+    "cefotiam": "2/3 gen",  # treated as 2nd/3rd bucket
+    "cefotiam hexetil hydrochloride": "2/3 gen",
+    "cefotiam hydrochloride": "2/3 gen",
+    "cefoxitin": "2/3 gen",
+    "cefoxitin sodium": "2/3 gen",
+    "cefpodoxime proxetil": "2/3 gen",
+    "cefprozil": "2/3 gen",
+    "cefprozil monohydrate": "2/3 gen",
+    "ceftaroline": "4/5 gen",
+    "ceftaroline fosamil": "4/5 gen",
+    "ceftaroline fosamil acetate": "4/5 gen",
+    "ceftazidime": "2/3 gen",
+    "ceftazidime pentahydrate": "2/3 gen",
+    "ceftazidime sodium": "2/3 gen",
+    "ceftobiprole": "4/5 gen",
+    "ceftolozane": "4/5 gen",
+    "ceftolozane sulfate": "4/5 gen",
+    "ceftriaxone": "2/3 gen",
+    "ceftriaxone disodium": "2/3 gen",
+    "ceftriaxone sodique": "2/3 gen",
+    "ceftriaxone sodium": "2/3 gen",
+    "ceftriaxone sodium hydrate": "2/3 gen",
+    "ceftriaxone sodium sesquaterhydrate": "2/3 gen",
+    "ceftriaxone, sodium, sesquaterhydrate": "2/3 gen",
+    "cefuroxime": "2/3 gen",
+    "cefuroxime axetil": "2/3 gen",
+    "cefuroxime salt not specified": "2/3 gen",
+    "cefuroxime sodium": "2/3 gen",
+    "cephalexin": "1st gen",
+    "cephazolin sodium": "1st gen",
+    "methylol cefalexin lysinate": "1st gen",
+    "probenecid": "other",
+    "sodium cefazolin": "1st gen",
+    "sodium ceforoxine": "2/3 gen",  # likely cefuroxime → 2nd-gen bucket
+    "sodium cefoxitin": "2/3 gen",
+    "sodium ceftriaxone": "2/3 gen",
+    "tazobactam": "other",
+    "tazobactam sodique": "other",
+    "tazobactam sodium": "other"
+}
+
+# GEN_MAP bucket of non-cephalosporin ingredients (probenecid, tazobactam): the
+# EB model has no exposure data for it and the window shows 0.0 overall
+OTHER_GENERATION = "other"
+
+NO_MODEL_RESULT = {"prob": 0, "severity": "Not Probable", "color": "#e2e8f0"}
+
+# active-ingredient vocabulary offered by the medication completer
+INGREDIENTS_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "info", "active_ingredients_unique.csv")
+
+
+def load_ingredient_names(path=INGREDIENTS_CSV):
+    """ACTIVE_INGREDIENT_NAME column of info/active_ingredients_unique.csv (empty list if missing)."""
+    try:
+        with open(path, newline="", encoding="utf-8") as f:
+            return [row["ACTIVE_INGREDIENT_NAME"].strip() for row in csv.DictReader(f)
+                    if row.get("ACTIVE_INGREDIENT_NAME")]
+    except FileNotFoundError:
+        return []
+
+
+def generation_for(ceph):
+    """EB generation bucket of a cephalosporin name (any casing); unknown or missing names count as 1st gen."""
+    return GEN_MAP.get(str(ceph).strip().lower() if ceph is not None else "") or "1st gen"
+
+
+def normalize_sex(sex):
+    """"Male" / "Female" (the window's sex combo) for any casing or M / F; ValueError otherwise."""
+    key = str(sex).strip().lower() if sex is not None else ""
+    if key in ("male", "m"):
+        return "Male"
+    if key in ("female", "f"):
+        return "Female"
+    raise ValueError("sex is required" if not key else f"sex must be Male or Female, got {sex!r}")
+
+
+def _number(value, key):
+    """float of a form / JSON / dataframe value; None for missing (None, "", NaN)."""
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"{key} must be numeric")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{key} must be numeric") from None
+    return None if math.isnan(number) else number
+
+
+def clean_patient(raw):
+    """
+    Validated copy of a patient dict (age, sex, weight, height, cephalosporin,
+    meds), checked the way predict_and_save checks the form: age is required
+    and whole, sex is Male or Female, weight / height are numeric or missing,
+    cephalosporin is a GEN_MAP name (any casing; lowercased here) or empty
+    (1st gen, like the form's default), meds is comma-separated text or a
+    list of names.  Raises ValueError naming the first bad field.
+    """
+    age = _number(raw.get("age"), "age")
+    if age is None:
+        raise ValueError("age is required")
+    if not age.is_integer():
+        raise ValueError("age must be an integer")
+    ceph = raw.get("cephalosporin")
+    if ceph is not None and not isinstance(ceph, str):
+        raise ValueError("cephalosporin must be a string")
+    ceph = ceph.strip().lower() if ceph is not None else ""
+    if ceph and ceph not in GEN_MAP:
+        raise ValueError(f"unknown cephalosporin {raw.get('cephalosporin')!r}")
+    meds = raw.get("meds")
+    if meds is None:
+        meds = ""
+    elif not isinstance(meds, str) and not (isinstance(meds, (list, tuple)) and all(isinstance(m, str) for m in meds)):
+        raise ValueError("medications must be a comma-separated string or a list of names")
+    return {
+        "age": int(age),
+        "sex": normalize_sex(raw.get("sex")),
+        "weight": _number(raw.get("weight"), "weight"),
+        "height": _number(raw.get("height"), "height"),
+        "cephalosporin": ceph or None,
+        "meds": meds,
+    }
+
+
+# ---------------- loading ----------------
+def load_risk_data(data_dir=None):
+    """(dfs, risk_table) for the overall EB risk; risk_table is None if it cannot be built."""
+    import risk_model
+    from risk_table import RiskTable
+
+    carpeta = risk_model.DATA_DIR if data_dir is None else data_dir
+    dfs = risk_model.load_parquets(carpeta, risk_model.RISK_PARQUETS)
+    if dfs:
+        risk_model.load_population(carpeta, dfs)
+        risk_model.load_event_ages(carpeta, dfs)
+    try:
+        risk_table = RiskTable.load_or_build(carpeta, dfs) if dfs else None
+    except Exception as e:
+        print("Warning: risk table unavailable, falling back to the full EB chain:", e)
+        risk_table = None
+    return dfs, risk_table
+
+
+def load_feature_names(model_dir):
+    """
+    The model's input columns from ``model_dir``: the frozen vocabulary
+    (features.npz) if present, else feature_names.csv; None if neither exists.
+    """
+    from encoder import FEATURES_VOCAB, Vocabulary
+
+    vocab_path = os.path.join(model_dir, FEATURES_VOCAB)
+    if os.path.exists(vocab_path):
+        return Vocabulary.load(vocab_path).names
+    features_csv = os.path.join(model_dir, "feature_names.csv")
+    if os.path.exists(features_csv):
+        return load_name_column(features_csv)
+    return None
+
+
+def load_models(model_dir, n_jobs=None):
+    """
+    SOCInferenceEngine over the models in ``model_dir``: models.bundle if present
+    (checked against the feature vocabulary), else catboost.joblib + the feature
+    vocabulary (features.npz or feature_names.csv) + soc_columns.csv.
+    """
+    from inference import SOCInferenceEngine
+
+    feature_names = load_feature_names(model_dir)
+    bundle_path = os.path.join(model_dir, BUNDLE_NAME)
+    if os.path.exists(bundle_path):
+        # 1) Versioned bundle: models + feature index + SOC order in one mmapped file
+        bundle = ModelBundle(bundle_path)
+        if feature_names is not None:
+            bundle.check_features(feature_names)
+        models = bundle.models()
+        model_features = bundle.feature_names
+        model_outputs = bundle.soc_names
+        print(f"Loaded model bundle {bundle_path} ({len(models)} SOCs).")
+    else:
+        # 1) Load the CatBoost models-per-SOC dict
+        import joblib
+        models = joblib.load(os.path.join(model_dir, "catboost.joblib"))
+        print(f"Loaded CatBoost models for {len(models)} SOCs.")
+
+        # 2) Feature names (frozen vocabulary) + SOC names
+        if feature_names is None:
+            raise FileNotFoundError(f"no features.npz or feature_names.csv in {model_dir}")
+        model_features = feature_names
+        model_outputs = load_name_column(os.path.join(model_dir, "soc_columns.csv"))
+
+    # 3) Batched engine: sparse rows, models run in parallel
+    return SOCInferenceEngine(models, model_features, model_outputs, n_jobs=n_jobs)
+
+
+# ---------------- scoring ----------------
+def overall_percentage(dfs, risk_table, sex, generation, age):
+    """
+    The overall EB risk in percent (the risk table when available, else the
+    full wrapper); 0.0 for the OTHER_GENERATION ingredients.
+    """
+    if not dfs:
+        raise RuntimeError("Parquet files not loaded; cannot compute probability.")
+    if generation == OTHER_GENERATION:
+        return 0.0
+    # O(1) table lookup; the wrapped function is only needed if the table is unavailable
+    if risk_table is not None:
+        return risk_table.percentage(sex, generation, age)
+    import risk_model
+    percentage, _df = risk_model.wraper(dfs, gender=sex, generation=generation, age=age)
+    return percentage
+
+
+class RiskService:
+    """
+    ``overall_percentage`` behind a bounded LRU cache keyed on
+    (sex, generation, age, data version).  The data version is the risk
+    table's source hash, or the identity of ``dfs`` without a table
+    (``data_version`` overrides it); ``reload`` swaps in
+    refreshed data and drops what was cached for the old version.
+    ``computations`` / ``hits`` count misses and cache hits.  Thread-safe:
+    the window calls it from worker threads.
+    """
+
+    def __init__(self, dfs, risk_table, data_version=None, maxsize=4096):
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.computations = 0
+        self.hits = 0
+        self.reload(dfs, risk_table, data_version)
+
+    def reload(self, dfs, risk_table, data_version=None):
+        if data_version is None:
+            data_version = risk_table.data_hash if risk_table is not None else id(dfs)
+        with self._lock:
+            self.dfs, self.risk_table, self.data_version = dfs, risk_table, data_version
+            self._cache.clear()
+
+    def percentage(self, sex, generation, age):
+        """overall_percentage(dfs, risk_table, sex, generation, age), computed once per key."""
+        with self._lock:
+            key = (sex, generation, age, self.data_version)
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            dfs, risk_table = self.dfs, self.risk_table
+        # computed outside the lock; a concurrent miss on the same key just computes it twice
+        value = overall_percentage(dfs, risk_table, sex, generation, age)
+        with self._lock:
+            self.computations += 1
+            if key[3] == self.data_version:
+                self._cache[key] = value
+                if len(self._cache) > self.maxsize:
+                    self._cache.popitem(last=False)
+        return value
+
+    def for_cephalosporin(self, sex, ceph, age):
+        """``percentage`` with the generation looked up from the cephalosporin name."""
+        return self.percentage(sex, generation_for(ceph), age)
+
+
+def classify(p_pct):
+    """(severity, colour) of a SOC probability in percent."""
+    if p_pct < 33:
+        return "Not Probable", "#22c55e"
+    if p_pct < 66:
+        return "Probable", "#facc15"
+    return "Very Probable", "#ef4444"
+
+
+def summarize(soc_names, probs):
+    """
+    Per-SOC result dict ({"prob", "severity", "color"}) for one row of model
+    probabilities, keyed in SIDE_EFFECTS order; SOCs without a model get NO_MODEL_RESULT.
+    """
+    results = {}
+    for soc, p in zip(soc_names, probs):
+        p_pct = 100 * float(p)
+        severity, color = classify(p_pct)
+        results[soc] = {"prob": round(p_pct, 2), "severity": severity, "color": color}
+    return {eff: results.get(eff, dict(NO_MODEL_RESULT)) for eff in SIDE_EFFECTS}
+
+
+class Scorer:
+    """
+    Headless predictor: overall EB risk + per-SOC model probabilities for
+    batches of patients (dicts with age, sex, weight, height, cephalosporin and
+    meds as a comma-separated string or a list of names).  Every patient goes
+    through ``clean_patient``; callers that must not fail a whole batch on one
+    bad row validate the rows first.
+    """
+
+    def __init__(self, model_dir, data_dir=None, n_jobs=None, extra_names=None):
+        self.dfs, self.risk_table = load_risk_data(data_dir)
+        self.engine = load_models(model_dir, n_jobs=n_jobs)
+        if extra_names is None:
+            extra_names = load_ingredient_names()
+        self.matcher = MedMatcher(self.engine.feature_names, extra_names)
+        self.risk = RiskService(self.dfs, self.risk_table)
+
+    def med_names(self, meds):
+        """Matched medication names for free text ("a, b") or a list of typed names."""
+        if meds is None:
+            return []
+        if isinstance(meds, str):
+            return [m.name for m in self.matcher.match_text(meds)]
+        return [m.name for m in (self.matcher.resolve(t) for t in meds) if m is not None]
+
+    def overall(self, sex, ceph, age):
+        """overall_percentage for one patient; memoised on the (sex, generation, age) it depends on."""
+        return self.risk.for_cephalosporin(sex, ceph, age)
+
+    def score(self, patients):
+        """
+        Returns (overall percentages, (N, n_soc) probability array in
+        ``self.engine.soc_names`` order) for a list of patient dicts.
+        """
+        import numpy as np
+
+        rows = [dict(p, meds=self.med_names(p["meds"])) for p in map(clean_patient, patients)]
+        probs = self.engine.predict_proba(rows)
+        overall = np.array([self.overall(p.get("sex"), p.get("cephalosporin"), p.get("age")) for p in rows],
+                           dtype=np.float64)
+        return overall, probs
+
+    def close(self):
+        self.engine.close()
@@ -0,0 +1,164 @@
+"""
+Timing spans for the prediction hot path.
+
+The app used to ``print`` what it was doing, which does not say whether a
+slow click went to parquet loading, the polars EB chain, CatBoost or
+SQLite.  Code wraps a stage in ``with span("stage"):``; each stage keeps
+its last ``WINDOW`` durations in a ring buffer (plus an all-time count and
+total), from which ``snapshot`` gives p50 / p95 / p99 / max in milliseconds.
+
+Recording is off unless ``CEPHALO_TIMING=1`` is set (or ``enable()`` is
+called, e.g. from the diagnostics panel: Ctrl+Shift+D in the window).  Off,
+``span`` returns one shared no-op context manager, so an instrumented call
+costs a global lookup and an empty ``with``.  With ``CEPHALO_TIMING_FILE``
+set, the statistics are written there as JSON when the process exits.
+
+    python telemetry.py timings.json    # print an exported file as a table
+"""
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+WINDOW = 1024  # durations kept per stage
+PERCENTILES = (50, 95, 99)
+
+_enabled = os.environ.get("CEPHALO_TIMING", "").lower() not in ("", "0", "false", "no")
+_stages = {}
+_lock = threading.Lock()
+_NULL = nullcontext()
+
+
+class _Stage:
+    __slots__ = ("window", "count", "total")
+
+    def __init__(self):
+        self.window = deque(maxlen=WINDOW)
+        self.count = 0
+        self.total = 0.0
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def enabled():
+    return _enabled
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def span(name):
+    """Context manager timing its block as stage ``name`` (a shared no-op while recording is off)."""
+    return _Span(name) if _enabled else _NULL
+
+
+def record(name, seconds):
+    """Add one duration (in seconds) to stage ``name``."""
+    with _lock:
+        stage = _stages.get(name)
+        if stage is None:
+            stage = _stages[name] = _Stage()
+        stage.window.append(seconds)
+        stage.count += 1
+        stage.total += seconds
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+
+
+def _percentile(ordered, q):
+    """Linearly interpolated percentile of a sorted list (numpy's default method)."""
+    pos = (len(ordered) - 1) * q / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def snapshot():
+    """
+    {stage: {"count", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"}}.
+    ``count`` and ``mean_ms`` are all-time; the percentiles and max cover the
+    last WINDOW calls.
+    """
+    with _lock:
+        copies = {name: (sorted(s.window), s.count, s.total) for name, s in _stages.items()}
+    out = {}
+    for name, (ordered, count, total) in sorted(copies.items()):
+        stats = {"count": count, "mean_ms": 1000.0 * total / count}
+        for q in PERCENTILES:
+            stats[f"p{q}_ms"] = 1000.0 * _percentile(ordered, q)
+        stats["max_ms"] = 1000.0 * ordered[-1]
+        out[name] = stats
+    return out
+
+
+def report(stats=None):
+    """``snapshot`` (or ``stats``) as a fixed-width text table."""
+    stats = snapshot() if stats is None else stats
+    if not stats:
+        return "no timings recorded"
+    width = max(len("stage"), *(len(n) for n in stats))
+    lines = [f"{'stage':<{width}} {'count':>7} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}  (ms)"]
+    for name, s in stats.items():
+        lines.append(f"{name:<{width}} {s['count']:>7} {s['mean_ms']:>9.2f} {s['p50_ms']:>9.2f} "
+                     f"{s['p95_ms']:>9.2f} {s['p99_ms']:>9.2f} {s['max_ms']:>9.2f}")
+    return "\n".join(lines)
+
+
+def export(path):
+    """Write the current ``snapshot`` to ``path`` as JSON; returns the snapshot."""
+    stats = snapshot()
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "window": WINDOW, "stages": stats}, f, indent=2)
+    return stats
+
+
+def _export_at_exit():
+    path = os.environ.get("CEPHALO_TIMING_FILE")
+    if path and _stages:
+        try:
+            export(path)
+        except OSError as e:
+            print(f"Warning: couldn't write timings to {path}: {e}")
+
+
+atexit.register(_export_at_exit)
+
+
+def main(argv):
+    if len(argv) != 2:
+        print("usage: python telemetry.py timings.json")
+        return 2
+    with open(argv[1], encoding="utf-8") as f:
+        print(report(json.load(f)["stages"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,80 @@
+"""
+Background jobs for the Qt window.
+
+A ``Job`` runs a plain Python callable on a QThreadPool thread and reports
+back through Qt signals, which are delivered on the GUI thread.  The callable
+receives the job itself so it can report progress and return early once the
+job has been cancelled (e.g. superseded by a newer prediction request).
+
+Jobs are not auto-deleted by the pool: the Python object owns the runnable,
+so the window can still cancel() / tryTake() a job that has already run.
+Whoever starts a job keeps a reference to it until ``is_done()``.
+"""
+import threading
+import traceback
+
+from PyQt5.QtCore import QObject, QRunnable, pyqtSignal
+
+
+class JobCancelled(Exception):
+    """Raised inside a job function to stop work for a cancelled job."""
+
+
+class JobSignals(QObject):
+    progress = pyqtSignal(int, int, str)   # job id, percent, stage label
+    finished = pyqtSignal(int, object)     # job id, result
+    failed = pyqtSignal(int, str)          # job id, error message
+
+
+class Job(QRunnable):
+    """
+    fn(job, *args, **kwargs) is executed off the GUI thread; it must not touch
+    widgets.  Results of cancelled jobs are never emitted.
+    """
+
+    def __init__(self, job_id, fn, *args, **kwargs):
+        super().__init__()
+        self.job_id = job_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = JobSignals()
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+        # the pool must not delete the C++ object under a live Python reference
+        self.setAutoDelete(False)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def is_done(self):
+        """True once run() has returned."""
+        return self._done.is_set()
+
+    def check(self):
+        """Stop the job function here if the job was cancelled."""
+        if self._cancelled.is_set():
+            raise JobCancelled()
+
+    def report(self, percent, stage=""):
+        if not self._cancelled.is_set():
+            self.signals.progress.emit(self.job_id, int(percent), stage)
+
+    def run(self):
+        try:
+            try:
+                result = self.fn(self, *self.args, **self.kwargs)
+            except JobCancelled:
+                return
+            except Exception as e:
+                traceback.print_exc()
+                if not self._cancelled.is_set():
+                    self.signals.failed.emit(self.job_id, str(e))
+                return
+            if not self._cancelled.is_set():
+                self.signals.finished.emit(self.job_id, result)
+        finally:
+            self._done.set()
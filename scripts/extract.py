@@ -0,0 +1,165 @@
+"""
+The cephalosporin extraction as lazy queries with the selection pushed into the scans.
+
+``00 Canada Data Raw`` and ``01 Canada`` read ``reports`` (1.2M x 42) and
+``report_drug`` (5.3M x 22) whole with ``read_parquet`` and only then keep the
+reports with a cephalosporin.  Here the tables of ``data/cephalosporines_clean``
+are LazyFrames over the ingested Parquet (``python -m scripts.ingest``):
+
+    drug_product_ingredients  -- ACTIVE_INGREDIENT_NAME ~ (?i)\\bcef|\\bceph --> DRUGNAMEs
+    report_drug[REPORT_ID, DRUGNAME]  -- semi join DRUGNAMEs --> REPORT_IDs
+    reports, reactions, report_drug, report_drug_indication  -- REPORT_ID in REPORT_IDs
+
+The id query only reads two columns of ``report_drug``.  Its result (tens of
+thousands of integers) becomes an ``is_in`` predicate that polars pushes into
+every table scan, so the Parquet reader decodes REPORT_ID first and the other
+columns only for the rows that match; hive partitions before ``since`` are
+not opened at all.  ``explain`` prints the optimised plans for review.
+
+usage (from the repository root):
+    python -m scripts.extract [RAW_DIR] [OUT_DIR] [--since 2024-01-01] [--explain]
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+
+import polars as pl
+
+from scripts.ingest import OUT_DIR as RAW_DIR, PARTITION, ROOT, received_date
+
+CLEAN_DIR = os.path.join(ROOT, "data", "cephalosporines_clean")
+
+KEY = "REPORT_ID"
+# drug products with one of these ingredients make a report a cephalosporin report (01 Canada)
+CEPH_PATTERN = r"(?i)\bcef|\bceph"
+CHILDREN = ("reactions", "report_drug", "report_drug_indication")
+
+# 00 Canada Data Raw; units missing from the maps give null
+WEIGHT_TO_KG = {"Kilogram": 1.0, "Pound": 0.453592, "Ounce": 0.02834957, "Unkwn": 1.0}
+HEIGHT_TO_CM = {"Centimeter": 1.0, "Inch": 2.54}
+
+
+def scan(raw_dir, name, since=None):
+    """
+    Lazy scan of an ingested table, hive-partitioned folder or single file,
+    with Categorical columns as String as the clean tables store them.  With
+    ``since`` the year partitions before it are not read at all.
+    """
+    path = os.path.join(raw_dir, name)
+    if os.path.isdir(path):
+        lf = pl.scan_parquet(path, hive_partitioning=True)
+        if since is not None:
+            lf = lf.filter(pl.col(PARTITION) >= since.year)
+        lf = lf.drop(PARTITION)
+    else:
+        lf = pl.scan_parquet(path + ".parquet")
+    return lf.with_columns(pl.col(pl.Categorical).cast(pl.String))
+
+
+def missing_tables(clean_dir, names):
+    """The tables of ``names`` that have no parquet in ``clean_dir`` (written by ``extract`` / scripts.refresh)."""
+    return [n for n in names if not os.path.exists(os.path.join(clean_dir, n + ".parquet"))]
+
+
+def ceph_ids(raw_dir, since=None):
+    """REPORT_IDs of the reports with a drug that has a cephalosporin ingredient (lazy)."""
+    names = (scan(raw_dir, "drug_product_ingredients")
+             .filter(pl.col("ACTIVE_INGREDIENT_NAME").str.contains(CEPH_PATTERN))
+             .select("DRUGNAME")
+             .unique())
+    return (scan(raw_dir, "report_drug", since)
+            .select(KEY, "DRUGNAME")
+            .join(names, on="DRUGNAME", how="semi")
+            .select(KEY)
+            .unique())
+
+
+def reports_short(reports_raw):
+    """reports_cleaned of 00 Canada Data Raw, restricted as in 02_00 Cephalosporines Clean."""
+    def scaled(value, unit, factors):
+        return (pl.col(value).cast(pl.Float64, strict=False)
+                * pl.col(unit).replace_strict(factors, default=None, return_dtype=pl.Float64))
+
+    return reports_raw.select(
+        KEY,
+        received_date(pl.col("DATRECEIVED")).cast(pl.Datetime("ns")).alias("DATRECEIVED"),
+        "GENDER_ENG",
+        "AGE_Y",
+        scaled("WEIGHT", "WEIGHT_UNIT_ENG", WEIGHT_TO_KG).alias("WEIGHT_KG"),
+        scaled("HEIGHT", "HEIGHT_UNIT_ENG", HEIGHT_TO_CM).alias("HEIGHT_CM"),
+    )
+
+
+def report_ids(raw_dir=RAW_DIR, ids=None, since=None):
+    """
+    The REPORT_IDs a ``plan`` selects: the cephalosporin reports, or ``ids``,
+    that have a report row (received on or after ``since`` if given).
+    """
+    lf = ceph_ids(raw_dir, since) if ids is None else ids.lazy().select(KEY)
+    reports = scan(raw_dir, "reports", since)
+    if since is not None:
+        reports = reports.filter(received_date(pl.col("DATRECEIVED")) >= since)
+    return lf.join(reports.select(KEY), on=KEY, how="semi").collect(engine="streaming")
+
+
+def plan(raw_dir=RAW_DIR, ids=None, since=None):
+    """
+    {table: LazyFrame} of the cephalosporin tables, restricted to
+    ``report_ids(raw_dir, ids, since)``.  Child rows follow their report.
+    """
+    wanted = pl.col(KEY).is_in(report_ids(raw_dir, ids, since)[KEY].implode())
+    reports = scan(raw_dir, "reports", since).filter(wanted)
+    tables = {"reports_raw": reports, "reports_short": reports_short(reports)}
+    for name in CHILDREN:
+        tables[name] = scan(raw_dir, name, since).filter(wanted)
+    tables["drug_product_ingredients"] = scan(raw_dir, "drug_product_ingredients")
+    return tables
+
+
+def collect(tables):
+    """Collect every table of a ``plan`` with the streaming engine."""
+    frames = pl.collect_all(list(tables.values()), engine="streaming")
+    return dict(zip(tables, frames))
+
+
+def explain(tables):
+    """The optimised plan of every table of a ``plan``."""
+    return "\n\n".join(f"== {name} ==\n{lf.explain(engine='streaming')}" for name, lf in tables.items())
+
+
+def extract(raw_dir=RAW_DIR, out_dir=CLEAN_DIR, since=None, log=sys.stderr):
+    """Write the cephalosporin tables to ``out_dir``, sorted by REPORT_ID; returns {table: rows}."""
+    t0 = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+    rows = {}
+    for name, df in collect(plan(raw_dir, since=since)).items():
+        if KEY in df.columns:
+            df = df.sort(KEY, maintain_order=True)
+        df.write_parquet(os.path.join(out_dir, name + ".parquet"))
+        rows[name] = df.height
+        print(f"{name}: {df.height:,} rows", file=log)
+    print(f"Extracted {len(rows)} tables in {time.perf_counter() - t0:.1f}s", file=log)
+    return rows
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Extract the cephalosporin reports from the ingested Canada Vigilance tables.")
+    ap.add_argument("raw_dir", nargs="?", default=RAW_DIR, help="output folder of scripts.ingest")
+    ap.add_argument("out_dir", nargs="?", default=CLEAN_DIR, help="folder for the cephalosporin tables")
+    ap.add_argument("--since", type=datetime.date.fromisoformat, default=None,
+                    help="only reports received on or after this date (YYYY-MM-DD)")
+    ap.add_argument("--explain", action="store_true", help="print the optimised query plans and exit")
+    args = ap.parse_args(argv)
+    if args.explain:
+        ids = ceph_ids(args.raw_dir, args.since)
+        print(f"== REPORT_IDs ==\n{ids.explain(engine='streaming')}\n")
+        print(explain(plan(args.raw_dir, since=args.since)))
+        return 0
+    extract(args.raw_dir, args.out_dir, args.since)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,310 @@
+"""
+Imputation of AGE_Y, WEIGHT_KG and HEIGHT_CM, as in
+``01 Probability of SOC given that ADR/02 Imputation.ipynb``.
+
+For each target in turn (age, then weight, then height) and each sex, a
+``RandomForestRegressor(n_estimators=10, random_state=42)`` is trained on the
+reports where the target is known, using every other non-SOC column of
+``pivoted_full_data`` as features, and predicts the reports where it is
+missing; later targets see the values imputed for earlier ones.
+
+Unlike the notebook the fitted models are kept (``fit`` returns them, ``save``
+/ ``load`` persist them) so new reports can be imputed with ``transform``
+without refitting.  The engine also differs in how it runs:
+
+* the features are a CSR matrix (the ingredient counts are >99% zeros),
+  built a batch of columns at a time, with the three targets kept apart as
+  dense float64.  Forests cannot take NaN in sparse input, so a missing age /
+  weight / height used as a feature is ``MISSING`` (all real values are >= 0,
+  one split isolates it).  ``sparse=False`` keeps a dense matrix with NaN;
+* the two sexes never share rows, so their age -> weight -> height chains
+  run concurrently, and each forest grows its trees on ``n_jobs`` threads;
+* predictions are made ``chunk_size`` rows at a time, and ``impute_parquet``
+  imputes a Parquet file batch by batch without loading it whole.
+
+``notebook`` is the notebook procedure itself (dense, NaN, one model after
+the other); ``benchmark`` compares it with the engine on a fixed random mask
+of known values.
+
+usage (from the repository root):
+    python -m scripts.imputation fit [CLEAN_DIR] [--dense] [--n-jobs N]
+    python -m scripts.imputation impute SRC DST [--imputers PATH] [--batch-size N]
+    python -m scripts.imputation bench [CLEAN_DIR] [--mask-frac 0.1] [--seed 0] [--n-jobs N]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
+import numpy as np
+import polars as pl
+import scipy.sparse as sp
+
+TARGETS = ("AGE_Y", "WEIGHT_KG", "HEIGHT_CM")
+SEX = "GENDER_CODE"  # 0 male, 1 female (see pivoted_full_data)
+KEY = "REPORT_ID"
+MISSING = -1.0  # a missing target used as a feature, in the sparse layout
+FORMAT = 2  # layout of the saved imputers; 1 had the targets in place among the features
+
+
+def _matrix(df, features):
+    """float32 feature matrix in ``features`` order; columns the frame lacks are 0."""
+    have = set(df.columns)
+    absent = [pl.lit(0.0, pl.Float32).alias(c) for c in features if c not in have]
+    return df.with_columns(absent).select(pl.col(c).cast(pl.Float32) for c in features).to_numpy()
+
+
+def _sparse_matrix(df, features, batch=512):
+    """``_matrix`` as CSR, converted ``batch`` columns at a time so the dense matrix never exists."""
+    blocks = [sp.csc_matrix(_matrix(df, features[i:i + batch])) for i in range(0, len(features), batch)]
+    if not blocks:
+        return sp.csr_matrix((df.height, 0), dtype=np.float32)
+    return sp.hstack(blocks, format="csr")
+
+
+def _layout(df, features, sparse):
+    """(base, Y, sex): the non-target features, the targets (float64, NaN = missing) and the sex codes."""
+    base_cols = [c for c in features if c not in TARGETS]
+    base = _sparse_matrix(df, base_cols) if sparse else _matrix(df, base_cols)
+    Y = np.column_stack([df.get_column(t).cast(pl.Float64).to_numpy() if t in df.columns
+                         else np.full(df.height, np.nan) for t in TARGETS])
+    sex = df.get_column(SEX).cast(pl.Float32).to_numpy()
+    return base, Y, sex
+
+
+def _design(base, Y, rows, t):
+    """Features for predicting target ``t`` of ``rows``: base + the other two targets."""
+    others = np.delete(Y[rows], t, axis=1)
+    if not sp.issparse(base):
+        return np.hstack([base[rows], others])
+    others = sp.csr_matrix(np.where(np.isnan(others), MISSING, others))
+    return sp.hstack([base[rows], others], format="csr")
+
+
+def _predict(model, base, Y, rows, t, chunk_size):
+    """Predictions for ``rows``, ``chunk_size`` rows at a time."""
+    out = np.empty(len(rows))
+    for i in range(0, len(rows), chunk_size):
+        part = rows[i:i + chunk_size]
+        out[i:i + len(part)] = model.predict(_design(base, Y, part, t))
+    return out
+
+
+def _new_model(n_estimators, random_state, n_jobs=None):
+    from sklearn.ensemble import RandomForestRegressor
+    return RandomForestRegressor(n_estimators=n_estimators, random_state=random_state, n_jobs=n_jobs)
+
+
+def _chain(base, Y, rows, fit_params, chunk_size, models=None):
+    """
+    Age, weight then height for the reports ``rows`` (one sex), filling Y in
+    place.  Fits the models when ``models`` is None; returns {target: model}.
+    """
+    fitted = {}
+    for t, target in enumerate(TARGETS):
+        missing = rows[np.isnan(Y[rows, t])]
+        if models is None:
+            known = rows[~np.isnan(Y[rows, t])]
+            if not len(known):
+                continue
+            model = _new_model(**fit_params)
+            model.fit(_design(base, Y, known, t), Y[known, t])
+        else:
+            model = models.get(target)
+            if model is None:
+                continue
+        fitted[target] = model
+        if len(missing):
+            Y[missing, t] = _predict(model, base, Y, missing, t, chunk_size)
+    return fitted
+
+
+def _run(base, Y, sex, fit_params=None, models=None, n_jobs=None, chunk_size=8192):
+    """Both sexes' chains on two threads; returns {(code, target): model}."""
+    by_sex = {code: np.flatnonzero(sex == code) for code in (0, 1)}
+    workers = min(2, n_jobs or os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="imputation") as pool:
+        futures = {
+            code: pool.submit(_chain, base, Y, rows, fit_params, chunk_size,
+                              None if models is None else {t: m for (c, t), m in models.items() if c == code})
+            for code, rows in by_sex.items()
+        }
+        return {(code, target): model for code, f in futures.items() for target, model in f.result().items()}
+
+
+def fit(df, exclude=(), n_estimators=10, random_state=42, sparse=True, n_jobs=None, chunk_size=8192):
+    """
+    Fit the per-sex, per-target models on ``df`` (pivoted_full_data without
+    the SOC columns listed in ``exclude``).  Returns (imputers, imputed frame).
+    ``n_jobs``: threads per forest (default: the core count).
+    """
+    features = [c for c in df.columns if c != KEY and c not in exclude]
+    base, Y, sex = _layout(df, features, sparse)
+    params = {"n_estimators": n_estimators, "random_state": random_state, "n_jobs": n_jobs or os.cpu_count()}
+    models = _run(base, Y, sex, fit_params=params, n_jobs=n_jobs, chunk_size=chunk_size)
+    imputers = {"format": FORMAT, "features": features, "sparse": sparse, "models": models}
+    return imputers, _with_targets(df, Y)
+
+
+def transform(df, imputers, n_jobs=None, chunk_size=8192):
+    """Fill the missing targets of ``df`` with fitted ``imputers``; other columns are returned as they are."""
+    if imputers.get("format") != FORMAT:
+        raise ValueError(f"imputers have format {imputers.get('format', 1)}, expected {FORMAT}; refit them")
+    base, Y, sex = _layout(df, imputers["features"], imputers["sparse"])
+    _run(base, Y, sex, models=imputers["models"], n_jobs=n_jobs, chunk_size=chunk_size)
+    return _with_targets(df, Y)
+
+
+def impute_parquet(src, dst, imputers, batch_size=65_536, n_jobs=None, chunk_size=8192):
+    """``transform`` a Parquet file ``batch_size`` rows at a time into ``dst``; returns the row count."""
+    import pyarrow.parquet as pq
+
+    rows, writer = 0, None
+    try:
+        for batch in pq.ParquetFile(src).iter_batches(batch_size=batch_size):
+            out = transform(pl.from_arrow(batch), imputers, n_jobs, chunk_size).to_arrow()
+            if writer is None:
+                writer = pq.ParquetWriter(dst, out.schema)
+            writer.write_table(out)
+            rows += out.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def notebook(df, exclude=(), n_estimators=10, random_state=42):
+    """The imputed frame exactly as 02 Imputation computes it: dense with NaN, one model after the other."""
+    features = [c for c in df.columns if c != KEY and c not in exclude]
+    X = _matrix(df, features)
+    sex = X[:, features.index(SEX)]
+    for target in TARGETS:
+        t = features.index(target)
+        others = [j for j in range(len(features)) if j != t]
+        for code in (0, 1):
+            rows = sex == code
+            known = rows & ~np.isnan(X[:, t])
+            missing = rows & np.isnan(X[:, t])
+            if not known.any():
+                continue
+            model = _new_model(n_estimators, random_state)
+            model.fit(X[known][:, others], X[known, t])
+            if missing.any():
+                X[missing, t] = model.predict(X[missing][:, others])
+    return _with_targets(df, np.column_stack([X[:, features.index(t)] for t in TARGETS]).astype(np.float64))
+
+
+def _with_targets(df, Y):
+    # only the missing values are taken from Y; known ones keep their precision,
+    # and rows that were not imputed (NaN in Y) stay null
+    return df.with_columns(
+        pl.coalesce(target, pl.Series(Y[:, t]).fill_nan(None)).alias(target) for t, target in enumerate(TARGETS)
+    )
+
+
+def save(imputers, path):
+    joblib.dump(imputers, path)
+
+
+def load(path):
+    return joblib.load(path)
+
+
+# ---------------- benchmark ----------------
+def mask_known(df, frac=0.1, seed=0):
+    """(df with ``frac`` of the known values of each target set to null, {target: (row indices, true values)})."""
+    rng = np.random.default_rng(seed)
+    truth, masked = {}, []
+    for target in TARGETS:
+        values = df.get_column(target).cast(pl.Float64).to_numpy()
+        known = np.flatnonzero(~np.isnan(values))
+        rows = np.sort(rng.choice(known, size=int(len(known) * frac), replace=False))
+        truth[target] = (rows, values[rows])
+        hide = np.zeros(df.height, dtype=bool)
+        hide[rows] = True
+        masked.append(pl.when(pl.Series(hide)).then(None).otherwise(pl.col(target)).alias(target))
+    return df.with_columns(masked), truth
+
+
+def _errors(imputed, truth):
+    out = {}
+    for target, (rows, true) in truth.items():
+        err = imputed.get_column(target).to_numpy()[rows] - true
+        out[target] = {"mae": float(np.mean(np.abs(err))), "rmse": float(np.sqrt(np.mean(err ** 2)))}
+    return out
+
+
+def benchmark(df, exclude=(), frac=0.1, seed=0, n_jobs=None, log=sys.stderr):
+    """
+    Runtime and error of ``notebook`` and ``fit`` (sparse and dense) on
+    ``df`` with ``frac`` of the known targets masked (``mask_known``).  The
+    mask and the forests are seeded, so the errors are identical run to run.
+    """
+    masked, truth = mask_known(df, frac, seed)
+    runs = {
+        "notebook": lambda: notebook(masked, exclude),
+        "dense": lambda: fit(masked, exclude, sparse=False, n_jobs=n_jobs)[1],
+        "sparse": lambda: fit(masked, exclude, sparse=True, n_jobs=n_jobs)[1],
+    }
+    result = {"reports": df.height, "mask_frac": frac, "seed": seed,
+              "n_jobs": n_jobs or os.cpu_count(), "runs": {}}
+    for name, run in runs.items():
+        t0 = time.perf_counter()
+        imputed = run()
+        seconds = time.perf_counter() - t0
+        result["runs"][name] = {"seconds": round(seconds, 3), "errors": _errors(imputed, truth)}
+        print(f"{name}: {seconds:.1f}s", file=log)
+    return result
+
+
+# ---------------- CLI ----------------
+def _clean_inputs(clean_dir):
+    """pivoted_full_data and the SOC columns to leave out, from a clean dir."""
+    df = pl.read_parquet(os.path.join(clean_dir, "pivoted_full_data.parquet"))
+    socs = pl.read_parquet_schema(os.path.join(clean_dir, "pivoted_socs.parquet"))
+    return df, [c for c in socs if c != KEY]
+
+
+def main(argv=None):
+    from scripts.extract import CLEAN_DIR
+
+    ap = argparse.ArgumentParser(description="Impute AGE_Y, WEIGHT_KG and HEIGHT_CM of pivoted_full_data.")
+    sub = ap.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("fit", help="fit the imputers and write pivoted_full_data_imputed")
+    p.add_argument("clean_dir", nargs="?", default=CLEAN_DIR)
+    p.add_argument("--dense", action="store_true", help="dense features with NaN instead of sparse")
+    p = sub.add_parser("impute", help="impute a Parquet file of new reports with saved imputers")
+    p.add_argument("src")
+    p.add_argument("dst")
+    p.add_argument("--imputers", default=os.path.join(CLEAN_DIR, "imputers.joblib"))
+    p.add_argument("--batch-size", type=int, default=65_536)
+    p = sub.add_parser("bench", help="compare with the notebook procedure on masked known values")
+    p.add_argument("clean_dir", nargs="?", default=CLEAN_DIR)
+    p.add_argument("--mask-frac", type=float, default=0.1)
+    p.add_argument("--seed", type=int, default=0)
+    for p in sub.choices.values():
+        p.add_argument("--n-jobs", type=int, default=None, help="threads per forest (default: core count)")
+    args = ap.parse_args(argv)
+
+    t0 = time.perf_counter()
+    if args.command == "fit":
+        df, socs = _clean_inputs(args.clean_dir)
+        imputers, imputed = fit(df, exclude=socs, sparse=not args.dense, n_jobs=args.n_jobs)
+        save(imputers, os.path.join(args.clean_dir, "imputers.joblib"))
+        imputed.write_parquet(os.path.join(args.clean_dir, "pivoted_full_data_imputed.parquet"))
+        print(f"Fitted {len(imputers['models'])} imputers on {df.height:,} reports "
+              f"in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+    elif args.command == "impute":
+        rows = impute_parquet(args.src, args.dst, load(args.imputers), args.batch_size, args.n_jobs)
+        print(f"Imputed {rows:,} reports in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+    else:
+        df, socs = _clean_inputs(args.clean_dir)
+        print(json.dumps(benchmark(df, socs, args.mask_frac, args.seed, args.n_jobs), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
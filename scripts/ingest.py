@@ -0,0 +1,304 @@
+"""
+Streaming ingestion of the Canada Vigilance extracts into Parquet.
+
+Health Canada publishes the database as headerless ``$``-separated text files
+(``reports.txt``, ``reactions.txt``, ``report_drug.txt``, ...).  The notebook
+``00 Canada Data/01 Canada.ipynb`` read each one whole with
+``pl.read_csv(..., ignore_errors=True)`` and renamed ``column_1..N`` by hand;
+this module does the same job with declared schemas, reading each extract
+with ``scan_csv`` in streaming batches that are appended to Parquet as they
+arrive, so no table is ever fully in memory:
+
+* every column is named and typed in ``TABLES``; text columns are written
+  dictionary-encoded (Parquet RLE_DICTIONARY pages), which is what keeps the
+  low-cardinality labels (units, sexes, SOC names, ...) small on disk.  They
+  are read back as String: polars decodes Categorical pages several times
+  slower and cannot skip them when a scan is filtered, so ``--categorical``
+  (the label columns as Categorical) is opt-in.  Text is kept as the reader
+  gives it (a quoted ``""`` stays an empty string, an unquoted empty field is
+  null), as before;
+* ``reports`` and its child tables (reactions, report_drug, ...) are written
+  hive-partitioned by the year the report was received::
+
+      out/reports/REPORT_YEAR=1973/data.parquet
+      out/reactions/REPORT_YEAR=1973/data.parquet
+
+  read them back with ``pl.scan_parquet(out / "reactions")``; the lookup
+  tables (``drug_product``, ``outcomes``, ``*_lx``) stay single files;
+* malformed records (too many fields, a missing id, an id or code that is not
+  an integer) are not nulled out silently: they are left out of the table and
+  written with their raw fields and the reason to ``out/_rejects/<table>.parquet``,
+  and their count is printed.
+
+Memory stays bounded: the extract is read in streaming batches that go to
+disk as they come (``ParquetSink``), and the only table held whole is the
+REPORT_ID -> year map (two integers per report) that partitions the child tables.
+
+usage (from the repository root):
+    python -m scripts.ingest [SRC_DIR] [OUT_DIR] [--tables reports reactions ...] [--categorical]
+"""
+import argparse
+import datetime
+import os
+import shutil
+import sys
+import time
+
+import polars as pl
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(ROOT, "data", "Canada Vigilance Adverse Reaction Online Database")
+OUT_DIR = os.path.join(ROOT, "data", "raw", "Canada Vigilance Adverse Reaction Online Database")
+
+I, S, C = pl.Int64, pl.String, pl.Categorical
+
+# output name -> (extract file, partitioned by report year, [(column, dtype)]); column order is the file's,
+# C marks the label columns written as Categorical with --categorical
+TABLES = {
+    "reports": ("reports.txt", True, [
+        ("REPORT_ID", I), ("REPORT_NO", I), ("VERSION_NO", I),
+        ("DATRECEIVED", S), ("DATINTRECEIVED", S), ("MAH_NO", S),
+        ("REPORT_TYPE_CODE", I), ("REPORT_TYPE_ENG", C), ("REPORT_TYPE_FR", C),
+        ("GENDER_CODE", C), ("GENDER_ENG", C), ("GENDER_FR", C),
+        ("AGE", S), ("AGE_Y", S), ("AGE_UNIT_ENG", C), ("AGE_UNIT_FR", C),
+        ("OUTCOME_CODE", I), ("OUTCOME_ENG", C), ("OUTCOME_FR", C),
+        ("WEIGHT", S), ("WEIGHT_UNIT_ENG", C), ("WEIGHT_UNIT_FR", C),
+        ("HEIGHT", S), ("HEIGHT_UNIT_ENG", C), ("HEIGHT_UNIT_FR", C),
+        ("SERIOUSNESS_CODE", I), ("SERIOUSNESS_ENG", C), ("SERIOUSNESS_FR", C),
+        ("DEATH", C), ("DISABILITY", C), ("CONGENITAL_ANOMALY", C),
+        ("LIFE_THREATENING", C), ("HOSP_REQUIRED", C), ("OTHER_MEDICALLY_IMP_COND", C),
+        ("REPORTER_TYPE_ENG", C), ("REPORTER_TYPE_FR", C),
+        ("SOURCE_CODE", C), ("SOURCE_ENG", C), ("SOURCE_FR", C),
+        ("E2B_IMP_SAFETYREPORT_ID", S), ("AUTHORITY_NUMB", S), ("COMPANY_NUMB", S),
+    ]),
+    "reactions": ("reactions.txt", True, [
+        ("REACTION_ID", I), ("REPORT_ID", I),
+        ("DURATION", S), ("DURATION_UNIT_ENG", C), ("DURATION_UNIT_FR", C),
+        ("PT_NAME_ENG", S), ("PT_NAME_FR", S),
+        ("SOC_NAME_ENG", C), ("SOC_NAME_FR", C), ("MEDDRA_VERSION", C),
+    ]),
+    "report_drug": ("report_drug.txt", True, [
+        ("REPORT_DRUG_ID", I), ("REPORT_ID", I), ("DRUG_PRODUCT_ID", I), ("DRUGNAME", S),
+        ("DRUGINVOLV_ENG", C), ("DRUGINVOLV_FR", C), ("ROUTEADMIN_ENG", C), ("ROUTEADMIN_FR", C),
+        ("UNIT_DOSE_QTY", S), ("DOSE_UNIT_ENG", C), ("DOSE_UNIT_FR", C),
+        ("FREQUENCY", S), ("FREQ_TIME", S), ("FREQUENCY_TIME_ENG", C), ("FREQUENCY_TIME_FR", C),
+        ("FREQ_TIME_UNIT_ENG", C), ("FREQ_TIME_UNIT_FR", C),
+        ("THERAPY_DURATION", S), ("THERAPY_DURATION_UNIT_ENG", C), ("THERAPY_DURATION_UNIT_FR", C),
+        ("DOSAGEFORM_ENG", C), ("DOSAGEFORM_FR", C),
+    ]),
+    "report_drug_indication": ("report_drug_indication.txt", True, [
+        ("REPORT_DRUG_ID", I), ("REPORT_ID", I), ("DRUG_PRODUCT_ID", I), ("DRUGNAME", S),
+        ("INDICATION_NAME_ENG", S), ("INDICATION_NAME_FR", S),
+    ]),
+    "report_links": ("report_links.txt", True, [
+        ("REPORT_LINK_ID", I), ("REPORT_ID", I),
+        ("RECORD_TYPE_ENG", C), ("RECORD_TYPE_FR", C), ("REPORT_LINK_NO", S),
+    ]),
+    "drug_product_ingredients": ("drug_product_ingredients.txt", False, [
+        ("DRUG_PRODUCT_INGREDIENT_ID", I), ("DRUG_PRODUCT_ID", I), ("DRUGNAME", S),
+        ("ACTIVE_INGREDIENT_ID", I), ("ACTIVE_INGREDIENT_NAME", S),
+    ]),
+    "drug_product": ("drug_products.txt", False, [("DRUG_PRODUCT_ID", I), ("DRUGNAME", S)]),
+    "outcomes": ("outcome_lx.txt", False, [
+        ("OUTCOME_LX_ID", I), ("OUTCOME_CODE", I), ("OUTCOME_EN", S), ("OUTCOME_FR", S),
+    ]),
+    "report_type_lx": ("report_type_lx.txt", False, [
+        ("REPORT_TYPE_LX_ID", I), ("REPORT_TYPE_CODE", I), ("REPORT_TYPE_EN", S), ("REPORT_TYPE_FR", S),
+    ]),
+    "seriousness_lx": ("seriousness_lx.txt", False, [
+        ("SERIOUSNESS_LX_ID", I), ("SERIOUSNESS_CODE", I), ("SERIOUSNESS_EN", S), ("SERIOUSNESS_FR", S),
+    ]),
+    "source_lx": ("source_lx.txt", False, [
+        ("SOURCE_LX_ID", I), ("SOURCE_CODE", I), ("SOURCE_EN", S), ("SOURCE_FR", S),
+    ]),
+}
+
+PARTITION = "REPORT_YEAR"
+EXTRA = "_EXTRA_FIELDS"   # catches the fields of records longer than the schema
+RECORD = "RECORD"         # 1-based record number in the extract, kept on rejected rows
+HIVE_NULL = "__HIVE_DEFAULT_PARTITION__"
+
+
+def received_date(datreceived):
+    """
+    Date of a DATRECEIVED expression ("18-JUN-73").  ``%y`` maps 65..68 to
+    2065..2068, but the database starts in 1965, so dates in the future lose a century.
+    """
+    date = datreceived.str.strptime(pl.Date, format="%d-%b-%y", strict=False)
+    return pl.when(date > datetime.date.today()).then(date.dt.offset_by("-100y")).otherwise(date)
+
+
+def report_year(datreceived):
+    """Year of a DATRECEIVED expression (see ``received_date``)."""
+    return received_date(datreceived).dt.year().cast(pl.Int16)
+
+
+def scan_extract(path, columns):
+    """Lazy scan of one extract with every field as text, plus RECORD and EXTRA."""
+    return pl.scan_csv(
+        path,
+        separator="$",
+        quote_char='"',
+        has_header=False,
+        schema={**{name: pl.String for name, _ in columns}, EXTRA: pl.String},
+        truncate_ragged_lines=True,
+        encoding="utf8-lossy",
+        row_index_name=RECORD,
+        row_index_offset=1,
+    )
+
+
+def problems(columns):
+    """Expression with the reasons a raw record is malformed ("" if it is fine)."""
+    checks = [pl.when(pl.col(EXTRA).is_not_null()).then(pl.lit("too many fields"))]
+    key = columns[0][0]
+    checks.append(pl.when(pl.col(key).is_null() | (pl.col(key) == "")).then(pl.lit(f"missing {key}")))
+    for name, dtype in columns:
+        if dtype == I:
+            raw = pl.col(name)
+            bad = (raw != "") & raw.cast(I, strict=False).is_null()
+            checks.append(pl.when(bad).then(pl.lit(f"{name} is not an integer")))
+    return pl.concat_str(checks, separator="; ", ignore_nulls=True).fill_null("")
+
+
+def typed(columns, categorical=False):
+    """The declared columns of a raw record cast to their types."""
+    exprs = []
+    for name, dtype in columns:
+        if dtype == C and not categorical:
+            dtype = S
+        exprs.append(pl.col(name).cast(dtype, strict=False))
+    return exprs
+
+
+class ParquetSink:
+    """
+    Streams DataFrames into Parquet with memory bounded by one batch.  Every
+    ``write`` goes straight to disk as part files; with ``by`` they land in hive
+    partitions ``path/<by>=<value>/``, without it they make up the single file
+    ``path``.  ``close`` merges each partition's parts into one file, again
+    streaming, so the tables are not left as thousands of slivers when the
+    extract is not ordered by year.
+    """
+
+    def __init__(self, path, by=None):
+        self.path = path
+        self.by = by
+        self.rows = 0
+        self._parts = {}  # partition folder -> parts written
+        # a refresh replaces the output; stale years would otherwise linger
+        if by:
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def _folder(self, key):
+        if not self.by:
+            return self.path + ".parts"
+        return os.path.join(self.path, f"{self.by}={HIVE_NULL if key is None else key}")
+
+    def write(self, df):
+        if not df.height:
+            return
+        self.rows += df.height
+        parts = df.partition_by(self.by, as_dict=True, include_key=False) if self.by else {(None,): df}
+        for (key,), part in parts.items():
+            folder = self._folder(key)
+            n = self._parts.get(folder, 0)
+            if not n:
+                os.makedirs(folder, exist_ok=True)
+            part.write_parquet(os.path.join(folder, f"part-{n:05d}.parquet"))
+            self._parts[folder] = n + 1
+
+    def close(self):
+        for folder, n in self._parts.items():
+            parts = [os.path.join(folder, f"part-{i:05d}.parquet") for i in range(n)]
+            target = os.path.join(folder, "data.parquet") if self.by else self.path
+            if n == 1:
+                os.replace(parts[0], target)
+            else:
+                pl.scan_parquet(parts).sink_parquet(target)
+                for part in parts:
+                    os.remove(part)
+            if not self.by:
+                os.rmdir(folder)
+        self._parts = {}
+
+
+def ingest_table(name, src_dir=SRC_DIR, out_dir=OUT_DIR, years=None, categorical=False):
+    """
+    Stream one extract into ``out_dir``.  ``years`` (a REPORT_ID/REPORT_YEAR
+    DataFrame) is needed for the partitioned child tables.  Returns (rows, rejected).
+    """
+    filename, partitioned, columns = TABLES[name]
+    raw = scan_extract(os.path.join(src_dir, filename), columns).with_columns(_problem=problems(columns))
+    if name == "reports":
+        raw = raw.with_columns(report_year(pl.col("DATRECEIVED")).alias(PARTITION))
+    elif partitioned:
+        # child rows take their report's year; orphans land in the null partition
+        raw = raw.join(years.lazy().rename({"REPORT_ID": "_REPORT_ID"}),
+                       left_on=pl.col("REPORT_ID").cast(I, strict=False), right_on="_REPORT_ID",
+                       how="left", maintain_order="left")
+
+    if partitioned:
+        table = ParquetSink(os.path.join(out_dir, name), by=PARTITION)
+    else:
+        table = ParquetSink(os.path.join(out_dir, name + ".parquet"))
+    rejects = ParquetSink(os.path.join(out_dir, "_rejects", name + ".parquet"))
+
+    keep = typed(columns, categorical) + ([pl.col(PARTITION)] if partitioned else [])
+    raw_columns = [RECORD] + [c for c, _ in columns] + [EXTRA]
+    for batch in raw.collect_batches(engine="streaming"):
+        ok = batch["_problem"] == ""
+        table.write(batch.filter(ok).select(keep))
+        rejects.write(batch.filter(~ok).select(raw_columns + [pl.col("_problem").alias("PROBLEM")]))
+    table.close()
+    rejects.close()
+    return table.rows, rejects.rows
+
+
+def report_years(out_dir=OUT_DIR):
+    """REPORT_ID -> REPORT_YEAR of the ingested reports (small enough to hold)."""
+    return (pl.scan_parquet(os.path.join(out_dir, "reports"), hive_partitioning=True)
+            .select("REPORT_ID", PARTITION)
+            .collect())
+
+
+def ingest(src_dir=SRC_DIR, out_dir=OUT_DIR, tables=None, categorical=False, log=sys.stderr):
+    """Ingest ``tables`` (default: every extract present); returns {table: (rows, rejected, seconds)}."""
+    tables = list(tables or TABLES)
+    # the child tables are partitioned with the years of the reports, so reports go first
+    tables.sort(key=lambda t: t != "reports")
+    summary = {}
+    years = None
+    for name in tables:
+        path = os.path.join(src_dir, TABLES[name][0])
+        if not os.path.exists(path):
+            print(f"{name}: {path} not found, skipped", file=log)
+            continue
+        if TABLES[name][1] and name != "reports" and years is None:
+            years = report_years(out_dir)
+        t0 = time.perf_counter()
+        rows, rejected = ingest_table(name, src_dir, out_dir, years, categorical)
+        dt = time.perf_counter() - t0
+        summary[name] = (rows, rejected, dt)
+        note = f", {rejected:,} malformed records -> _rejects/{name}.parquet" if rejected else ""
+        print(f"{name}: {rows:,} rows in {dt:.1f}s{note}", file=log)
+    return summary
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Stream the Canada Vigilance $-separated extracts into Parquet.")
+    ap.add_argument("src_dir", nargs="?", default=SRC_DIR, help="folder with reports.txt, reactions.txt, ...")
+    ap.add_argument("out_dir", nargs="?", default=OUT_DIR, help="output folder")
+    ap.add_argument("--tables", nargs="+", choices=sorted(TABLES), default=None, help="only these tables")
+    ap.add_argument("--categorical", action="store_true", help="write label columns as Categorical, not String")
+    args = ap.parse_args(argv)
+    summary = ingest(args.src_dir, args.out_dir, args.tables, args.categorical)
+    rejected = sum(r for _, r, _ in summary.values())
+    print(f"Ingested {len(summary)} tables; {rejected:,} malformed records set aside.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
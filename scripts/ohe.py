@@ -0,0 +1,151 @@
+"""
+The report-level one-hot blocks of ``00 Canada Data/05 OHE.ipynb`` as sparse matrices.
+
+The notebook pivots PT, SOC, indication, active ingredient and cephalosporin
+generation into dense, zero-filled UInt8 frames (``report_ohe``), one column
+per category.  Here each block is a ``ReportEncoder`` (interface/encoder.py)
+over the tables of ``data/cephalosporines_clean``:
+
+    pt                reactions.PT_NAME_ENG
+    soc               reactions.SOC_NAME_ENG
+    indication        report_drug_indication.INDICATION_NAME_ENG
+    activeingredient  report_drug x drug_product_ingredients, cephalosporin ingredients only
+    cephgen           generation of those ingredients (GEN_MAP of interface/scoring, else "other")
+
+The activeingredient and cephgen blocks need drug_product_ingredients, which
+only ``python -m scripts.extract`` / ``python -m scripts.refresh`` write to the
+clean folder; without it those two are skipped (with a message) and the
+other blocks are still encoded.
+
+All blocks share the rows (every REPORT_ID of reports_short, sorted), and are
+written to ``OUT_DIR/<block>_ohe.npz`` next to their vocabulary
+``<block>_vocab.npz``.  An existing vocabulary is reused as it is, so a
+rerun on a newer extract keeps the column indices and counts the categories
+it does not know; ``--extend`` appends them instead (a new vocabulary
+version), ``--refit`` learns the vocabularies from scratch.  Column names are
+the stripped category values, not the notebook's sanitised names.
+
+usage (from the repository root):
+    python -m scripts.ohe [CLEAN_DIR] [OUT_DIR] [--extend | --refit]
+"""
+import argparse
+import os
+import sys
+import time
+
+import polars as pl
+
+from scripts.extract import CEPH_PATTERN, CLEAN_DIR, KEY, missing_tables
+from scripts.ingest import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, "interface"))
+from encoder import ReportEncoder, Vocabulary, load_matrix, save_matrix  # noqa: E402
+from scoring import GEN_MAP  # noqa: E402
+
+OUT_DIR = os.path.join(ROOT, "data", "processed")
+BLOCKS = ("pt", "soc", "indication", "activeingredient", "cephgen")
+# clean tables each block is encoded from
+SOURCES = {
+    "pt": ("reactions",),
+    "soc": ("reactions",),
+    "indication": ("report_drug_indication",),
+    "activeingredient": ("report_drug", "drug_product_ingredients"),
+    "cephgen": ("report_drug", "drug_product_ingredients"),
+}
+
+
+def _read(clean_dir, name, *columns):
+    return pl.read_parquet(os.path.join(clean_dir, name + ".parquet"), columns=list(columns))
+
+
+def _stripped(df, column):
+    return df.with_columns(pl.col(column).cast(pl.String).str.strip_chars()).filter(pl.col(column) != "")
+
+
+def long_table(clean_dir, block):
+    """(REPORT_ID, category) frame of one of the notebook blocks."""
+    if block in ("pt", "soc"):
+        column = "PT_NAME_ENG" if block == "pt" else "SOC_NAME_ENG"
+        return _stripped(_read(clean_dir, "reactions", KEY, column), column)
+    if block == "indication":
+        return _stripped(_read(clean_dir, "report_drug_indication", KEY, "INDICATION_NAME_ENG"), "INDICATION_NAME_ENG")
+    ingredients = (
+        _read(clean_dir, "report_drug", KEY, "DRUG_PRODUCT_ID")
+        .join(_read(clean_dir, "drug_product_ingredients", "DRUG_PRODUCT_ID", "ACTIVE_INGREDIENT_NAME"),
+              on="DRUG_PRODUCT_ID")
+        .select(KEY, "ACTIVE_INGREDIENT_NAME")
+        .pipe(_stripped, "ACTIVE_INGREDIENT_NAME")
+        .filter(pl.col("ACTIVE_INGREDIENT_NAME").str.contains(CEPH_PATTERN))
+    )
+    if block == "activeingredient":
+        return ingredients
+    return ingredients.select(
+        KEY,
+        pl.col("ACTIVE_INGREDIENT_NAME").str.to_lowercase()
+        .replace_strict(GEN_MAP, default="other", return_dtype=pl.String).alias("ceph_gen"),
+    )
+
+
+def paths(out_dir, block):
+    """(matrix, vocabulary) file of a block."""
+    return (os.path.join(out_dir, f"{block}_ohe.npz"), os.path.join(out_dir, f"{block}_vocab.npz"))
+
+
+def encode(clean_dir=CLEAN_DIR, out_dir=OUT_DIR, extend=False, refit=False, log=sys.stderr):
+    """
+    Write every block's matrix (and its vocabulary if new or extended); returns {block: EncodedReports}.
+    A block whose source tables are missing is skipped and left out of the result.
+    """
+    t0 = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+    keys = _read(clean_dir, "reports_short", KEY).get_column(KEY).unique().sort().to_numpy()
+    out = {}
+    for block in BLOCKS:
+        missing = missing_tables(clean_dir, SOURCES[block])
+        if missing:
+            print(f"{block}: skipped, no {', '.join(missing)} in {clean_dir} "
+                  f"(run python -m scripts.extract or python -m scripts.refresh first)", file=log)
+            continue
+        df = long_table(clean_dir, block)
+        matrix_path, vocab_path = paths(out_dir, block)
+        column = df.columns[1]
+        vocab = None if refit or not os.path.exists(vocab_path) else Vocabulary.load(vocab_path)
+        encoder = ReportEncoder(column, KEY, vocab)
+        if vocab is None:
+            encoder.fit(df)
+        elif extend:
+            encoder.partial_fit(df)
+        if encoder.vocabulary is not vocab:
+            encoder.vocabulary.save(vocab_path)
+        encoded = encoder.transform(df, keys)
+        save_matrix(matrix_path, encoded, encoder.vocabulary)
+        out[block] = encoded
+        m = encoded.matrix
+        print(f"{block}: {m.shape[0]:,} x {m.shape[1]:,}, {m.nnz:,} ones, "
+              f"{encoded.unknown} unknown categories ({encoder.vocabulary!r})", file=log)
+    print(f"Encoded {len(out)} blocks in {time.perf_counter() - t0:.1f}s", file=log)
+    return out
+
+
+def load(block, out_dir=OUT_DIR):
+    """(REPORT_IDs, CSR matrix, Vocabulary) of an encoded block."""
+    matrix_path, vocab_path = paths(out_dir, block)
+    vocab = Vocabulary.load(vocab_path)
+    keys, matrix = load_matrix(matrix_path, vocab)
+    return keys, matrix, vocab
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Encode the report-level one-hot blocks as sparse matrices.")
+    ap.add_argument("clean_dir", nargs="?", default=CLEAN_DIR, help="folder with the cephalosporin tables")
+    ap.add_argument("out_dir", nargs="?", default=OUT_DIR, help="folder for the .npz matrices and vocabularies")
+    mode = ap.add_mutually_exclusive_group()
+    mode.add_argument("--extend", action="store_true", help="append unknown categories to the saved vocabularies")
+    mode.add_argument("--refit", action="store_true", help="learn the vocabularies from scratch")
+    args = ap.parse_args(argv)
+    encoded = encode(args.clean_dir, args.out_dir, extend=args.extend, refit=args.refit)
+    return 0 if len(encoded) == len(BLOCKS) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
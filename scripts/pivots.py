@@ -0,0 +1,119 @@
+"""
+The report x ingredient and report x SOC count matrices of ``01 Pivots`` as sparse arrays.
+
+The notebook (and ``refresh.pivot_ingredients``) pivots the
+report_drug x drug_product_ingredients join into a dense frame with one
+column per active ingredient, zero-filled.  Here the long tables are turned
+into CSR matrices directly: the category becomes its code through an Enum
+cast, the report its row, and one group-by counts the (row, code) pairs
+(``ReportEncoder(counts=True)`` of interface/encoder.py).  They are written
+next to ``pivoted_socs.parquet`` in ``data/cephalosporines_clean``:
+
+    pivoted_active_ingredients.npz  how many of the report's drugs contain the ingredient
+    pivoted_socs.npz                how many of the report's reactions are in the SOC
+                                    (> 0 gives pivoted_socs.parquet)
+
+each with its vocabulary ``<name>_vocab.npz``.  Rows are every REPORT_ID of
+reports_short, sorted.  The ingredient matrix needs drug_product_ingredients,
+which only ``python -m scripts.extract`` / ``python -m scripts.refresh`` write
+to the clean folder; without it that matrix is skipped (with a message) and
+the SOC matrix is still built.  A saved vocabulary is extended, never reordered, so
+the column of an ingredient stays the same across refreshes.  ``load`` reads a
+matrix back without re-pivoting.
+
+usage (from the repository root):
+    python -m scripts.pivots [CLEAN_DIR] [--refit]
+"""
+import argparse
+import os
+import sys
+import time
+
+import polars as pl
+
+from scripts.extract import CLEAN_DIR, KEY, missing_tables
+from scripts.ingest import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, "interface"))
+from encoder import ReportEncoder, Vocabulary, load_matrix, save_matrix  # noqa: E402
+
+MATRICES = ("pivoted_active_ingredients", "pivoted_socs")
+
+
+def _read(clean_dir, name, *columns):
+    return pl.read_parquet(os.path.join(clean_dir, name + ".parquet"), columns=list(columns))
+
+
+# clean tables each matrix is built from
+SOURCES = {
+    "pivoted_active_ingredients": ("report_drug", "drug_product_ingredients"),
+    "pivoted_socs": ("reactions",),
+}
+
+
+def long_table(clean_dir, name):
+    """(REPORT_ID, category) frame of a matrix, one row per drug ingredient / reaction."""
+    if name == "pivoted_active_ingredients":
+        return (
+            _read(clean_dir, "report_drug", KEY, "DRUG_PRODUCT_ID")
+            .join(_read(clean_dir, "drug_product_ingredients", "DRUG_PRODUCT_ID", "ACTIVE_INGREDIENT_NAME"),
+                  on="DRUG_PRODUCT_ID")
+            .select(KEY, "ACTIVE_INGREDIENT_NAME")
+        )
+    return _read(clean_dir, "reactions", KEY, "SOC_NAME_ENG")
+
+
+def paths(clean_dir, name):
+    """(matrix, vocabulary) file of a matrix."""
+    return os.path.join(clean_dir, f"{name}.npz"), os.path.join(clean_dir, f"{name}_vocab.npz")
+
+
+def build(clean_dir=CLEAN_DIR, refit=False, log=sys.stderr):
+    """
+    Write the count matrices (and their vocabularies); returns {matrix: EncodedReports}.
+    A matrix whose source tables are missing is skipped and left out of the result.
+    """
+    t0 = time.perf_counter()
+    keys = _read(clean_dir, "reports_short", KEY).get_column(KEY).unique().sort().to_numpy()
+    out = {}
+    for name in MATRICES:
+        missing = missing_tables(clean_dir, SOURCES[name])
+        if missing:
+            print(f"{name}: skipped, no {', '.join(missing)} in {clean_dir} "
+                  f"(run python -m scripts.extract or python -m scripts.refresh first)", file=log)
+            continue
+        df = long_table(clean_dir, name)
+        matrix_path, vocab_path = paths(clean_dir, name)
+        column = df.columns[1]
+        vocab = None if refit or not os.path.exists(vocab_path) else Vocabulary.load(vocab_path)
+        encoder = ReportEncoder(column, KEY, vocab, counts=True).partial_fit(df)
+        if encoder.vocabulary is not vocab:
+            encoder.vocabulary.save(vocab_path)
+        encoded = encoder.transform(df, keys)
+        save_matrix(matrix_path, encoded, encoder.vocabulary)
+        out[name] = encoded
+        m = encoded.matrix
+        print(f"{name}: {m.shape[0]:,} x {m.shape[1]:,}, {m.nnz:,} non-zero", file=log)
+    print(f"Built {len(out)} count matrices in {time.perf_counter() - t0:.2f}s", file=log)
+    return out
+
+
+def load(name, clean_dir=CLEAN_DIR):
+    """(REPORT_IDs, CSR counts, column names) of a matrix written by ``build``."""
+    matrix_path, vocab_path = paths(clean_dir, name)
+    vocab = Vocabulary.load(vocab_path)
+    keys, matrix = load_matrix(matrix_path, vocab)
+    return keys, matrix, vocab.names
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Build the sparse report x ingredient / SOC count matrices.")
+    ap.add_argument("clean_dir", nargs="?", default=CLEAN_DIR, help="folder with the cephalosporin tables")
+    ap.add_argument("--refit", action="store_true", help="learn the column vocabularies from scratch")
+    args = ap.parse_args(argv)
+    built = build(args.clean_dir, refit=args.refit)
+    return 0 if len(built) == len(MATRICES) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
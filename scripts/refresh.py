@@ -0,0 +1,279 @@
+"""
+Incremental refresh of ``data/cephalosporines_clean``.
+
+Rerunning the notebook chain after every Health Canada extract rebuilds the
+cephalosporin tables, the pivots and the imputation from zero.  This module
+keeps a manifest of the reports it has processed (``_manifest.parquet``:
+REPORT_ID, DATRECEIVED and a content hash of the report row and all of its
+reactions, drugs and indications) and, given a freshly ingested extract
+(``python -m scripts.ingest``), only reprocesses the difference:
+
+* new reports: cephalosporin reports whose REPORT_ID is not in the manifest;
+* changed reports: DATRECEIVED or content hash differs from the manifest;
+* removed reports: in the manifest but no longer cephalosporin reports.
+
+Their rows are dropped from every output and the new/changed ones extracted
+(``scripts.extract``), rebuilt with the notebook recipes and merged back:
+
+    reports_raw, reports_short, report_drug, reactions, report_drug_indication,
+    drug_product_ingredients        (00 Canada Data Raw, 02_00 Cephalosporines Clean)
+    pivoted_active_ingredients, pivoted_socs, pivoted_full_data      (01 Pivots)
+    pivoted_active_ingredients.npz, pivoted_socs.npz                 (scripts.pivots)
+    pivoted_full_data_imputed                                       (02 Imputation)
+
+Imputation of the new reports uses the random forests fitted on the last full
+build (``imputers.joblib``) instead of refitting them.  A full rebuild happens
+when there is no manifest yet, with ``--full``, when the product -> ingredient
+table changes (it decides which reports are cephalosporin reports) or when
+polars is upgraded (row hashes are only stable within one version).
+
+The manifest is written last, so an interrupted refresh is simply redone by
+the next run.
+
+usage (from the repository root):
+    python -m scripts.refresh [RAW_DIR] [CLEAN_DIR] [--since 2024-01-01] [--full]
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+import polars as pl
+
+from scripts import extract, imputation, pivots
+from scripts.extract import CLEAN_DIR, RAW_DIR
+from scripts.ingest import received_date
+
+MANIFEST = "_manifest.parquet"
+STATE = "_refresh.json"
+IMPUTERS = "imputers.joblib"
+
+KEY = "REPORT_ID"
+CHILDREN = extract.CHILDREN
+
+# pivot columns are counts; these are the columns of pivoted_full_data that are not
+NOT_COUNTS = (KEY, "AGE_Y", "WEIGHT_KG", "HEIGHT_CM", "GENDER_CODE")
+
+
+# ---------------- fingerprints ----------------
+def _row_hash(lf, seed):
+    # rows of one table hash with their own seed, so moving a row between tables changes the sum
+    return lf.select(KEY, pl.struct(pl.all()).hash(seed).alias("HASH"))
+
+
+def fingerprints(tables):
+    """
+    REPORT_ID, DATRECEIVED, HASH of the reports of an ``extract.plan``.  HASH
+    is the wrapping sum of the row hashes of the report and its child rows, so
+    it does not depend on row order.
+    """
+    reports = tables["reports_raw"]
+    fp = reports.select(KEY, received_date(pl.col("DATRECEIVED")).alias("DATRECEIVED"),
+                        pl.struct(pl.all()).hash(0).alias("HASH"))
+    for seed, name in enumerate(CHILDREN, 1):
+        child = _row_hash(tables[name], seed).group_by(KEY).agg(pl.col("HASH").sum().alias("_CHILD"))
+        fp = (fp.join(child, on=KEY, how="left")
+              .with_columns(pl.col("HASH") + pl.col("_CHILD").fill_null(0))
+              .drop("_CHILD"))
+    return fp.collect(engine="streaming").sort(KEY)
+
+
+def table_hash(lf):
+    """Order-independent hash of a whole table."""
+    return lf.select(pl.struct(pl.all()).hash(0).sum()).collect().item()
+
+
+# ---------------- notebook recipes ----------------
+def pivot_ingredients(report_drug, dpi):
+    """Per report, how many of its drugs contain each active ingredient (01 Pivots)."""
+    rd = report_drug.select(KEY, "DRUG_PRODUCT_ID").join(
+        dpi.select("DRUG_PRODUCT_ID", "ACTIVE_INGREDIENT_NAME"), on="DRUG_PRODUCT_ID")
+    if not rd.height:
+        return pl.DataFrame(schema={KEY: pl.Int64})
+    return (rd.pivot(on="ACTIVE_INGREDIENT_NAME", index=KEY, values="ACTIVE_INGREDIENT_NAME",
+                     aggregate_function="len")
+            .fill_null(0))
+
+
+def pivot_socs(reactions):
+    """1 where the report has a reaction in the SOC (01 Pivots)."""
+    socs = reactions.select(KEY, "SOC_NAME_ENG").with_columns(pl.lit(1).alias("value"))
+    if not socs.height:
+        return pl.DataFrame(schema={KEY: pl.Int64})
+    return socs.pivot(on="SOC_NAME_ENG", index=KEY, values="value", aggregate_function="max").fill_null(0)
+
+
+def full_data(short, ingredients, socs):
+    """pivoted_full_data: reports with numeric age and sex code, their ingredients and SOCs (01 Pivots)."""
+    reports = short.with_columns(
+        pl.col("AGE_Y").cast(pl.Float64, strict=False),
+        pl.when(pl.col("GENDER_ENG") == "Male").then(0).otherwise(1).alias("GENDER_CODE"),
+    ).drop("DATRECEIVED", "GENDER_ENG")
+    return reports.join(ingredients, on=KEY).join(socs, on=KEY)
+
+
+# ---------------- outputs ----------------
+def _write(df, path):
+    tmp = path + ".tmp"
+    df.write_parquet(tmp)
+    os.replace(tmp, path)
+
+
+def merge_rows(path, delta, drop_ids, counts=False):
+    """
+    Replace the rows of ``drop_ids`` in the Parquet file ``path`` with
+    ``delta``.  For pivots (``counts``) columns missing on either side are
+    zero and columns left all zero are dropped, as a rebuild would not have them.
+    """
+    if os.path.exists(path):
+        old = pl.read_parquet(path).filter(~pl.col(KEY).is_in(drop_ids[KEY].implode()))
+        merged = pl.concat([old, delta], how="diagonal_relaxed") if delta.height else old
+    else:
+        merged = delta
+    if counts:
+        value_cols = [c for c in merged.columns if c not in NOT_COUNTS]
+        merged = merged.with_columns(pl.col(value_cols).fill_null(0))
+        empty = [c for c in value_cols if not (merged[c] != 0).any()]
+        merged = merged.drop(empty)
+    merged = merged.sort(KEY, maintain_order=True)
+    _write(merged, path)
+    return merged
+
+
+def _load_state(clean_dir):
+    try:
+        with open(os.path.join(clean_dir, STATE), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_state(clean_dir, state):
+    path = os.path.join(clean_dir, STATE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+# ---------------- refresh ----------------
+def diff(manifest, current, ceph_ids):
+    """(new or changed ids, removed ids) of ``current`` fingerprints against the manifest."""
+    joined = current.join(manifest, on=KEY, how="left", suffix="_OLD")
+    delta = joined.filter(
+        pl.col("HASH_OLD").is_null()
+        | (pl.col("HASH") != pl.col("HASH_OLD"))
+        | pl.col("DATRECEIVED").ne_missing(pl.col("DATRECEIVED_OLD"))
+    ).select(KEY)
+    removed = manifest.join(ceph_ids, on=KEY, how="anti").select(KEY)
+    return delta, removed
+
+
+def refresh(raw_dir=RAW_DIR, clean_dir=CLEAN_DIR, since=None, full=False, log=sys.stderr):
+    """Bring ``clean_dir`` up to date with the ingested tables in ``raw_dir``; returns a summary dict."""
+    t0 = time.perf_counter()
+    os.makedirs(clean_dir, exist_ok=True)
+    manifest_path = os.path.join(clean_dir, MANIFEST)
+    state = _load_state(clean_dir)
+
+    dpi_hash = table_hash(extract.scan(raw_dir, "drug_product_ingredients"))
+    reasons = []
+    if full:
+        reasons.append("--full")
+    if not os.path.exists(manifest_path):
+        reasons.append("no manifest")
+    if state.get("polars") != pl.__version__:
+        reasons.append("polars version changed")
+    if state.get("dpi_hash") != dpi_hash:
+        reasons.append("drug_product_ingredients changed")
+    rebuild = bool(reasons)
+
+    if rebuild:
+        print(f"Full rebuild ({', '.join(reasons)})", file=log)
+        since = None
+    ceph_ids = extract.report_ids(raw_dir)
+    current = fingerprints(extract.plan(raw_dir, ceph_ids, since))
+    if rebuild:
+        manifest = current.clear()
+        delta, removed = current.select(KEY), current.clear().select(KEY)
+    else:
+        manifest = pl.read_parquet(manifest_path)
+        delta, removed = diff(manifest, current, ceph_ids)
+    print(f"{ceph_ids.height:,} cephalosporin reports: {delta.height:,} new or changed, "
+          f"{removed.height:,} removed", file=log)
+    if not rebuild and not delta.height and not removed.height:
+        return {"rebuild": False, "delta": 0, "removed": 0, "seconds": time.perf_counter() - t0}
+
+    drop_ids = pl.concat([delta, removed])
+    out = lambda name: os.path.join(clean_dir, name + ".parquet")
+    if rebuild:
+        # a rebuild replaces the outputs instead of merging into them
+        for name in ("reports_raw", "reports_short", *CHILDREN, "pivoted_active_ingredients",
+                     "pivoted_socs", "pivoted_full_data", "pivoted_full_data_imputed"):
+            if os.path.exists(out(name)):
+                os.remove(out(name))
+
+    # 1) cephalosporin tables (02_00 Cephalosporines Clean)
+    tables = extract.collect(extract.plan(raw_dir, delta, since))
+    dpi = tables.pop("drug_product_ingredients")
+    for name, df in tables.items():
+        merge_rows(out(name), df, drop_ids)
+    if rebuild:
+        _write(dpi, out("drug_product_ingredients"))
+
+    # 2) pivots (01 Pivots)
+    ingredients = pivot_ingredients(tables["report_drug"], dpi)
+    merge_rows(out("pivoted_active_ingredients"), ingredients, drop_ids, counts=True)
+    socs = pivot_socs(tables["reactions"])
+    soc_names = merge_rows(out("pivoted_socs"), socs, drop_ids, counts=True).drop(KEY).columns
+    delta_full = full_data(tables["reports_short"], ingredients, socs)
+    full = merge_rows(out("pivoted_full_data"), delta_full, drop_ids, counts=True)
+    # the same counts as sparse matrices, rebuilt from the merged tables (scripts.pivots)
+    pivots.build(clean_dir, log=log)
+
+    # 3) imputation (02 Imputation): fit on a rebuild, reuse the fitted forests otherwise
+    imputers_path = os.path.join(clean_dir, IMPUTERS)
+    imputers = None
+    if not rebuild and os.path.exists(imputers_path):
+        imputers = imputation.load(imputers_path)
+        if imputers.get("format") != imputation.FORMAT:
+            imputers = None  # saved by an older layout: refit on the whole table
+    if imputers is None:
+        print(f"Fitting imputers on {full.height:,} reports", file=log)
+        imputers, imputed = imputation.fit(full, exclude=soc_names)
+        imputation.save(imputers, imputers_path)
+        _write(imputed, out("pivoted_full_data_imputed"))
+    else:
+        imputed = imputation.transform(delta_full, imputers)
+        merge_rows(out("pivoted_full_data_imputed"), imputed, drop_ids, counts=True)
+
+    # 4) manifest last: a refresh that dies before this point is redone next time
+    manifest = pl.concat([manifest.join(drop_ids, on=KEY, how="anti"),
+                          current.join(delta, on=KEY, how="semi")]).sort(KEY)
+    _write(manifest, manifest_path)
+    _save_state(clean_dir, {
+        "polars": pl.__version__,
+        "dpi_hash": dpi_hash,
+        "refreshed": datetime.datetime.now().isoformat(timespec="seconds"),
+        "reports": manifest.height,
+    })
+    dt = time.perf_counter() - t0
+    print(f"Refreshed {clean_dir} in {dt:.1f}s ({manifest.height:,} reports)", file=log)
+    return {"rebuild": rebuild, "delta": delta.height, "removed": removed.height, "seconds": dt}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Incrementally refresh data/cephalosporines_clean from an ingested extract.")
+    ap.add_argument("raw_dir", nargs="?", default=RAW_DIR, help="output folder of scripts.ingest")
+    ap.add_argument("clean_dir", nargs="?", default=CLEAN_DIR, help="folder with the cephalosporin tables")
+    ap.add_argument("--since", type=datetime.date.fromisoformat, default=None,
+                    help="only look for changes in reports received on or after this date (YYYY-MM-DD)")
+    ap.add_argument("--full", action="store_true", help="rebuild everything and refit the imputers")
+    args = ap.parse_args(argv)
+    refresh(args.raw_dir, args.clean_dir, args.since, args.full)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the app modules are flat imports run from interface/ (``import scoring``)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "interface"))
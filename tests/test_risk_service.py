@@ -0,0 +1,122 @@
+"""The overall risk is computed once per (sex, generation, age, data version)."""
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import scoring
+from med_matcher import MedMatcher
+from scoring import RiskService
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Replace scoring.overall_percentage with a counting stand-in; returns its call list."""
+    seen = []
+
+    def counting(dfs, risk_table, sex, generation, age):
+        seen.append((sex, generation, age))
+        return 12.5
+
+    monkeypatch.setattr(scoring, "overall_percentage", counting)
+    return seen
+
+
+def test_same_key_computed_once(calls):
+    risk = RiskService({}, SimpleNamespace(data_hash="v1"))
+    assert risk.percentage("Male", "2/3 gen", 40) == 12.5
+    assert risk.percentage("Male", "2/3 gen", 40) == 12.5
+    assert len(calls) == 1
+    assert (risk.computations, risk.hits) == (1, 1)
+
+
+def test_other_key_computed(calls):
+    risk = RiskService({}, SimpleNamespace(data_hash="v1"))
+    risk.percentage("Male", "2/3 gen", 40)
+    risk.percentage("Female", "2/3 gen", 40)
+    risk.percentage("Male", "4/5 gen", 40)
+    risk.percentage("Male", "1st gen", 40)
+    risk.percentage("Male", "2/3 gen", 41)
+    assert len(calls) == 5
+
+
+@pytest.mark.parametrize("ceph, generation", [
+    ("ceftriaxone", "2/3 gen"), ("Ceftriaxone", "2/3 gen"), (" CEFEPIME ", "4/5 gen"),
+    ("cefazolin", "1st gen"), ("", "1st gen"), (None, "1st gen"),
+])
+def test_generation_for(ceph, generation):
+    assert scoring.generation_for(ceph) == generation
+
+
+def test_new_data_version_recomputes(calls):
+    risk = RiskService({}, SimpleNamespace(data_hash="v1"))
+    risk.percentage("Male", "2/3 gen", 40)
+    risk.reload({}, SimpleNamespace(data_hash="v2"))
+    risk.percentage("Male", "2/3 gen", 40)
+    assert len(calls) == 2
+    assert risk.data_version == "v2"
+
+
+def test_explicit_data_version_recomputes(calls):
+    table = SimpleNamespace(data_hash="v1")
+    risk = RiskService({}, table)
+    risk.percentage("Male", "2/3 gen", 40)
+    risk.reload({}, table, data_version="v1-refreshed")
+    risk.percentage("Male", "2/3 gen", 40)
+    risk.percentage("Male", "2/3 gen", 40)
+    assert len(calls) == 2
+
+
+def test_least_recently_used_evicted(calls):
+    risk = RiskService({}, SimpleNamespace(data_hash="v1"), maxsize=2)
+    for age in (40, 41, 40, 42):  # 41 is the least recently used when 42 comes in
+        risk.percentage("Male", "2/3 gen", age)
+    risk.percentage("Male", "2/3 gen", 40)
+    assert len(calls) == 3
+    risk.percentage("Male", "1st gen", 40)
+    risk.percentage("Male", "2/3 gen", 41)
+    assert len(calls) == 5
+
+
+class _Job:
+    def report(self, percent, stage):
+        pass
+
+    def check(self):
+        pass
+
+
+def _window():
+    """The prediction path of CephaloPredictor on a plain object (no widgets, no model files)."""
+    interface = pytest.importorskip("interface")
+    cls = interface.CephaloPredictor
+
+    class Window:
+        _predict = cls._predict
+        ensure_ready = cls.ensure_ready
+        compute_overall_probability = cls.compute_overall_probability
+        probability_model = cls.probability_model
+        parse_med_input_to_vector = cls.parse_med_input_to_vector
+
+    window = Window()
+    window._ready = threading.Event()
+    window._ready.set()
+    window.engine = None
+    window.med_matcher = MedMatcher(["AGE_Y", "furosemide"])
+    window.risk = RiskService({}, SimpleNamespace(data_hash="v1"))
+    return window
+
+
+def test_prediction_computes_overall_once(calls):
+    pytest.importorskip("PyQt5")
+    window = _window()
+    inputs = {"age": 40, "sex": "Male", "weight": 80.0, "height": 180.0, "ceph": "ceftriaxone",
+              "med_text": "furosemide"}
+    first = window._predict(_Job(), inputs)
+    second = window._predict(_Job(), inputs)
+    assert first["overall_percentage"] == second["overall_percentage"] == 12.5
+    assert calls == [("Male", "2/3 gen", 40)]
+
+    window.risk.reload({}, SimpleNamespace(data_hash="v2"))
+    window._predict(_Job(), inputs)
+    assert len(calls) == 2